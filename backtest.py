@@ -0,0 +1,204 @@
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from fetching import call_with_retry, fetch_concurrently
+from indicators import classify_status, compute_indicators
+from instrumentation import span
+from providers import get_provider
+from screener import read_universe
+
+# The app downloads a year of daily bars, so the recent high and low are taken over this window
+LOOKBACK_DAYS = 365
+HORIZONS = (1, 5, 20, 60)
+STATUSES = ('CLEAR', 'CAUTION', 'AVOID', '')
+CHUNK = 100  # tickers per vectorized pass, to bound memory on long histories
+
+
+def window_starts(dates, days=LOOKBACK_DAYS):
+    # First column inside the lookback window that ends at each column
+    return np.searchsorted(dates, dates - np.timedelta64(days, 'D'), side='right')
+
+
+def rolling_extreme_index(values, starts, largest=True):
+    # Column of the max (or min) of values[:, starts[t]:t + 1] for every t, the first one on ties
+    # as nanargmax picks, via a sparse table: level k holds the winner of each span of 2**k
+    # columns, and any window is covered by two overlapping spans of the same level. Levels are
+    # built one at a time and discarded once the windows that need them are answered
+    n, length = values.shape
+    filled = np.where(np.isnan(values), -np.inf if largest else np.inf, values)
+    sign = 1.0 if largest else -1.0
+    rows = np.arange(n)[:, None]
+    columns = np.arange(length)
+    size = columns - starts + 1
+    level_of = np.floor(np.log2(size)).astype(np.int64)
+    result = np.empty((n, length), dtype=np.int64)
+
+    def pick(a, b):
+        # Left wins ties so the earliest extreme is kept
+        return np.where(sign * filled[rows, b] > sign * filled[rows, a], b, a)
+
+    best = np.broadcast_to(columns, (n, length)).copy()
+    for k in range(level_of.max() + 1):
+        if k:
+            half = 1 << (k - 1)
+            shifted = np.concatenate([best[:, half:], best[:, -1:].repeat(half, axis=1)], axis=1)
+            best = pick(best, shifted)
+        at = np.nonzero(level_of == k)[0]
+        if at.size:
+            result[:, at] = pick(best[:, starts[at]], best[:, at - (1 << k) + 1])
+    seen = np.isfinite(filled[rows, result])
+    return np.where(seen, result, -1)
+
+
+def year_start_anchors(dates):
+    # First column of each column's calendar year
+    years = dates.astype('datetime64[Y]')
+    return np.searchsorted(dates, years.astype('datetime64[ns]'), side='left')
+
+
+def earnings_anchors(dates, earnings_dates):
+    # The earnings anchor the app would have used at each day's close: the column of the latest
+    # report released by then, or -1 when that report came after the day's bar (as the app does
+    # for an after-the-close report on the day itself) or there is none
+    anchors = np.full(len(dates), -1, dtype=np.int64)
+    if earnings_dates is None or len(earnings_dates) == 0:
+        return anchors
+    reports = np.sort(np.asarray(earnings_dates, dtype='datetime64[ns]'))
+    close_times = dates + np.timedelta64(16, 'h')
+    latest = np.searchsorted(reports, close_times, side='right') - 1
+    known = latest >= 0
+    last_report = reports[np.clip(latest, 0, None)]
+    known &= last_report <= dates
+    anchors[known] = np.searchsorted(dates, last_report[known], side='left')
+    return anchors
+
+
+def status_series(close, volume, dates, earnings_dates):
+    # AVOID/CAUTION/CLEAR for every ticker and day at once, as the app would have shown it at each
+    # day's close, as a (tickers x days) array
+    n, length = close.shape
+    starts = window_starts(dates)
+    t = np.arange(length)
+    anchors = {
+        'YearStart': np.broadcast_to(year_start_anchors(dates), (n, length)),
+        'RecentHigh': rolling_extreme_index(close, starts, largest=True),
+        'RecentLow': rolling_extreme_index(close, starts, largest=False),
+        'Earnings': np.stack([earnings_anchors(dates, e) for e in earnings_dates]),
+    }
+    # Each day's values and the previous day's, both with that day's anchors
+    last = compute_indicators(close, volume, anchors, t)
+    prev = compute_indicators(close, volume, anchors, t - 1)
+    ind = {key: np.stack([prev[key].ravel(), last[key].ravel()], axis=1) for key in last}
+    has_earnings = anchors['Earnings'] >= 0
+    status = classify_status(close.ravel(), ind, has_earnings.ravel()).reshape(n, length)
+    return np.where(np.isnan(close), '', status)
+
+
+def forward_returns(close, horizon):
+    returns = np.full(close.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns[:, :-horizon] = close[:, horizon:] / close[:, :-horizon] - 1
+    return returns
+
+
+def forward_return_stats(close, status, horizons=HORIZONS):
+    # Forward returns after each day, grouped by the status shown that day
+    rows = []
+    for horizon in horizons:
+        returns = forward_returns(close, horizon)
+        for name in STATUSES + ('ALL',):
+            mask = ~np.isnan(returns) if name == 'ALL' else ~np.isnan(returns) & (status == name)
+            values = returns[mask]
+            rows.append({
+                'status': name or 'NONE',
+                'horizon': horizon,
+                'count': int(values.size),
+                'mean': values.mean() if values.size else np.nan,
+                'median': np.median(values) if values.size else np.nan,
+                'std': values.std() if values.size else np.nan,
+                'hit_rate': (values > 0).mean() if values.size else np.nan,
+            })
+    stats = pd.DataFrame(rows)
+    overall = stats[stats['status'] == 'ALL'].set_index('horizon')['mean']
+    stats['excess_mean'] = stats['mean'] - stats['horizon'].map(overall)
+    return stats
+
+
+def load(tickers, years, provider=None):
+    # Daily bars on the union of all trading calendars (NaN where a ticker has no bar) and each
+    # ticker's earnings report dates. Yahoo lists only a limited number of past reports, so days
+    # before the earliest one known have no earnings anchor, as in the app
+    provider = provider or get_provider()
+    end = datetime.now()
+    start = end - timedelta(days=int(365.25 * years) + LOOKBACK_DAYS)
+    with span('download_daily'):
+        frames = call_with_retry(provider.history, tickers, start, end)
+    tickers = [ticker for ticker in tickers if ticker in frames and not frames[ticker].empty]
+    close = pd.DataFrame({ticker: frames[ticker]['Close'] for ticker in tickers}).sort_index()
+    volume = pd.DataFrame({ticker: frames[ticker]['Volume'] for ticker in tickers}).reindex(close.index)
+
+    def report_dates(ticker):
+        info = provider.ticker(ticker)
+        # yfinance returns 12 reports by default; ask for as many as it will give
+        getter = getattr(info, 'get_earnings_dates', None)
+        dates = getter(limit=100) if getter else info.earnings_dates
+        if dates is None or dates.empty:
+            return []
+        index = pd.to_datetime(dates.index)
+        return index.tz_localize(None) if index.tz is not None else index
+
+    earnings = {}
+    for ticker, result, error in fetch_concurrently(report_dates, tickers):
+        earnings[ticker] = [] if error is not None else result
+    return tickers, close, volume, [earnings[ticker] for ticker in tickers]
+
+
+def run(tickers, years=10, horizons=HORIZONS, provider=None):
+    started = time.monotonic()
+    tickers, close_frame, volume_frame, earnings = load(tickers, years, provider)
+    loaded = time.monotonic()
+    dates = close_frame.index.to_numpy(dtype='datetime64[ns]')
+    close = close_frame.to_numpy(dtype=float).T
+    volume = volume_frame.to_numpy(dtype=float).T
+
+    status = np.empty(close.shape, dtype=object)
+    with span('backtest'):
+        for lo in range(0, len(tickers), CHUNK):
+            hi = lo + CHUNK
+            status[lo:hi] = status_series(close[lo:hi], volume[lo:hi], dates, earnings[lo:hi])
+
+    # Days inside the first lookback window only have part of the history the app would have had
+    warm = dates >= dates[0] + np.timedelta64(LOOKBACK_DAYS, 'D')
+    stats = forward_return_stats(close[:, warm], status[:, warm], horizons)
+    print(f"{len(tickers)} TICKERS x {int(warm.sum())} DAYS: LOADED IN {loaded - started:.1f}s, "
+          f"BACKTESTED IN {time.monotonic() - loaded:.1f}s", file=sys.stderr)
+    series = pd.DataFrame(status[:, warm].T, index=close_frame.index[warm], columns=tickers)
+    return stats, series
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest the Skyhook status signal over a universe file")
+    parser.add_argument('universe', help="file with one or more symbols per line")
+    parser.add_argument('--years', type=float, default=10, help="years of signal history (default: 10)")
+    parser.add_argument('--horizons', type=int, nargs='+', default=list(HORIZONS),
+                        help="forward return horizons in trading days")
+    parser.add_argument('-o', '--output', default=None, help="write the statistics as CSV")
+    parser.add_argument('--series', default=None, help="write the daily status of every ticker as Parquet")
+    args = parser.parse_args(argv)
+
+    stats, series = run(read_universe(args.universe), args.years, args.horizons)
+    with pd.option_context('display.max_rows', None, 'display.width', 120, 'display.float_format', '{:.4f}'.format):
+        print(stats.to_string(index=False))
+    if args.output:
+        stats.to_csv(args.output, index=False)
+    if args.series:
+        series.to_parquet(args.series)
+
+
+if __name__ == "__main__":
+    main()
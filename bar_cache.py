@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pandas as pd
+
+import config
+from providers import MarketDataProvider
+
+
+class SharedHistoryProvider(MarketDataProvider):
+    # Wraps another provider and keeps the bars it returns in memory for `ttl` seconds, shared by
+    # every session in the process, so that symbols in both the regime panel and a watchlist (or
+    # in several sessions' watchlists) are downloaded once. Only the symbols without fresh bars
+    # covering the requested start go upstream, in a single batch
+    def __init__(self, inner, ttl=None):
+        self.inner = inner
+        self.download_lock = inner.download_lock
+        self.ttl = config.BAR_CACHE_TTL if ttl is None else ttl
+        self.lock = threading.Lock()
+        self.frames = {}  # (ticker, interval) -> (frame, covered_from, fetched)
+
+    def history(self, tickers, start, end, interval='1d'):
+        # Entries are taken to reach the present, which holds for the daily bars up to now but not
+        # for the windowed minute bars the minute store asks for
+        if interval != '1d':
+            return self.inner.history(tickers, start, end, interval)
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        tickers = list(dict.fromkeys(tickers))
+        now = time.monotonic()
+
+        frames = {}
+        with self.lock:
+            for ticker in tickers:
+                entry = self.frames.get((ticker, interval))
+                if entry is not None and now - entry[2] < self.ttl and entry[1] <= start:
+                    frames[ticker] = entry[0]
+        missing = [ticker for ticker in tickers if ticker not in frames]
+
+        if missing:
+            fresh = self.inner.history(missing, start, end, interval)
+            fetched = time.monotonic()
+            with self.lock:
+                # Drop whatever has expired while storing the new bars
+                self.frames = {key: entry for key, entry in self.frames.items() if fetched - entry[2] < self.ttl}
+                for ticker, frame in fresh.items():
+                    self.frames[(ticker, interval)] = (frame, start, fetched)
+            frames.update(fresh)
+
+        return {
+            ticker: frames[ticker][(frames[ticker].index >= start) & (frames[ticker].index < end)]
+            for ticker in tickers if ticker in frames
+        }
+
+    def clear(self):
+        with self.lock:
+            self.frames = {}
+
+    def intraday(self, tickers):
+        return self.inner.intraday(tickers)
+
+    def intraday_since(self, tickers, since):
+        return self.inner.intraday_since(tickers, since)
+
+    def ticker(self, symbol):
+        return self.inner.ticker(symbol)
+
+    def market_cap(self, symbol):
+        return self.inner.market_cap(symbol)
+
+    def quotes(self, tickers):
+        return self.inner.quotes(tickers)
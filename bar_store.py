@@ -0,0 +1,155 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+from providers import MarketDataProvider
+from storage import read_frame, replacing, write_frame
+
+# Relative difference between a stored and a refetched bar that we treat as a split/dividend adjustment
+ADJUSTMENT_TOLERANCE = 1e-6
+PRICE_COLUMNS = ('Close', 'Adj Close')
+
+
+class BarStore:
+    # On-disk OHLCV bars per (interval, symbol) under <root>/<interval>/<SYMBOL>.parquet, each with
+    # a small <SYMBOL>.json next to it recording the earliest date the symbol has been fetched from,
+    # so that symbols listed after the requested start are not refetched in full every time. Every
+    # file belongs to one symbol and is replaced atomically, so stores in other threads and
+    # processes (the screener's workers) writing other symbols never touch it
+    def __init__(self, root=None):
+        self.root = root or os.path.join(config.DATA_DIR, 'bars')
+
+    def _base(self, symbol, interval):
+        return os.path.join(self.root, interval, symbol)
+
+    def _meta_path(self, symbol, interval):
+        return self._base(symbol, interval) + '.json'
+
+    def _read_meta(self, symbol, interval):
+        try:
+            with open(self._meta_path(symbol, interval)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        # Stores written before the per-symbol files kept one index.json per interval
+        try:
+            with open(os.path.join(self.root, interval, 'index.json')) as f:
+                start = json.load(f).get(symbol)
+        except (OSError, ValueError):
+            return {}
+        return {'covered_from': start} if start else {}
+
+    def load(self, symbol, interval='1d'):
+        frame = read_frame(self._base(symbol, interval))
+        if frame is None or frame.empty:
+            return None
+        return frame
+
+    def covered_from(self, symbol, interval='1d'):
+        start = self._read_meta(symbol, interval).get('covered_from')
+        return pd.Timestamp(start) if start else None
+
+    def save(self, symbol, frame, interval='1d', covered_from=None):
+        write_frame(frame, self._base(symbol, interval))
+        if covered_from is not None:
+            with replacing(self._meta_path(symbol, interval)) as tmp_path, open(tmp_path, 'w') as f:
+                json.dump({'covered_from': pd.Timestamp(covered_from).isoformat()}, f)
+
+    def merge(self, symbol, fresh, interval='1d'):
+        # Fresh bars win on overlapping dates so that a partial last session gets completed
+        stored = self.load(symbol, interval)
+        if stored is None:
+            merged = fresh
+        else:
+            merged = pd.concat([stored[~stored.index.isin(fresh.index)], fresh]).sort_index()
+        self.save(symbol, merged, interval)
+        return merged
+
+
+def is_adjusted(stored, fresh):
+    # Compares the bars both frames share, except the newest stored bar which may have been
+    # captured mid-session; any price change there means history was split/dividend adjusted
+    overlap = stored.index[:-1].intersection(fresh.index)
+    if overlap.empty:
+        return False
+    for col in PRICE_COLUMNS:
+        if col in stored.columns and col in fresh.columns:
+            old = stored.loc[overlap, col].to_numpy(dtype=float)
+            new = fresh.loc[overlap, col].to_numpy(dtype=float)
+            if not np.allclose(old, new, rtol=ADJUSTMENT_TOLERANCE, atol=0, equal_nan=True):
+                return True
+    return False
+
+
+class StoredHistoryProvider(MarketDataProvider):
+    # Wraps another provider so daily history is served from a BarStore and only the bars after
+    # the last stored one are downloaded; everything else is passed straight through
+    def __init__(self, inner, store=None, interval='1d'):
+        self.inner = inner
+        self.download_lock = inner.download_lock
+        self.store = store or BarStore()
+        self.interval = interval
+
+    def history(self, tickers, start, end, interval='1d'):
+        if interval != self.interval:
+            return self.inner.history(tickers, start, end, interval)
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        tickers = list(dict.fromkeys(tickers))
+
+        stored = {}
+        full = []
+        incremental = []
+        for ticker in tickers:
+            frame = self.store.load(ticker, interval)
+            covered_from = self.store.covered_from(ticker, interval)
+            if frame is None or covered_from is None or covered_from > start:
+                full.append(ticker)
+            else:
+                stored[ticker] = frame
+                incremental.append(ticker)
+
+        # One download for every symbol with usable history, starting at the earliest second-to-last
+        # stored bar so there is a complete bar to compare against for split/dividend detection
+        if incremental:
+            fetch_from = min(stored[t].index[max(len(stored[t]) - 2, 0)] for t in incremental)
+            fresh = self.inner.history(incremental, fetch_from, end, interval)
+            for ticker in incremental:
+                if ticker not in fresh:
+                    continue
+                if is_adjusted(stored[ticker], fresh[ticker]):
+                    full.append(ticker)
+                else:
+                    stored[ticker] = self.store.merge(ticker, fresh[ticker], interval)
+
+        if full:
+            stored.update(self.repair(full, start, end, interval))
+
+        return {
+            ticker: stored[ticker][(stored[ticker].index >= start) & (stored[ticker].index < end)]
+            for ticker in tickers if ticker in stored
+        }
+
+    def repair(self, tickers, start, end, interval='1d'):
+        # Refetches the whole window and replaces what is stored, e.g. after a split or dividend
+        fresh = self.inner.history(tickers, start, end, interval)
+        for ticker, frame in fresh.items():
+            self.store.save(ticker, frame, interval, covered_from=start)
+        return fresh
+
+    def intraday(self, tickers):
+        return self.inner.intraday(tickers)
+
+    def intraday_since(self, tickers, since):
+        return self.inner.intraday_since(tickers, since)
+
+    def ticker(self, symbol):
+        return self.inner.ticker(symbol)
+
+    def market_cap(self, symbol):
+        return self.inner.market_cap(symbol)
+
+    def quotes(self, tickers):
+        return self.inner.quotes(tickers)
@@ -0,0 +1,251 @@
+# Load test for one Skyhook process serving many sessions. Each simulated session reruns the page
+# the way main() does (regime header, cached rows, streamed fetch, table rebuilds) for its own
+# watchlist, against SyntheticProvider standing in for Yahoo behind the real provider stack.
+# Concurrency is stepped up and each level starts from cold caches.
+#
+# SyntheticProvider is safe to call from any number of threads, which yf.download is not, so by
+# default the run says nothing about concurrency bugs in YFinanceProvider and its throughput is
+# not what the yfinance upstream would reach. --upstream yfinance runs bar downloads through the
+# real YFinanceProvider and yf.download with the network stubbed out. Frames a download loses show
+# up as errors and frames that come back with another symbol's or interval's bars are counted as
+# mismatched; --no-download-lock drops YFinanceProvider's download lock to show the failures it
+# prevents. Run from the repo root:
+#
+#     python -m benchmarks.load                                   # 1..32 sessions, 20 ms upstream
+#     python -m benchmarks.load --sessions 8 64 --latency 0.2 --error-rate 0.02 -o load.json
+#     python -m benchmarks.load --upstream yfinance --sessions 8
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import config
+import fetching
+import fundamentals_store
+import minute_store
+import pipeline
+import prefetch
+import providers
+from benchmarks.synthetic import StubbedYahooProvider, SyntheticProvider, symbols
+
+SESSIONS = (1, 2, 4, 8, 16, 32)
+# Config paths under the data directory, pointed into the run's temporary directory and restored after
+PATHS = ('DATA_DIR', 'SNAPSHOT_DIR', 'METRICS_PATH', 'MINUTE_DIR', 'WATCHLISTS_PATH')
+
+
+def watchlists(rng, count, universe, mean_size):
+    # Ticker lists as a desk keeps them: sizes spread around `mean_size`, and a few popular names
+    # (Zipf-weighted) on most of them, so sessions overlap the way real ones do
+    names = np.array(symbols(universe))
+    weights = 1 / np.arange(1, universe + 1)
+    weights /= weights.sum()
+    sizes = np.clip(rng.poisson(mean_size, count), 1, universe)
+    return [names[rng.choice(universe, size, replace=False, p=weights)].tolist() for size in sizes]
+
+
+def rerun(tickers):
+    # One page load minus Streamlit: the regime header, the rows the shared cache still has, the
+    # rest streamed in with the table rebuilt at most every RENDER_INTERVAL seconds, and a final
+    # rebuild. Returns the tickers that errored and how many rows came back late
+    from main import create_table
+
+    pipeline.get_vix_data()
+    cached, missing = {}, tickers
+    if config.PREFETCH:
+        cached, missing, _ = prefetch.get_cache().lookup(tickers)
+    data = dict(cached)
+    errors = {}
+    last_render = 0.0
+    for rows, batch_errors in pipeline.iter_stock_data(missing, flush_interval=config.RENDER_INTERVAL / 2):
+        data.update(rows)
+        errors.update(batch_errors)
+        if rows and time.monotonic() - last_render >= config.RENDER_INTERVAL:
+            create_table(data, 0, config.TABLE_PAGE_SIZE)
+            last_render = time.monotonic()
+    if data:
+        create_table(data, 0, config.TABLE_PAGE_SIZE)
+    if config.PREFETCH:
+        prefetch.get_cache().update({t: data[t] for t in missing if t in data})
+    return errors, sum(1 for row in data.values() if row.get('late'))
+
+
+class Session(threading.Thread):
+    # Reruns its watchlist until `stop`, pausing an exponentially distributed think time between
+    # reruns; now and then the watchlist is edited, which is when the cached rows stop covering it
+    def __init__(self, index, tickers, universe, args, stop):
+        super().__init__(name=f'session-{index}', daemon=True)
+        self.rng = np.random.default_rng([args.seed, index])
+        self.tickers = tickers
+        self.universe = universe
+        self.args = args
+        self.stop = stop
+        self.results = []  # (seconds, tickers, errored tickers, late rows, failed)
+
+    def run(self):
+        while not self.stop.is_set():
+            if self.results and self.rng.random() < self.args.edit_rate:
+                self.tickers = self.tickers[1:] + [self.universe[self.rng.integers(len(self.universe))]]
+            started = time.perf_counter()
+            try:
+                errors, late = rerun(self.tickers)
+                self.results.append((time.perf_counter() - started, len(self.tickers), len(errors), late, False))
+            except Exception:
+                self.results.append((time.perf_counter() - started, len(self.tickers), len(self.tickers), 0, True))
+            if self.args.think > 0:
+                self.stop.wait(self.rng.exponential(self.args.think))
+
+
+def memory_mb():
+    # Resident set size now, from /proc where there is one, and the process peak so far
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, peak
+    except OSError:
+        return peak, peak
+
+
+def reset(provider, upstream, data_dir):
+    # Cold caches for the next level: stores in a fresh directory and new shared layers in front
+    # of the same upstream, with the synthetic request counts zeroed. Every path config derived
+    # from the data directory at import is moved too, so the run never writes synthetic regime
+    # snapshots or metrics over the real ones
+    config.DATA_DIR = data_dir
+    config.SNAPSHOT_DIR = os.path.join(data_dir, 'snapshot')
+    config.METRICS_PATH = os.path.join(data_dir, 'metrics.prom')
+    config.MINUTE_DIR = os.path.join(data_dir, 'minutes')
+    config.WATCHLISTS_PATH = os.path.join(data_dir, 'watchlists.txt')
+    fundamentals_store._store = None
+    minute_store._store = None
+    prefetch._cache = prefetch.RowCache()
+    pipeline._regime = None
+    fetching._deadlines = None
+    with provider.lock:
+        provider.calls = {}
+    providers.set_provider(providers.wrap_provider(upstream, store_bars=True))
+
+
+def run_level(sessions, provider, upstream, lists, universe, args, data_dir):
+    reset(provider, upstream, data_dir)
+    stop = threading.Event()
+    threads = [Session(i, lists[i % len(lists)], universe, args, stop) for i in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(args.duration)
+    stop.set()
+    # Reruns in progress are allowed to finish and are counted
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    results = [r for thread in threads for r in thread.results]
+    seconds = np.array([r[0] for r in results]) if results else np.array([np.nan])
+    rows = sum(r[1] for r in results)
+    rss, peak = memory_mb()
+    with provider.lock:
+        calls = dict(provider.calls)
+    mismatched = calls.pop('mismatched', 0)
+    return {
+        'sessions': sessions,
+        'reruns': len(results),
+        'seconds': elapsed,
+        'reruns_per_second': len(results) / elapsed,
+        'rows_per_second': rows / elapsed,
+        'p50_ms': float(np.percentile(seconds, 50) * 1e3),
+        'p90_ms': float(np.percentile(seconds, 90) * 1e3),
+        'p99_ms': float(np.percentile(seconds, 99) * 1e3),
+        'max_ms': float(np.max(seconds) * 1e3),
+        'failed_reruns': sum(1 for r in results if r[4]),
+        'ticker_error_rate': sum(r[2] for r in results) / rows if rows else 0.0,
+        'late_row_rate': sum(r[3] for r in results) / rows if rows else 0.0,
+        'mismatched_frames': mismatched,
+        'upstream_calls': calls,
+        'upstream_calls_per_rerun': sum(calls.values()) / len(results) if results else 0.0,
+        'rss_mb': rss,
+        'peak_rss_mb': peak,
+    }
+
+
+def run(args):
+    config.RATE_LIMIT = args.rate_limit if args.rate_limit is not None else config.RATE_LIMIT
+    config.RATE_BURST = max(config.RATE_BURST, config.RATE_LIMIT)
+    provider = SyntheticProvider(seed=args.seed, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    universe = symbols(args.universe)
+    lists = watchlists(np.random.default_rng(args.seed), max(args.sessions), args.universe, args.watchlist)
+    levels = []
+    print(f"{'sessions':>8} {'reruns':>7} {'rerun/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+          f"{'max ms':>9} {'errors':>7} {'late':>6} {'mismatch':>8} {'calls/rerun':>11} {'rss MB':>8}",
+          file=sys.stderr)
+    saved = {name: getattr(config, name) for name in PATHS}
+    with tempfile.TemporaryDirectory() as root:
+        upstream = provider
+        if args.upstream == 'yfinance':
+            upstream = StubbedYahooProvider(provider, lock=not args.no_download_lock, tz_cache=os.path.join(root, 'tz'))
+        try:
+            for sessions in args.sessions:
+                level = run_level(sessions, provider, upstream, lists, universe, args,
+                                  os.path.join(root, f'level-{sessions}'))
+                levels.append(level)
+                print(f"{sessions:>8} {level['reruns']:>7} {level['reruns_per_second']:>8.2f} {level['p50_ms']:>9.0f} "
+                      f"{level['p90_ms']:>9.0f} {level['p99_ms']:>9.0f} {level['max_ms']:>9.0f} "
+                      f"{level['ticker_error_rate']:>7.1%} {level['late_row_rate']:>6.1%} "
+                      f"{level['mismatched_frames']:>8} {level['upstream_calls_per_rerun']:>11.1f} "
+                      f"{level['rss_mb']:>8.0f}", file=sys.stderr)
+        finally:
+            for name, value in saved.items():
+                setattr(config, name, value)
+            fundamentals_store._store = None
+            minute_store._store = None
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+            'rate_limit': config.RATE_LIMIT,
+            'fetch_workers': config.FETCH_WORKERS,
+        },
+        'levels': levels,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test Skyhook with concurrent simulated sessions")
+    parser.add_argument('--sessions', type=int, nargs='+', default=list(SESSIONS), help="concurrency levels")
+    parser.add_argument('--duration', type=float, default=20, help="seconds per level")
+    parser.add_argument('--think', type=float, default=2, help="mean seconds between a session's reruns")
+    parser.add_argument('--edit-rate', type=float, default=0.2, help="chance a rerun follows a watchlist edit")
+    parser.add_argument('--watchlist', type=int, default=25, help="mean tickers per watchlist")
+    parser.add_argument('--universe', type=int, default=1000, help="symbols the watchlists draw from")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds per upstream request")
+    parser.add_argument('--jitter', type=float, default=0.5, help="lognormal sigma of the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="chance an upstream request fails")
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help="upstream requests per second (default: SKYHOOK_RATE_LIMIT)")
+    parser.add_argument('--upstream', choices=['synthetic', 'yfinance'], default='synthetic',
+                        help="serve bars from SyntheticProvider or through yf.download with the network stubbed")
+    parser.add_argument('--no-download-lock', action='store_true',
+                        help="with --upstream yfinance, let downloads overlap")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help="write results as JSON")
+    args = parser.parse_args(argv)
+    args.sessions = sorted(set(args.sessions))
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
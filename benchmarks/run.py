@@ -0,0 +1,194 @@
+# Offline benchmarks for the Skyhook data path on synthetic market data. Run from the repo root:
+#
+#     python -m benchmarks.run -o bench.json                    # all stages, 10..10,000 tickers
+#     python -m benchmarks.run --baseline bench.json            # compare, exit 1 on regressions
+#     python -m benchmarks.run --sizes 100 --stages rows table  # a subset
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import config
+import fundamentals_store
+import pipeline
+import providers
+from benchmarks.synthetic import SyntheticProvider, symbols
+from indicators import anchor_indices, classify_status, compute_indicators, stack_histories, trend
+
+SIZES = (10, 100, 1000, 10000)
+STAGES = ('indicators', 'status', 'rows', 'table', 'vix', 'pipeline')
+
+
+class Workload:
+    # Everything a stage needs for N tickers, prepared outside the timed region
+    def __init__(self, provider, n, store_dir):
+        self.provider = provider
+        self.tickers = symbols(n)
+        self.store_dir = store_dir
+        self.stores = 0
+        self.history = pipeline.download_batch(self.tickers)
+        store = self.new_store()
+        self.fundamentals = {
+            ticker: fundamentals_store.get_fundamentals(ticker, provider, store)
+            for ticker in self.tickers
+        }
+        self.frames = [self.history[t][0] for t in self.tickers]
+        self.close, self.volume, self.offsets = stack_histories(self.frames)
+        self.anchors = self.anchor()
+        self.ind = compute_indicators(self.close, self.volume, self.anchors)
+        self.price = np.array([self.history[t][1]['Close'].iloc[-1] for t in self.tickers])
+        self.rows = pipeline.compute_rows(self.history, self.fundamentals)
+
+    def new_store(self):
+        self.stores += 1
+        path = os.path.join(self.store_dir, f'fundamentals-{len(self.tickers)}-{self.stores}.sqlite')
+        return fundamentals_store.FundamentalsStore(path)
+
+    def anchor(self):
+        year_start = pd.Timestamp(f'{datetime.now().year}-01-01')
+        earnings = [self.fundamentals[t]['last_earnings_date'] for t in self.tickers]
+        return anchor_indices(self.frames, self.offsets, self.close.shape[1], year_start, earnings)
+
+    def indicators(self):
+        close, volume, _ = stack_histories(self.frames)
+        compute_indicators(close, volume, self.anchor())
+
+    def status(self):
+        classify_status(self.price, self.ind, self.anchors['Earnings'] >= 0)
+        for values in self.ind.values():
+            trend(values)
+
+    def compute_rows(self):
+        pipeline.compute_rows(self.history, self.fundamentals)
+
+    def table(self):
+        from main import create_table
+        create_table(self.rows)
+
+    def vix(self):
+        # The uncached computation; get_vix_data would only measure a cache hit
+        with contextlib.redirect_stdout(io.StringIO()):
+            pipeline.compute_regime()
+
+    def full_pipeline(self):
+        # Cold fundamentals store each time so the full per-ticker fetch path is measured
+        fundamentals_store._store = self.new_store()
+        pipeline.get_stock_data_batch(self.tickers)
+
+
+STAGE_METHODS = {
+    'indicators': Workload.indicators,
+    'status': Workload.status,
+    'rows': Workload.compute_rows,
+    'table': Workload.table,
+    'vix': Workload.vix,
+    'pipeline': Workload.full_pipeline,
+}
+
+
+def measure(fn, repeat):
+    # One untimed warm-up call absorbs lazy imports and first-touch caches
+    fn()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    # Peak memory from a separate traced run, since tracing slows everything down
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds_min': min(times),
+        'seconds_median': statistics.median(times),
+        'peak_mb': peak / 2 ** 20,
+    }
+
+
+def run(sizes, stages, repeat, seed):
+    # Offline and unthrottled: synthetic data, temporary stores, no rate limiting
+    config.RATE_LIMIT = 1e9
+    config.RATE_BURST = 1e9
+    provider = SyntheticProvider(seed=seed)
+    providers.set_provider(provider)
+    results = []
+    with tempfile.TemporaryDirectory() as store_dir:
+        for n in sizes:
+            workload = Workload(provider, n, store_dir)
+            for stage in stages:
+                stats = measure(lambda: STAGE_METHODS[stage](workload), repeat)
+                results.append(dict(stage=stage, n=n, **stats))
+                print(f"{stage:>10} n={n:<6} min={stats['seconds_min'] * 1e3:10.2f} ms  "
+                      f"median={stats['seconds_median'] * 1e3:10.2f} ms  peak={stats['peak_mb']:8.1f} MB",
+                      file=sys.stderr)
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    # Returns the (stage, n) pairs slower than baseline by more than `tolerance` (a fraction)
+    base = {(r['stage'], r['n']): r for r in baseline['results']}
+    regressions = []
+    print(f"{'stage':>10} {'n':>6} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for r in current['results']:
+        old = base.get((r['stage'], r['n']))
+        if old is None:
+            continue
+        ratio = r['seconds_min'] / old['seconds_min'] if old['seconds_min'] else float('inf')
+        flag = ' REGRESSION' if ratio > 1 + tolerance else ''
+        print(f"{r['stage']:>10} {r['n']:>6} {old['seconds_min'] * 1e3:12.2f} "
+              f"{r['seconds_min'] * 1e3:12.2f} {ratio:7.2f}{flag}")
+        if flag:
+            regressions.append((r['stage'], r['n']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Skyhook benchmarks on synthetic market data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help="ticker counts")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help="write results as JSON")
+    parser.add_argument('--baseline', default=None, help="JSON results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline before failing (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    current = run(args.sizes, args.stages, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import json
+import random
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from providers import MarketDataProvider, YFinanceProvider
+
+SESSION_MINUTES = 390
+
+
+def symbols(n):
+    return [f'SYN{i:05d}' for i in range(n)]
+
+
+def daily_bars(rng, days, end=None):
+    # Geometric random walk with per-symbol drift/volatility and lognormal volumes
+    end = pd.Timestamp(end or datetime.now()).normalize()
+    index = pd.bdate_range(end=end, periods=days)
+    vol = rng.uniform(0.01, 0.04)
+    drift = rng.normal(0.0003, 0.0005)
+    close = rng.uniform(10, 500) * np.exp(np.cumsum(rng.normal(drift, vol, days)))
+    spread = close * rng.uniform(0.002, 0.02, days)
+    open_ = close * (1 + rng.normal(0, vol / 2, days))
+    volume = rng.lognormal(np.log(rng.uniform(2e5, 2e7)), 0.4, days).astype(np.int64)
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) + spread,
+        'Low': np.minimum(open_, close) - spread,
+        'Close': close,
+        'Adj Close': close,
+        'Volume': volume,
+    }, index=index)
+
+
+def intraday_bars(rng, last_close, minutes=SESSION_MINUTES):
+    start = pd.Timestamp.now(tz='America/New_York').normalize() + pd.Timedelta(hours=9, minutes=30)
+    index = pd.date_range(start, periods=minutes, freq='min')
+    close = last_close * np.exp(np.cumsum(rng.normal(0, 0.001, minutes)))
+    volume = rng.lognormal(np.log(5e3), 0.8, minutes).astype(np.int64)
+    return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close,
+                         'Adj Close': close, 'Volume': volume}, index=index)
+
+
+def earnings_calendar(rng, quarters=8):
+    # Quarterly report dates straddling today, after the close as Yahoo lists most of them
+    now = pd.Timestamp.now(tz='America/New_York').normalize()
+    next_report = now + pd.Timedelta(days=int(rng.integers(1, 92)))
+    dates = [next_report - pd.Timedelta(days=91 * k) + pd.Timedelta(hours=16) for k in range(quarters)]
+    return pd.DataFrame({'EPS Estimate': rng.normal(1, 0.3, quarters)}, index=pd.DatetimeIndex(dates))
+
+
+def quarterly_statements(rng, quarters=6):
+    ends = pd.date_range(end=pd.Timestamp.now().normalize(), periods=quarters, freq='Q')
+    revenue = rng.uniform(1e8, 1e11) * np.exp(np.cumsum(rng.normal(0.02, 0.05, quarters)))
+    fcf = revenue * rng.normal(0.1, 0.08, quarters)
+    financials = pd.DataFrame([revenue], index=['Total Revenue'], columns=ends)
+    cashflow = pd.DataFrame([fcf], index=['Free Cash Flow'], columns=ends)
+    return financials, cashflow
+
+
+class SyntheticTicker:
+    def __init__(self, provider, symbol):
+        self.provider = provider
+        self.symbol = symbol
+
+    @property
+    def earnings_dates(self):
+        self.provider.wait('earnings_dates')
+        return self.provider.market[self.symbol]['earnings_dates']
+
+    @property
+    def info(self):
+        self.provider.wait('info')
+        return {'marketCap': self.provider.market[self.symbol]['market_cap']}
+
+    @property
+    def quarterly_financials(self):
+        self.provider.wait('quarterly_financials')
+        return self.provider.market[self.symbol]['quarterly_financials']
+
+    @property
+    def quarterly_cashflow(self):
+        self.provider.wait('quarterly_cashflow')
+        return self.provider.market[self.symbol]['quarterly_cashflow']
+
+
+class SyntheticProvider(MarketDataProvider):
+    # Serves a generated market from memory, standing in for Yahoo: `latency` seconds are slept per
+    # simulated request, spread lognormally by `jitter`, and a request fails with a transient
+    # error with probability `error_rate`. Requests are counted per endpoint in `calls`. Symbols
+    # are generated lazily and deterministically from `seed`, so any ticker resolves
+    def __init__(self, days=260, seed=0, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.days = days
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.market = SyntheticMarket(self)
+
+    def wait(self, endpoint='request'):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            delay = self.latency * self.random.lognormvariate(0, self.jitter) if self.jitter else self.latency
+            failed = self.random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            raise ConnectionError(f"SYNTHETIC {endpoint.upper()} ERROR")
+
+    def history(self, tickers, start, end, interval='1d'):
+        self.wait('history')
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        frames = {}
+        for ticker in dict.fromkeys(tickers):
+            daily = self.market[ticker]['daily']
+            frames[ticker] = daily[(daily.index >= start) & (daily.index < end)]
+        return frames
+
+    def intraday(self, tickers):
+        self.wait('intraday')
+        return {ticker: self.market[ticker]['intraday'] for ticker in dict.fromkeys(tickers)}
+
+    def ticker(self, symbol):
+        return SyntheticTicker(self, symbol)
+
+
+class SyntheticMarket(dict):
+    def __init__(self, provider):
+        super().__init__()
+        self.provider = provider
+
+    def __missing__(self, symbol):
+        rng = np.random.default_rng([self.provider.seed, *symbol.encode()])
+        daily = daily_bars(rng, self.provider.days)
+        financials, cashflow = quarterly_statements(rng)
+        entry = {
+            'daily': daily,
+            'intraday': intraday_bars(rng, daily['Close'].iloc[-1]),
+            'earnings_dates': earnings_calendar(rng),
+            'quarterly_financials': financials,
+            'quarterly_cashflow': cashflow,
+            'market_cap': float(financials.iloc[0].sum() * rng.uniform(1, 15)),
+        }
+        self[symbol] = entry
+        return entry
+
+
+class ChartResponse:
+    def __init__(self, payload):
+        self.payload = payload
+        self.status_code = 200
+        self.text = json.dumps(payload['chart']['error'])
+
+    def json(self):
+        return self.payload
+
+
+def chart(frame, symbol, params):
+    # The v8 chart payload Yahoo would return for `frame`, cut to the request's period1/period2
+    interval = params.get('interval', '1d')
+    index = frame.index if frame.index.tz else frame.index.tz_localize('America/New_York')
+    if 'period1' in params:
+        start = pd.Timestamp(params['period1'], unit='s', tz='UTC')
+        end = pd.Timestamp(params['period2'], unit='s', tz='UTC')
+        keep = (index >= start) & (index < end)
+        frame, index = frame[keep], index[keep]
+    meta = {
+        'currency': 'USD', 'symbol': symbol, 'exchangeTimezoneName': 'America/New_York',
+        'instrumentType': 'EQUITY', 'dataGranularity': interval,
+        'validRanges': ['1d', '5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'ytd', 'max'],
+    }
+    quote = {col.lower(): frame[col].tolist() for col in ('Open', 'High', 'Low', 'Close', 'Volume')}
+    return {'chart': {'error': None, 'result': [{
+        'meta': meta,
+        'timestamp': (index.tz_convert('UTC').asi8 // 10 ** 9).tolist(),
+        'indicators': {'quote': [quote], 'adjclose': [{'adjclose': frame['Adj Close'].tolist()}]},
+    }]}}
+
+
+class StubbedYahooProvider(YFinanceProvider):
+    # The real YFinanceProvider download path, yf.download and its shared module state included,
+    # with yfinance's HTTP requests answered from `synthetic`'s market: each chart request is one
+    # synthetic 'chart' request with its latency and errors. Every frame a download returns is
+    # checked against the market and one that is not the requested symbol's bars at the requested
+    # interval counts as 'mismatched' in synthetic.calls. Fundamentals come from `synthetic`
+    # directly. With lock=False downloads are left to overlap, to show what the lock prevents.
+    # Patches yfinance for the rest of the process
+    def __init__(self, synthetic, lock=True, tz_cache=None):
+        import yfinance
+        from yfinance.data import YfData
+
+        self.synthetic = synthetic
+        if not lock:
+            self.download_lock = nullcontext()
+        if tz_cache:
+            yfinance.set_tz_cache_location(tz_cache)
+
+        def get(data, url, user_agent_headers=None, params=None, proxy=None, timeout=30):
+            synthetic.wait('chart')
+            symbol = url.rsplit('/', 1)[1]
+            entry = synthetic.market[symbol]
+            interval = (params or {}).get('interval', '1d')
+            return ChartResponse(chart(entry['intraday' if interval == '1m' else 'daily'], symbol, params or {}))
+        YfData.get = get
+        YfData.cache_get = get
+
+    def download(self, tickers, **kwargs):
+        frames = super().download(tickers, **kwargs)
+        key = 'intraday' if kwargs.get('interval') == '1m' else 'daily'
+        mismatched = 0
+        for ticker, frame in frames.items():
+            close = frame['Close'].dropna().to_numpy()
+            expected = self.synthetic.market[ticker][key]['Close'].to_numpy()
+            if len(close) > len(expected) or not np.isin(close.round(6), expected.round(6)).all():
+                mismatched += 1
+        if mismatched:
+            with self.synthetic.lock:
+                self.synthetic.calls['mismatched'] = self.synthetic.calls.get('mismatched', 0) + mismatched
+        return frames
+
+    def ticker(self, symbol):
+        return self.synthetic.ticker(symbol)
+
+    def market_cap(self, symbol):
+        return self.synthetic.market_cap(symbol)
+
+    def quotes(self, tickers):
+        return self.synthetic.quotes(tickers)
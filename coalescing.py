@@ -0,0 +1,57 @@
+from contextlib import nullcontext
+
+import pandas as pd
+
+from fetching import SingleFlight
+from providers import MarketDataProvider
+
+
+def window_key(start, end, interval):
+    # Windows that agree at the resolution of the bars return the same bars. download_batch asks
+    # for a year up to now, which differs by milliseconds between sessions
+    unit = 'D' if interval[-1] in 'dko' else 'min'  # 1d/5d, 1wk, 1mo/3mo; minutes and hours
+    return pd.Timestamp(start).floor(unit), pd.Timestamp(end).floor(unit)
+
+
+class CoalescingProvider(MarketDataProvider):
+    # Wraps the upstream provider so that concurrent requests from any session for the same symbol,
+    # interval and window wait on one download in flight and share its result. A batch only
+    # downloads the symbols nobody else is already fetching. Batches for different symbols are not
+    # merged, so for an upstream with a download_lock this layer also runs them one at a time
+    def __init__(self, inner):
+        self.inner = inner
+        self.download_lock = inner.download_lock
+        self.bars = SingleFlight('bars')
+        self.market_caps = SingleFlight('market_cap')
+
+    def _batch(self, tickers, key, fetch):
+        # fetch(tickers) -> {ticker: frame}, called with this caller's share of the tickers
+        def fetch_keys(keys):
+            with self.download_lock or nullcontext():
+                frames = fetch([k[0] for k in keys])
+            return {(ticker,) + key: frame for ticker, frame in frames.items()}
+        frames = self.bars.do_many([(ticker,) + key for ticker in dict.fromkeys(tickers)], fetch_keys)
+        return {k[0]: frame for k, frame in frames.items()}
+
+    def history(self, tickers, start, end, interval='1d'):
+        return self._batch(tickers, (interval, window_key(start, end, interval)),
+                           lambda share: self.inner.history(share, start, end, interval))
+
+    def intraday(self, tickers):
+        return self._batch(tickers, ('1m', 'session'), self.inner.intraday)
+
+    def intraday_since(self, tickers, since):
+        return self._batch(tickers, ('1m', window_key(since, since, '1m')[0]),
+                           lambda share: self.inner.intraday_since(share, since))
+
+    def ticker(self, symbol):
+        return self.inner.ticker(symbol)
+
+    def market_cap(self, symbol):
+        return self.market_caps.do(symbol, self.inner.market_cap, symbol)
+
+    def quotes(self, tickers):
+        def fetch_keys(keys):
+            return {(ticker, 'quote'): quote for ticker, quote in self.inner.quotes([k[0] for k in keys]).items()}
+        found = self.market_caps.do_many([(ticker, 'quote') for ticker in dict.fromkeys(tickers)], fetch_keys)
+        return {k[0]: quote for k, quote in found.items()}
@@ -0,0 +1,81 @@
+import os
+
+# Directory for everything Skyhook persists between runs
+DATA_DIR = os.path.expanduser(os.environ.get('SKYHOOK_DATA_DIR', '~/.skyhook'))
+
+# Market-data backend: 'yfinance' (live Yahoo) or 'replay' (recorded files)
+PROVIDER = os.environ.get('SKYHOOK_PROVIDER', 'yfinance')
+REPLAY_DIR = os.path.expanduser(os.environ.get('SKYHOOK_REPLAY_DIR', os.path.join(DATA_DIR, 'replay')))
+REPLAY_LATENCY = float(os.environ.get('SKYHOOK_REPLAY_LATENCY', '0'))  # seconds per simulated request
+
+# Persist daily bars locally and only download the ones after the last stored bar
+BAR_STORE = os.environ.get('SKYHOOK_BAR_STORE', '1') != '0'
+
+# Keep 1-minute bars for the last month on disk and anchor the VWAPs at the exact minute rather
+# than the day; off by default since the first run downloads a month of minutes per symbol
+MINUTE_STORE = os.environ.get('SKYHOOK_MINUTE_STORE', '0') != '0'
+MINUTE_DIR = os.path.expanduser(os.environ.get('SKYHOOK_MINUTE_DIR', os.path.join(DATA_DIR, 'minutes')))
+
+# Concurrent requests for the same symbols from any session share one upstream download
+COALESCE = os.environ.get('SKYHOOK_COALESCE', '1') != '0'
+
+# Daily bars are shared in memory by every session for this long, so the regime panel and the
+# watchlists never download the same symbol twice; the regime panel itself is recomputed at most
+# every REGIME_TTL seconds
+BAR_CACHE_TTL = float(os.environ.get('SKYHOOK_BAR_CACHE_TTL', '60'))  # seconds, 0 to disable
+REGIME_TTL = float(os.environ.get('SKYHOOK_REGIME_TTL', '300'))  # seconds
+
+# Fundamentals snapshots are refetched once the next earnings date passes or after this many days
+FUNDAMENTALS_TTL_DAYS = float(os.environ.get('SKYHOOK_FUNDAMENTALS_TTL_DAYS', '14'))
+MARKET_CAP_TTL = float(os.environ.get('SKYHOOK_MARKET_CAP_TTL', '900'))  # seconds
+# The bulk-quote price stands in for the last price only while it is at most this old
+QUOTE_PRICE_TTL = float(os.environ.get('SKYHOOK_QUOTE_PRICE_TTL', '60'))  # seconds
+
+# Concurrent per-ticker fetching: worker threads, shared token-bucket rate limit and retry backoff
+FETCH_WORKERS = int(os.environ.get('SKYHOOK_FETCH_WORKERS', '8'))
+RATE_LIMIT = float(os.environ.get('SKYHOOK_RATE_LIMIT', '5'))  # requests per second
+RATE_BURST = float(os.environ.get('SKYHOOK_RATE_BURST', '10'))
+FETCH_RETRIES = int(os.environ.get('SKYHOOK_FETCH_RETRIES', '3'))
+BACKOFF_BASE = float(os.environ.get('SKYHOOK_BACKOFF_BASE', '0.5'))  # seconds
+BACKOFF_MAX = float(os.environ.get('SKYHOOK_BACKOFF_MAX', '8'))  # seconds
+
+# Connections kept alive in the pooled HTTP session every Yahoo request shares; at least as many as
+# can be in flight at once (fetch workers, deadline workers and yfinance's download threads)
+HTTP_POOL_SIZE = int(os.environ.get('SKYHOOK_HTTP_POOL_SIZE', '32'))
+
+# Latency budget per refresh: each upstream stage is waited on for at most its deadline, after
+# which its columns show N/A or the last stored values and the call's result fills in on the next
+# rerun. REFRESH_BUDGET bounds the per-ticker fundamentals fetches of a whole watchlist. 0 disables
+DEADLINE_DAILY = float(os.environ.get('SKYHOOK_DEADLINE_DAILY', '10'))  # seconds
+DEADLINE_INTRADAY = float(os.environ.get('SKYHOOK_DEADLINE_INTRADAY', '5'))  # seconds
+DEADLINE_EARNINGS = float(os.environ.get('SKYHOOK_DEADLINE_EARNINGS', '5'))  # seconds
+DEADLINE_FUNDAMENTALS = float(os.environ.get('SKYHOOK_DEADLINE_FUNDAMENTALS', '5'))  # seconds, statements and market cap
+REFRESH_BUDGET = float(os.environ.get('SKYHOOK_REFRESH_BUDGET', '30'))  # seconds
+
+# Render table rows as they arrive instead of waiting for the whole watchlist
+STREAMING_RENDER = os.environ.get('SKYHOOK_STREAMING_RENDER', '1') != '0'
+RENDER_INTERVAL = float(os.environ.get('SKYHOOK_RENDER_INTERVAL', '0.5'))  # seconds between re-renders
+TABLE_PAGE_SIZE = int(os.environ.get('SKYHOOK_TABLE_PAGE_SIZE', '100'))  # rows per table page
+
+# Paint the last regime header and table from disk, marked stale, while the current ones are fetched
+SNAPSHOT = os.environ.get('SKYHOOK_SNAPSHOT', '1') != '0'
+SNAPSHOT_DIR = os.environ.get('SKYHOOK_SNAPSHOT_DIR', os.path.join(DATA_DIR, 'snapshot'))
+
+# Live mode: poll new minute bars and update the table in place
+LIVE_MODE = os.environ.get('SKYHOOK_LIVE', '0') != '0'  # initial state of the LIVE toggle
+LIVE_INTERVAL = float(os.environ.get('SKYHOOK_LIVE_INTERVAL', '5'))  # seconds between polls
+
+# Initial state of the RELATIVE STRENGTH toggle: returns against SPY/QQQ and correlations below the table
+RELATIVE_STRENGTH = os.environ.get('SKYHOOK_RELATIVE_STRENGTH', '0') != '0'
+
+# Background prefetch of saved watchlists and the regime header, scheduled on the NYSE calendar
+PREFETCH = os.environ.get('SKYHOOK_PREFETCH', '1') != '0'
+PREFETCH_INTERVAL = float(os.environ.get('SKYHOOK_PREFETCH_INTERVAL', '300'))  # seconds, during the session
+PREFETCH_CLOSE_DELAY = float(os.environ.get('SKYHOOK_PREFETCH_CLOSE_DELAY', '900'))  # end-of-day pass after the close
+WATCHLISTS_PATH = os.environ.get('SKYHOOK_WATCHLISTS', os.path.join(DATA_DIR, 'watchlists.txt'))
+
+# Timing instrumentation: structured JSON logs, Prometheus textfile export and the in-app panel
+LOG_PATH = os.environ.get('SKYHOOK_LOG_PATH')  # default: stderr
+LOG_LEVEL = os.environ.get('SKYHOOK_LOG_LEVEL', 'INFO').upper()
+METRICS_PATH = os.environ.get('SKYHOOK_METRICS_PATH', os.path.join(DATA_DIR, 'metrics.prom'))
+DIAGNOSTICS = os.environ.get('SKYHOOK_DIAGNOSTICS', '1') != '0'
@@ -0,0 +1,218 @@
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import requests
+
+import config
+from instrumentation import copy_context, histograms
+
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+TRANSIENT_MESSAGES = ('Too Many Requests', 'Rate limited', 'timed out', 'Connection reset')
+LATE_RESULT_TTL = 300  # seconds a late result is kept for the next caller to collect
+
+
+class DeadlineExceeded(Exception):
+    # Not transient: retrying straight away would only wait on the same call again
+    def __init__(self, stage):
+        super().__init__(f"{stage.upper().replace('_', ' ')} DEADLINE EXCEEDED")
+        self.stage = stage
+
+
+class TokenBucket:
+    # Allows `rate` acquisitions per second on average with bursts of up to `capacity`
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SingleFlight:
+    # Concurrent calls for the same key, from any session in the process, share one upstream call:
+    # the first caller runs it and the others wait for its result (or exception). Keys are counted
+    # as issued or coalesced under `name` for the metrics export
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> Future of the call in flight
+
+    def claim(self, keys):
+        # Futures for the keys this caller must fetch and for the ones already in flight
+        mine, theirs = {}, {}
+        with self.lock:
+            for key in keys:
+                if key in self.calls:
+                    theirs[key] = self.calls[key]
+                else:
+                    mine[key] = self.calls[key] = Future()
+        histograms.count_fetches(self.name, issued=len(mine), coalesced=len(theirs))
+        return mine, theirs
+
+    def release(self, futures, results=None, error=None):
+        with self.lock:
+            for key in futures:
+                del self.calls[key]
+        for key, future in futures.items():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results.get(key))
+
+    def do(self, key, fn, *args, **kwargs):
+        mine, theirs = self.claim([key])
+        if theirs:
+            return theirs[key].result()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.release(mine, error=e)
+            raise
+        self.release(mine, {key: result})
+        return result
+
+    def do_many(self, keys, fn):
+        # fn(keys) -> {key: result} for the keys nobody else is fetching; returns {key: result}
+        # for all of them, leaving out keys whose fetch returned nothing
+        mine, theirs = self.claim(list(dict.fromkeys(keys)))
+        results = {}
+        if mine:
+            try:
+                results = fn(list(mine))
+            except Exception as e:
+                self.release(mine, error=e)
+                raise
+            self.release(mine, results)
+        # Only wait once our own share is published, so two batches overlapping each other
+        # cannot wait on one another
+        for key, future in theirs.items():
+            results[key] = future.result()
+        return {key: results[key] for key in keys if results.get(key) is not None}
+
+
+class Deadlines:
+    # Runs upstream calls on a shared pool and waits for each at most its stage's deadline. A call
+    # that overruns keeps running and is handed to the next caller with the same stage and key, so
+    # its result fills in on the next rerun instead of being fetched again from scratch
+    def __init__(self, max_workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or 4 * config.FETCH_WORKERS,
+                                           thread_name_prefix='skyhook-deadline')
+        self.lock = threading.Lock()
+        self.calls = {}  # (stage, key) -> (Future, started)
+
+    def call(self, stage, key, deadline, fn, *args, **kwargs):
+        if deadline <= 0:
+            return fn(*args, **kwargs)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.calls.get((stage, key))
+            if entry is None or (entry[0].done() and now - entry[1] > LATE_RESULT_TTL):
+                future = self.executor.submit(copy_context().run, fn, *args, **kwargs)
+                entry = self.calls[(stage, key)] = (future, now)
+        future = entry[0]
+        try:
+            return future.result(timeout=deadline)
+        except FutureTimeout:
+            histograms.count_late(stage)
+            raise DeadlineExceeded(stage) from None
+        finally:
+            if future.done():
+                with self.lock:
+                    if self.calls.get((stage, key)) is entry:
+                        del self.calls[(stage, key)]
+
+
+def is_transient(exc):
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        ConnectionError, TimeoutError)):
+        return True
+    response = getattr(exc, 'response', None)
+    if response is not None and getattr(response, 'status_code', None) in TRANSIENT_STATUS_CODES:
+        return True
+    return any(message.lower() in str(exc).lower() for message in TRANSIENT_MESSAGES)
+
+
+def call_with_retry(fn, *args, retries=None, limiter=None, **kwargs):
+    # Retries transient upstream failures with full-jitter exponential backoff; every attempt
+    # first takes a token from the shared rate limiter
+    retries = config.FETCH_RETRIES if retries is None else retries
+    limiter = limiter or get_rate_limiter()
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= retries or not is_transient(e):
+                raise
+            delay = min(config.BACKOFF_MAX, config.BACKOFF_BASE * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+            attempt += 1
+
+
+def fetch_concurrently(fn, items, max_workers=None, limiter=None, retries=None, deadline=None, stage='fetch'):
+    # Runs fn(item) on a bounded thread pool and yields (item, result, error) as each finishes.
+    # Items still running `deadline` seconds in get a DeadlineExceeded error; they are left to
+    # finish in the background and the ones not started yet are dropped
+    items = list(dict.fromkeys(items))
+    if not items:
+        return
+    max_workers = max_workers or config.FETCH_WORKERS
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    futures = {
+        executor.submit(copy_context().run, call_with_retry, fn, item, retries=retries, limiter=limiter): item
+        for item in items
+    }
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=deadline if deadline and deadline > 0 else None):
+            pending.discard(future)
+            item = futures[future]
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
+    except FutureTimeout:
+        histograms.count_late(stage)
+        for future in pending:
+            yield futures[future], None, DeadlineExceeded(stage)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+_deadlines = None
+_deadlines_lock = threading.Lock()
+
+def get_deadlines():
+    global _deadlines
+    with _deadlines_lock:
+        if _deadlines is None:
+            _deadlines = Deadlines()
+    return _deadlines
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    # One bucket per process so that concurrent sessions share the upstream budget
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = TokenBucket(config.RATE_LIMIT, config.RATE_BURST)
+    return _rate_limiter
@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import config
+from fetching import DeadlineExceeded, SingleFlight, get_deadlines
+from instrumentation import span
+
+logger = logging.getLogger('skyhook.fundamentals')
+
+REVENUE_COL = 'Total Revenue'
+FREE_CASH_FLOW_COL = 'Free Cash Flow'
+
+COLUMNS = (
+    'ticker', 'fetched_at', 'last_earnings_date', 'next_earnings_date', 'has_statements',
+    'ttm_revenue', 'prev_ttm_revenue', 'ttm_fcf', 'prev_ttm_fcf', 'market_cap', 'market_cap_at'
+)
+DATE_COLUMNS = ('fetched_at', 'last_earnings_date', 'next_earnings_date', 'market_cap_at')
+TOTALS = ('ttm_revenue', 'prev_ttm_revenue', 'ttm_fcf', 'prev_ttm_fcf')
+
+
+def earnings_anchors(earnings_dates):
+    # Latest past and next future earnings dates as naive exchange-local timestamps
+    if earnings_dates is None or earnings_dates.empty:
+        return None, None
+    index = pd.to_datetime(earnings_dates.index)
+    current_time = datetime.now().astimezone(index.tz)
+
+    latest_past = index[index <= current_time].max()
+    if pd.isna(latest_past):
+        latest_past = None
+    elif latest_past.tzinfo:
+        latest_past = latest_past.tz_localize(None)
+
+    future = index[index > current_time]
+    next_date = future.min() if not future.empty else None
+    if next_date is not None and next_date.tzinfo:
+        next_date = next_date.tz_localize(None)
+    return latest_past, next_date
+
+
+def statement_totals(ticker_info):
+    # TTM and previous-TTM revenue and free cash flow from the last five quarterly statements
+    income_stmt = ticker_info.quarterly_financials.T
+    cashflow_stmt = ticker_info.quarterly_cashflow.T
+    if REVENUE_COL not in income_stmt.columns or FREE_CASH_FLOW_COL not in cashflow_stmt.columns:
+        return None
+    income_stmt = income_stmt.sort_index(ascending=False)
+    cashflow_stmt = cashflow_stmt.sort_index(ascending=False)
+    return {
+        'ttm_revenue': float(income_stmt[REVENUE_COL].head(4).sum()),
+        'prev_ttm_revenue': float(income_stmt[REVENUE_COL].iloc[1:5].sum()),
+        'ttm_fcf': float(cashflow_stmt[FREE_CASH_FLOW_COL].head(4).sum()),
+        'prev_ttm_fcf': float(cashflow_stmt[FREE_CASH_FLOW_COL].iloc[1:5].sum()),
+    }
+
+
+def fetch_fundamentals(ticker, ticker_info, previous=None):
+    # Each upstream call gets its stage's deadline; one that misses it keeps the values of the
+    # `previous` snapshot, if any, and is listed under 'late'
+    previous = previous or {}
+    deadlines = get_deadlines()
+    late = []
+    with span('earnings_dates', ticker):
+        try:
+            last_earnings_date, next_earnings_date = deadlines.call(
+                'earnings_dates', ticker, config.DEADLINE_EARNINGS, lambda: earnings_anchors(ticker_info.earnings_dates))
+        except DeadlineExceeded:
+            last_earnings_date, next_earnings_date = previous.get('last_earnings_date'), previous.get('next_earnings_date')
+            late.append('earnings_dates')
+    snapshot = {
+        'fetched_at': pd.Timestamp.now(),
+        'last_earnings_date': last_earnings_date,
+        'next_earnings_date': next_earnings_date,
+        'has_statements': False,
+        'ttm_revenue': None,
+        'prev_ttm_revenue': None,
+        'ttm_fcf': None,
+        'prev_ttm_fcf': None,
+    }
+    with span('statements', ticker):
+        try:
+            totals = deadlines.call('statements', ticker, config.DEADLINE_FUNDAMENTALS, statement_totals, ticker_info)
+        except DeadlineExceeded:
+            totals = {col: previous[col] for col in TOTALS} if previous.get('has_statements') else None
+            late.append('statements')
+    if totals is not None:
+        snapshot.update(totals, has_statements=True)
+    snapshot['late'] = late
+    return snapshot
+
+
+class FundamentalsStore:
+    # One row per ticker in SQLite, shared by every session and process on the machine
+    def __init__(self, path=None):
+        self.path = path or os.path.join(config.DATA_DIR, 'fundamentals.sqlite')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS fundamentals (
+                    ticker TEXT PRIMARY KEY,
+                    fetched_at TEXT NOT NULL,
+                    last_earnings_date TEXT,
+                    next_earnings_date TEXT,
+                    has_statements INTEGER NOT NULL,
+                    ttm_revenue REAL,
+                    prev_ttm_revenue REAL,
+                    ttm_fcf REAL,
+                    prev_ttm_fcf REAL,
+                    market_cap REAL,
+                    market_cap_at TEXT
+                )
+            """)
+
+    def get(self, ticker):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM fundamentals WHERE ticker = ?", (ticker,)
+            ).fetchone()
+        if row is None:
+            return None
+        snapshot = dict(zip(COLUMNS, row))
+        for col in DATE_COLUMNS:
+            snapshot[col] = pd.Timestamp(snapshot[col]) if snapshot[col] else None
+        snapshot['has_statements'] = bool(snapshot['has_statements'])
+        return snapshot
+
+    def put(self, ticker, snapshot):
+        values = dict(snapshot, ticker=ticker)
+        values.setdefault('market_cap', None)
+        values.setdefault('market_cap_at', None)
+        for col in DATE_COLUMNS:
+            values[col] = values[col].isoformat() if values[col] is not None else None
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO fundamentals ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                [values[col] for col in COLUMNS]
+            )
+
+    def invalidate(self, ticker):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM fundamentals WHERE ticker = ?", (ticker,))
+
+
+def is_fresh(snapshot, now=None):
+    # Statements and the earnings calendar only change around a report, so a snapshot stays valid
+    # until its next earnings date passes, with a long TTL as a backstop
+    now = now or pd.Timestamp.now()
+    if now - snapshot['fetched_at'] > timedelta(days=config.FUNDAMENTALS_TTL_DAYS):
+        return False
+    next_earnings_date = snapshot['next_earnings_date']
+    return next_earnings_date is None or now < next_earnings_date
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FundamentalsStore()
+    return _store
+
+
+def stored_fundamentals(ticker, store=None):
+    # The last stored snapshot whatever its age, or an empty one, for a ticker whose fetch ran out
+    # of time; its columns then show stale values or N/A
+    snapshot = (store or get_store()).get(ticker)
+    if snapshot is None:
+        snapshot = dict.fromkeys(COLUMNS[1:], None)
+        snapshot['has_statements'] = False
+    snapshot['late'] = ['fundamentals']
+    return snapshot
+
+
+def market_cap_due(snapshot, now):
+    market_cap_at = snapshot.get('market_cap_at') if snapshot else None
+    return market_cap_at is None or now - market_cap_at > timedelta(seconds=config.MARKET_CAP_TTL)
+
+
+_quotes = {}  # ticker -> (quote, fetched)
+_quotes_lock = threading.Lock()
+
+def cached_quote(ticker, now=None):
+    # (quote, fetched) of the bulk quote fetched for the ticker within MARKET_CAP_TTL, if any
+    now = now or pd.Timestamp.now()
+    with _quotes_lock:
+        entry = _quotes.get(ticker)
+    if entry is None or now - entry[1] > timedelta(seconds=config.MARKET_CAP_TTL):
+        return None
+    return entry
+
+def prime_quotes(tickers, provider, store=None):
+    # Market caps and prices for every ticker whose market cap is due, from one bulk quote request,
+    # so get_fundamentals finds them here instead of asking for each ticker on its own. On failure
+    # the per-ticker requests remain
+    store = store or get_store()
+    now = pd.Timestamp.now()
+    due = [ticker for ticker in dict.fromkeys(tickers)
+           if cached_quote(ticker, now) is None and market_cap_due(store.get(ticker), now)]
+    if not due:
+        return
+    with span('quotes'):
+        try:
+            found = get_deadlines().call('market_cap', tuple(due), config.DEADLINE_FUNDAMENTALS, provider.quotes, due)
+        except Exception as e:
+            logger.warning(json.dumps({'event': 'quotes_failed', 'tickers': len(due), 'error': str(e)}))
+            return
+    with _quotes_lock:
+        for ticker, quote in found.items():
+            _quotes[ticker] = (quote, now)
+
+
+_in_flight = SingleFlight('fundamentals')
+
+def get_fundamentals(ticker, provider, store=None):
+    # Earnings anchors and TTM totals from the store when still valid; only the market cap is
+    # refreshed on its own short TTL. Sessions asking for the same ticker at once share one fetch
+    with span('fundamentals', ticker):
+        if config.COALESCE:
+            return _in_flight.do(ticker, _get_fundamentals, ticker, provider, store or get_store())
+        return _get_fundamentals(ticker, provider, store or get_store())
+
+def _get_fundamentals(ticker, provider, store):
+    now = pd.Timestamp.now()
+    snapshot = store.get(ticker)
+    changed = False
+    if snapshot is None or not is_fresh(snapshot, now):
+        previous = snapshot or {}
+        snapshot = fetch_fundamentals(ticker, provider.ticker(ticker), previous)
+        snapshot['market_cap'] = previous.get('market_cap')
+        snapshot['market_cap_at'] = previous.get('market_cap_at')
+        # A partly late snapshot is not stored, so the next rerun collects the late calls
+        changed = not snapshot['late']
+    else:
+        snapshot['late'] = []
+
+    quote = cached_quote(ticker, now)
+    # The quote is kept as long as the market cap, far longer than a price stays current
+    fresh_price = quote is not None and now - quote[1] <= timedelta(seconds=config.QUOTE_PRICE_TTL)
+    snapshot['price'] = quote[0]['price'] if fresh_price else None
+    # Funds and partial quote responses carry no market cap; those still ask the provider
+    if market_cap_due(snapshot, now) and quote is not None and quote[0]['market_cap'] is not None:
+        snapshot['market_cap'], snapshot['market_cap_at'] = quote[0]['market_cap'], quote[1]
+        changed = changed or not snapshot['late']
+    elif market_cap_due(snapshot, now):
+        with span('market_cap', ticker):
+            try:
+                snapshot['market_cap'] = get_deadlines().call(
+                    'market_cap', ticker, config.DEADLINE_FUNDAMENTALS, provider.market_cap, ticker)
+                snapshot['market_cap_at'] = now
+                changed = changed or not snapshot['late']
+            except DeadlineExceeded:
+                snapshot['late'].append('market_cap')
+
+    if changed:
+        store.put(ticker, snapshot)
+    return snapshot
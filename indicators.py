@@ -0,0 +1,133 @@
+import numpy as np
+
+SMA_WINDOWS = (5, 50, 150, 200)
+VOLUME_WINDOW = 20
+VWAP_ANCHORS = ('YearStart', 'RecentHigh', 'RecentLow', 'Earnings')
+
+
+def stack_histories(frames, length=None):
+    # Right-aligns each ticker's own bars into tickers x days matrices, NaN-padded on the left, so
+    # that every ticker keeps its own trading calendar and the last column is each one's last bar
+    length = length or max(len(frame) for frame in frames)
+    close = np.full((len(frames), length), np.nan)
+    volume = np.full((len(frames), length), np.nan)
+    offsets = np.empty(len(frames), dtype=np.int64)
+    for i, frame in enumerate(frames):
+        k = min(len(frame), length)
+        close[i, length - k:] = frame['Close'].to_numpy(dtype=float)[len(frame) - k:]
+        volume[i, length - k:] = frame['Volume'].to_numpy(dtype=float)[len(frame) - k:]
+        offsets[i] = length - k
+    return close, volume, offsets
+
+
+def anchor_indices(frames, offsets, length, year_start, earnings_dates):
+    # Column of each VWAP anchor in the stacked matrices, -1 where the anchor does not exist
+    n = len(frames)
+    anchors = {name: np.full(n, -1, dtype=np.int64) for name in VWAP_ANCHORS}
+    for i, frame in enumerate(frames):
+        offset = offsets[i]
+        skip = len(frame) - (length - offset)
+        index = frame.index[skip:]
+        closes = frame['Close'].to_numpy(dtype=float)[skip:]
+
+        pos = index.searchsorted(year_start, side='left')
+        if pos < len(index):
+            anchors['YearStart'][i] = offset + pos
+
+        if not np.isnan(closes).all():
+            anchors['RecentHigh'][i] = offset + np.nanargmax(closes)
+            anchors['RecentLow'][i] = offset + np.nanargmin(closes)
+
+        earnings_date = earnings_dates[i]
+        if earnings_date is not None and earnings_date <= index[-1]:
+            anchors['Earnings'][i] = offset + index.searchsorted(earnings_date, side='left')
+    return anchors
+
+
+def prefix_sums(values):
+    # Cumulative sums with a leading zero column, NaNs contributing nothing, plus valid counts
+    valid = ~np.isnan(values)
+    zeros = np.zeros((values.shape[0], 1))
+    sums = np.concatenate([zeros, np.cumsum(np.where(valid, values, 0.0), axis=1)], axis=1)
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=1)], axis=1)
+    return sums, counts
+
+
+def rolling_mean_at(sums, counts, window, t):
+    # Same as Series.rolling(window).mean() evaluated at columns t (shape (k,) or (n, k)):
+    # NaN unless all `window` values ending at t are present
+    t = np.broadcast_to(t, (sums.shape[0],) + np.shape(t)[-1:])
+    rows = np.arange(sums.shape[0])[:, None]
+    lo = np.clip(t + 1 - window, 0, None)
+    total = sums[rows, t + 1] - sums[rows, lo]
+    count = counts[rows, t + 1] - counts[rows, lo]
+    with np.errstate(invalid='ignore'):
+        return np.where((count == window) & (t + 1 - window >= 0), total / window, np.nan)
+
+
+def anchored_vwap_at(pv_sums, v_sums, pv_valid, v_valid, anchors, t):
+    # Same as calculate_vwap(data[data.index >= anchor]) evaluated at columns t, read straight off
+    # the prefix sums instead of slicing and re-accumulating; NaN before the anchor or without one
+    t = np.broadcast_to(t, (pv_sums.shape[0],) + np.shape(t)[-1:])
+    rows = np.arange(pv_sums.shape[0])[:, None]
+    anchors = np.broadcast_to(anchors if np.ndim(anchors) == 2 else np.asarray(anchors)[:, None], t.shape)
+    a = np.clip(anchors, 0, None)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vwap = (pv_sums[rows, t + 1] - pv_sums[rows, a]) / (v_sums[rows, t + 1] - v_sums[rows, a])
+    ok = (anchors >= 0) & (t >= anchors) & pv_valid[rows, t] & v_valid[rows, t]
+    return np.where(ok, vwap, np.nan)
+
+
+def compute_indicators(close, volume, anchors, t=None):
+    # All SMAs, the 20-day average volume and every anchored VWAP for every ticker in one pass.
+    # Values are returned at columns t, by default the last two bars as (n, 2) arrays [prev, last]
+    n, length = close.shape
+    if t is None:
+        t = np.array([length - 2, length - 1])
+    t = np.asarray(t)
+
+    close_sums, close_counts = prefix_sums(close)
+    volume_sums, volume_counts = prefix_sums(volume)
+    pv = close * volume
+    pv_sums, _ = prefix_sums(pv)
+    pv_valid = ~np.isnan(pv)
+    v_valid = ~np.isnan(volume)
+
+    # A history of a single bar has no previous value, so negative columns come back as NaN
+    tc = np.clip(t, 0, None)
+    result = {}
+    for window in SMA_WINDOWS:
+        result[f'SMA{window}'] = rolling_mean_at(close_sums, close_counts, window, tc)
+    result['avg_volume_20d'] = rolling_mean_at(volume_sums, volume_counts, VOLUME_WINDOW, tc)
+    for name in VWAP_ANCHORS:
+        result[f'VWAP_{name}'] = anchored_vwap_at(pv_sums, volume_sums, pv_valid, v_valid, anchors[name], tc)
+    if (t < 0).any():
+        for values in result.values():
+            values[np.broadcast_to(t < 0, values.shape)] = np.nan
+    return result
+
+
+def trend(values):
+    # 'R' when the last value is above the previous one, as in the table's trend columns
+    return np.where(values[:, -1] > values[:, -2], 'R', 'F')
+
+
+def classify_status(price, ind, has_earnings):
+    # Vectorized form of the AVOID/CLEAR/CAUTION rules over (n, 2) [prev, last] indicator arrays
+    def rising(key):
+        return ind[key][:, -1] > ind[key][:, -2]
+
+    def above(key):
+        return price > ind[key][:, -1]
+
+    avoid = price < ind['SMA5'][:, -1]
+    clear = (
+        above('SMA5') & above('SMA50') & above('SMA150') & above('SMA200') &
+        above('VWAP_YearStart') & above('VWAP_RecentLow') &
+        (~has_earnings | above('VWAP_Earnings')) &
+        rising('SMA5') & rising('SMA50') & rising('SMA150') & rising('SMA200') &
+        rising('VWAP_YearStart') & rising('VWAP_RecentLow') &
+        (~has_earnings | rising('VWAP_Earnings'))
+    )
+    caution = above('SMA5') & (ind['SMA5'][:, -1] <= ind['SMA5'][:, -2])
+    return np.select([avoid, clear, caution], ['AVOID', 'CLEAR', 'CAUTION'], '')
@@ -0,0 +1,193 @@
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import config
+
+logger = logging.getLogger('skyhook.timing')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current = contextvars.ContextVar('skyhook_run', default=None)
+
+
+class Run:
+    # Spans recorded during one refresh (one Streamlit rerun, one screener chunk, ...)
+    def __init__(self, name):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, stage, ticker, seconds):
+        with self.lock:
+            self.spans.append({'stage': stage, 'ticker': ticker, 'seconds': seconds})
+
+    def summary(self):
+        # Per stage: call count, total and slowest call with the ticker that caused it
+        stages = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            entry = stages.setdefault(span['stage'], {'count': 0, 'total': 0.0, 'max': 0.0, 'max_ticker': None})
+            entry['count'] += 1
+            entry['total'] += span['seconds']
+            if span['seconds'] >= entry['max']:
+                entry['max'] = span['seconds']
+                entry['max_ticker'] = span['ticker']
+        return stages
+
+
+class Histograms:
+    # Process-wide cumulative per-stage histograms and counters for the Prometheus export
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.runs = {}
+        self.fetches = {}  # kind -> upstream requests issued and coalesced into one in flight
+        self.late = {}  # stage -> upstream calls that missed their deadline
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            counts, total = self.stages.get(stage, ([0] * (len(BUCKETS) + 1), 0.0))
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.stages[stage] = (counts, total + seconds)
+
+    def count_run(self, name):
+        with self.lock:
+            self.runs[name] = self.runs.get(name, 0) + 1
+
+    def count_fetches(self, kind, issued=0, coalesced=0):
+        with self.lock:
+            counts = self.fetches.setdefault(kind, {'issued': 0, 'coalesced': 0})
+            counts['issued'] += issued
+            counts['coalesced'] += coalesced
+
+    def fetch_counts(self):
+        with self.lock:
+            return {kind: dict(counts) for kind, counts in self.fetches.items()}
+
+    def count_late(self, stage):
+        with self.lock:
+            self.late[stage] = self.late.get(stage, 0) + 1
+
+    def late_counts(self):
+        with self.lock:
+            return dict(self.late)
+
+    def render(self):
+        lines = [
+            '# HELP skyhook_stage_duration_seconds Time spent in each refresh stage.',
+            '# TYPE skyhook_stage_duration_seconds histogram',
+        ]
+        with self.lock:
+            for stage, (counts, total) in sorted(self.stages.items()):
+                for bound, count in zip(BUCKETS, counts):
+                    lines.append(f'skyhook_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'skyhook_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {counts[-1]}')
+                lines.append(f'skyhook_stage_duration_seconds_sum{{stage="{stage}"}} {total}')
+                lines.append(f'skyhook_stage_duration_seconds_count{{stage="{stage}"}} {counts[-1]}')
+            lines.append('# HELP skyhook_runs_total Completed refreshes by kind.')
+            lines.append('# TYPE skyhook_runs_total counter')
+            for name, count in sorted(self.runs.items()):
+                lines.append(f'skyhook_runs_total{{run="{name}"}} {count}')
+            lines.append('# HELP skyhook_fetches_total Upstream fetches by kind, issued or coalesced into one in flight.')
+            lines.append('# TYPE skyhook_fetches_total counter')
+            for kind, counts in sorted(self.fetches.items()):
+                for result in ('issued', 'coalesced'):
+                    lines.append(f'skyhook_fetches_total{{kind="{kind}",result="{result}"}} {counts[result]}')
+            lines.append('# HELP skyhook_deadline_misses_total Upstream calls that missed their stage deadline.')
+            lines.append('# TYPE skyhook_deadline_misses_total counter')
+            for stage, count in sorted(self.late.items()):
+                lines.append(f'skyhook_deadline_misses_total{{stage="{stage}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+histograms = Histograms()
+
+
+@contextmanager
+def span(stage, ticker=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        histograms.observe(stage, seconds)
+        run = _current.get()
+        if run is not None:
+            run.add(stage, ticker, seconds)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({
+                'event': 'span', 'run': run.id if run else None, 'stage': stage,
+                'ticker': ticker, 'seconds': round(seconds, 6),
+            }))
+
+
+def start_run(name):
+    run = Run(name)
+    _current.set(run)
+    return run
+
+
+def finish_run(run):
+    histograms.count_run(run.name)
+    logger.info(json.dumps({
+        'event': 'run', 'run': run.id, 'name': run.name,
+        'seconds': round(time.time() - run.started, 6),
+        'stages': {stage: round(entry['total'], 6) for stage, entry in run.summary().items()},
+    }))
+    if config.METRICS_PATH:
+        # A failed export costs one scrape, it must not fail the page that finished the run
+        try:
+            write_metrics(config.METRICS_PATH)
+        except OSError as e:
+            logger.warning(json.dumps({'event': 'metrics_export_failed', 'path': config.METRICS_PATH, 'error': str(e)}))
+
+
+def write_metrics(path):
+    # Prometheus text exposition format, replaced atomically for the node_exporter textfile collector.
+    # Runs finishing at once each write their own temporary file, so the last replace wins
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(histograms.render())
+        os.chmod(tmp_path, 0o644)  # mkstemp creates it private; the collector may run as another user
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def copy_context():
+    # Worker threads do not inherit context variables; submit through this so spans land in the run
+    return contextvars.copy_context()
+
+
+_logging_configured = False
+
+def configure_logging():
+    # JSON lines from the 'skyhook' loggers to SKYHOOK_LOG_PATH (or stderr)
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    handler = logging.FileHandler(config.LOG_PATH) if config.LOG_PATH else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('{"time": "%(asctime)s", "logger": "%(name)s", '
+                                           '"level": "%(levelname)s", "message": %(message)s}'))
+    root = logging.getLogger('skyhook')
+    root.addHandler(handler)
+    root.setLevel(config.LOG_LEVEL)
+    root.propagate = False
@@ -0,0 +1,180 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from fetching import call_with_retry, fetch_concurrently
+from fundamentals_store import get_fundamentals, prime_quotes
+from indicators import SMA_WINDOWS, VOLUME_WINDOW, anchor_indices, compute_indicators, prefix_sums, stack_histories
+from instrumentation import span
+from pipeline import download_batch, make_rows
+from providers import get_provider
+
+FIXED_ANCHORS = ('YearStart', 'Earnings')
+
+
+def with_today(daily, minutes):
+    # Daily bars with the session's bar rebuilt from its minute bars, so the live updates and the
+    # initial values agree on what today's close and volume are
+    day = pd.Timestamp(minutes.index[-1].date())
+    if daily.index.tz is not None:
+        day = day.tz_localize(daily.index.tz)
+    today = pd.DataFrame({'Close': [minutes['Close'].iloc[-1]], 'Volume': [minutes['Volume'].sum()]}, index=[day])
+    return pd.concat([daily.loc[daily.index < day, ['Close', 'Volume']], today])
+
+
+def window_base(sums, counts, t, window):
+    # Sum of the window - 1 values before column t, NaN unless they are all present
+    lo = t + 1 - window
+    if lo < 0:
+        return np.full(sums.shape[0], np.nan)
+    return np.where(counts[:, t] - counts[:, lo] == window - 1, sums[:, t] - sums[:, lo], np.nan)
+
+
+def anchored_base(pv_sums, v_sums, anchors, t):
+    # Price x volume and volume from each anchor up to the column before t; NaN without an anchor
+    rows = np.arange(pv_sums.shape[0])
+    a = np.clip(anchors, 0, t)
+    ok = (anchors >= 0) & (anchors <= t)
+    pv = np.where(ok, pv_sums[:, t] - pv_sums[rows, a], np.nan)
+    return pv, np.where(ok, v_sums[:, t] - v_sums[rows, a], np.nan)
+
+
+def vwap(pv_base, v_base, close, volume):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (pv_base + close * volume) / (v_base + volume)
+
+
+class LiveState:
+    # Running state behind the live table. Everything before today is reduced to a handful of sums
+    # per ticker when the state is built, so a new minute bar updates its ticker in constant time
+    # and recomputing the rows is a few vector operations over the watchlist
+    def __init__(self, history, fundamentals):
+        self.tickers = list(history)
+        self.position = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.fundamentals = fundamentals
+        minutes = [history[ticker][1] for ticker in self.tickers]
+        frames = [with_today(history[ticker][0], frame) for ticker, frame in zip(self.tickers, minutes)]
+        self.day = max(frame.index[-1].date() for frame in minutes)
+
+        close, volume, offsets = stack_histories(frames)
+        t = close.shape[1] - 1
+        year_start = pd.Timestamp(f'{datetime.now().year}-01-01')
+        earnings_dates = [fundamentals[ticker]['last_earnings_date'] for ticker in self.tickers]
+        anchors = anchor_indices(frames, offsets, t + 1, year_start, earnings_dates)
+        self.has_earnings = anchors['Earnings'] >= 0
+
+        # The recent high and low are re-anchored on today's bar whenever it makes a new extreme,
+        # so keep the extremes before today and the anchors they give
+        before = close[:, :t]
+        highs = np.where(np.isnan(before), -np.inf, before)
+        lows = np.where(np.isnan(before), np.inf, before)
+        seen = ~np.isnan(before).all(axis=1)
+        self.high = highs.max(axis=1, initial=-np.inf)
+        self.low = lows.min(axis=1, initial=np.inf)
+        prior = dict(anchors)
+        prior['RecentHigh'] = np.where(seen, highs.argmax(axis=1) if t else -1, -1)
+        prior['RecentLow'] = np.where(seen, lows.argmin(axis=1) if t else -1, -1)
+
+        # Yesterday's values never change during the session
+        self.prev = {key: values[:, 0] for key, values in compute_indicators(close, volume, prior).items()}
+
+        close_sums, close_counts = prefix_sums(close)
+        volume_sums, volume_counts = prefix_sums(volume)
+        pv_sums, _ = prefix_sums(close * volume)
+        self.sma_base = {window: window_base(close_sums, close_counts, t, window) for window in SMA_WINDOWS}
+        self.volume_base = window_base(volume_sums, volume_counts, t, VOLUME_WINDOW)
+        self.vwap_base = {name: anchored_base(pv_sums, volume_sums, prior[name], t)
+                          for name in FIXED_ANCHORS + ('RecentHigh', 'RecentLow')}
+
+        # Today so far: the last minute bar is still forming and is replaced when it is seen again
+        self.close = np.array([frame['Close'].iloc[-1] for frame in minutes], dtype=float)
+        self.bar_volume = np.nan_to_num(np.array([frame['Volume'].iloc[-1] for frame in minutes], dtype=float))
+        self.closed_volume = np.array([frame['Volume'].sum() for frame in minutes], dtype=float) - self.bar_volume
+        self.last_bar = [frame.index[-1] for frame in minutes]
+        self.cached_rows = None
+
+    def since(self):
+        return min(self.last_bar)
+
+    def apply(self, bars):
+        # Folds in minute bars at or after each ticker's last seen bar and returns whether anything
+        # changed, or None once a new session has started and the state must be rebuilt
+        changed = False
+        for ticker, frame in bars.items():
+            i = self.position.get(ticker)
+            if i is None:
+                continue
+            frame = frame[frame.index >= self.last_bar[i]]
+            if frame.empty:
+                continue
+            if frame.index[-1].date() > self.day:
+                return None
+            if frame.index[0] != self.last_bar[i]:
+                self.closed_volume[i] += self.bar_volume[i]
+            volume = frame['Volume'].to_numpy(dtype=float)
+            self.closed_volume[i] += np.nansum(volume[:-1])
+            self.bar_volume[i] = 0.0 if np.isnan(volume[-1]) else volume[-1]
+            self.close[i] = frame['Close'].iloc[-1]
+            self.last_bar[i] = frame.index[-1]
+            changed = True
+        if changed:
+            self.cached_rows = None
+        return changed
+
+    def indicators(self):
+        # (n, 2) [prev, last] arrays in the layout compute_indicators returns
+        close = self.close
+        volume = self.closed_volume + self.bar_volume
+        last = {f'SMA{window}': (self.sma_base[window] + close) / window for window in SMA_WINDOWS}
+        last['avg_volume_20d'] = (self.volume_base + volume) / VOLUME_WINDOW
+        for name in FIXED_ANCHORS:
+            last[f'VWAP_{name}'] = vwap(*self.vwap_base[name], close, volume)
+        prev = dict(self.prev)
+
+        # A new high or low moves the anchor to today, which leaves no previous value
+        for name, extreme in (('RecentHigh', close > self.high), ('RecentLow', close < self.low)):
+            anchored = vwap(*self.vwap_base[name], close, volume)
+            last[f'VWAP_{name}'] = np.where(extreme, vwap(0.0, 0.0, close, volume), anchored)
+            prev[f'VWAP_{name}'] = np.where(extreme, np.nan, prev[f'VWAP_{name}'])
+        return {key: np.column_stack([prev[key], last[key]]) for key in last}
+
+    def rows(self):
+        # Computed once per change, so reruns between polls reuse the same rows (and the query
+        # index built over them)
+        if self.cached_rows is None:
+            with span('live_indicators'):
+                current_volume = self.closed_volume + self.bar_volume
+                self.cached_rows = make_rows(self.tickers, self.close, current_volume, self.indicators(),
+                                             self.has_earnings, self.fundamentals)
+        return self.cached_rows
+
+
+def start(tickers, provider=None):
+    # One full fetch to build the state from; returns None for the state when nothing was priced
+    provider = provider or get_provider()
+    history = call_with_retry(download_batch, tickers)
+    errors = {}
+    priced = []
+    for ticker, (data, latest_data) in history.items():
+        if data is None or data.empty or latest_data is None or latest_data.empty:
+            errors[ticker] = ValueError("NO PRICE DATA RETURNED")
+        else:
+            priced.append(ticker)
+    prime_quotes(priced, provider)
+    fundamentals = {}
+    for ticker, result, error in fetch_concurrently(lambda t: get_fundamentals(t, provider), priced):
+        if error is not None:
+            errors[ticker] = error
+        else:
+            fundamentals[ticker] = result
+    ready = {ticker: history[ticker] for ticker in priced if ticker in fundamentals}
+    return (LiveState(ready, fundamentals) if ready else None), errors
+
+
+def poll(state, provider=None):
+    # Fetches only the minute bars since the oldest last-seen bar, see LiveState.apply
+    provider = provider or get_provider()
+    with span('live_poll'):
+        bars = call_with_retry(provider.intraday_since, state.tickers, state.since())
+    return state.apply(bars)
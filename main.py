@@ -1,255 +1,85 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-from datetime import datetime, timedelta
-import plotly.graph_objects as go
+import numpy as np
 from streamlit.components.v1 import html
 
 import os
 import sys
+import time
 
-def calculate_vwap(data):
-    return (data['Close'] * data['Volume']).cumsum() / data['Volume'].cumsum()
+import config
+import market_calendar
+from instrumentation import configure_logging, finish_run, histograms, span, start_run
+from pipeline import (cached_regime, get_relative_strength, get_stock_data_batch, get_vix_data, get_vix_data_async,
+                      iter_stock_data)
+from live import poll, start as start_live
+from prefetch import get_cache, save_watchlist, start_prefetcher
+from query import RowTable, filter_rows
+from relative import CORRELATION_WINDOW, LOOKBACKS
+from snapshot import load_regime, load_table, save_table
 
-def get_stock_data(ticker):
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=365)  # 1 year ago
-    data = yf.download(ticker, start=start_date, end=end_date, interval="1d")
-    
-    latest_data = yf.download(ticker, period="1d", interval="1m")
-    latest_price = latest_data['Close'].iloc[-1]
-    current_volume = latest_data['Volume'].sum()
-    
-    data['SMA5'] = data['Close'].rolling(window=5).mean()
-    data['SMA50'] = data['Close'].rolling(window=50).mean()
-    data['SMA150'] = data['Close'].rolling(window=150).mean()
-    data['SMA200'] = data['Close'].rolling(window=200).mean()
-    
-    # Calculate 20-day average volume
-    avg_volume_20d = data['Volume'].rolling(window=20).mean().iloc[-1]
-    
-    year_start = pd.Timestamp(f'{datetime.now().year}-01-01')
-    year_start_data = data[data.index >= year_start].copy()
-    year_start_data['VWAP_YearStart'] = calculate_vwap(year_start_data)
-    
-    recent_high_date = data['Close'].idxmax()
-    recent_high_data = data[data.index >= recent_high_date].copy()
-    recent_high_data['VWAP_RecentHigh'] = calculate_vwap(recent_high_data)
-    
-    recent_low_date = data['Close'].idxmin()
-    recent_low_data = data[data.index >= recent_low_date].copy()
-    recent_low_data['VWAP_RecentLow'] = calculate_vwap(recent_low_data)
-    
-    ticker_info = yf.Ticker(ticker)
-    earnings_dates = ticker_info.earnings_dates
-    if earnings_dates is not None and not earnings_dates.empty:
-        earnings_dates.index = pd.to_datetime(earnings_dates.index)
-        current_time = datetime.now().astimezone(earnings_dates.index.tz)
-        latest_past_earnings_date = earnings_dates.index[earnings_dates.index <= current_time].max()
-        
-        if latest_past_earnings_date.tzinfo:
-            latest_past_earnings_date = latest_past_earnings_date.tz_localize(None)
-        
-        if latest_past_earnings_date <= data.index[-1]:
-            earnings_data = data[data.index >= latest_past_earnings_date].copy()
-            if not earnings_data.empty:
-                earnings_data['VWAP_Earnings'] = calculate_vwap(earnings_data)
-            else:
-                earnings_data = None
-        else:
-            earnings_data = None
-    else:
-        earnings_data = None
-
-    sma5 = data['SMA5'].iloc[-1]
-    sma50 = data['SMA50'].iloc[-1]
-    sma150 = data['SMA150'].iloc[-1]
-    sma200 = data['SMA200'].iloc[-1]
-    vwap_ytd = year_start_data['VWAP_YearStart'].iloc[-1]
-    vwap_high = recent_high_data['VWAP_RecentHigh'].iloc[-1]
-    vwap_low = recent_low_data['VWAP_RecentLow'].iloc[-1]
-    vwap_earnings = earnings_data['VWAP_Earnings'].iloc[-1] if earnings_data is not None else None
-
-    # Determine status
-    if latest_price < sma5:
-        status = 'AVOID'
-    elif latest_price > sma5 and latest_price > sma50 and latest_price > sma150 and latest_price > sma200 and \
-         latest_price > vwap_ytd and latest_price > vwap_low and \
-         (vwap_earnings is None or latest_price > vwap_earnings) and \
-         all(data[col].iloc[-1] > data[col].iloc[-2] for col in ['SMA5', 'SMA50', 'SMA150', 'SMA200']) and \
-         year_start_data['VWAP_YearStart'].iloc[-1] > year_start_data['VWAP_YearStart'].iloc[-2] and \
-         recent_low_data['VWAP_RecentLow'].iloc[-1] > recent_low_data['VWAP_RecentLow'].iloc[-2] and \
-         (earnings_data is None or earnings_data['VWAP_Earnings'].iloc[-1] > earnings_data['VWAP_Earnings'].iloc[-2]):
-        status = 'CLEAR'
-    elif latest_price > sma5 and data['SMA5'].iloc[-1] <= data['SMA5'].iloc[-2]:
-        status = 'CAUTION'
-    else:
-        status = ''
+VALUE_COLUMNS = ['SMA5', 'SMA50', 'SMA150', 'SMA200', 'VWAP_YearStart', 'VWAP_RecentHigh', 'VWAP_RecentLow', 'VWAP_Earnings']
+STATUS_COLORS = {'AVOID': 'red', 'CLEAR': 'green', 'CAUTION': 'darkorange'}
+TREND_COLORS = {'R': 'green', 'F': 'red'}
 
-    # Calculate P/Sales and P/FCF
-    stock = yf.Ticker(ticker)
-    market_cap = stock.info.get('marketCap')
-    
-    income_stmt = stock.quarterly_financials.T
-    cashflow_stmt = stock.quarterly_cashflow.T
-    
-    revenue_col = 'Total Revenue'
-    free_cash_flow_col = 'Free Cash Flow'
-    
-    if revenue_col in income_stmt.columns and free_cash_flow_col in cashflow_stmt.columns:
-        income_stmt = income_stmt.sort_index(ascending=False)
-        cashflow_stmt = cashflow_stmt.sort_index(ascending=False)
-        
-        ttm_revenue = income_stmt[revenue_col].head(4).sum()
-        ttm_free_cash_flow = cashflow_stmt[free_cash_flow_col].head(4).sum()
-        
-        p_s_ratio = market_cap / ttm_revenue if ttm_revenue and ttm_revenue != 0 else None
-        p_fcf_ratio = market_cap / ttm_free_cash_flow if ttm_free_cash_flow and ttm_free_cash_flow != 0 else None
-
-        # Calculate TTM trends
-        prev_ttm_revenue = income_stmt[revenue_col].iloc[1:5].sum()
-        prev_ttm_fcf = cashflow_stmt[free_cash_flow_col].iloc[1:5].sum()
-
-        ttm_revenue_trend = 'R' if ttm_revenue > prev_ttm_revenue else 'F'
-        ttm_fcf_trend = 'R' if ttm_free_cash_flow > prev_ttm_fcf else 'F'
-    else:
-        p_s_ratio = None
-        p_fcf_ratio = None
-        ttm_revenue_trend = None
-        ttm_fcf_trend = None
-
-    # Get the next earnings date
-    earnings_dates = ticker_info.earnings_dates
-    next_earnings_date = None
-    days_to_earnings = None
-
-    if earnings_dates is not None and not earnings_dates.empty:
-        earnings_dates.index = pd.to_datetime(earnings_dates.index)
-        current_time = datetime.now().astimezone(earnings_dates.index.tz)
-        future_earnings_dates = earnings_dates.index[earnings_dates.index > current_time]
-        
-        if not future_earnings_dates.empty:
-            next_earnings_date = future_earnings_dates.min()
-            
-            if next_earnings_date.tzinfo:
-                next_earnings_date = next_earnings_date.tz_localize(None)
-            
-            days_to_earnings = (next_earnings_date - pd.Timestamp.now()).days
-
-    return {
-        'latest_price': latest_price,
-        'status': status,
-        'days_to_earnings': days_to_earnings,
-        'SMA5': sma5,
-        'SMA5_trend': 'R' if data['SMA5'].iloc[-1] > data['SMA5'].iloc[-2] else 'F',
-        'SMA50': sma50,
-        'SMA50_trend': 'R' if data['SMA50'].iloc[-1] > data['SMA50'].iloc[-2] else 'F',
-        'SMA150': sma150,
-        'SMA150_trend': 'R' if data['SMA150'].iloc[-1] > data['SMA150'].iloc[-2] else 'F',
-        'SMA200': sma200,
-        'SMA200_trend': 'R' if data['SMA200'].iloc[-1] > data['SMA200'].iloc[-2] else 'F',
-        'VWAP_YearStart': vwap_ytd,
-        'VWAP_YearStart_trend': 'R' if year_start_data['VWAP_YearStart'].iloc[-1] > year_start_data['VWAP_YearStart'].iloc[-2] else 'F',
-        'VWAP_RecentHigh': vwap_high,
-        'VWAP_RecentHigh_trend': 'R' if recent_high_data['VWAP_RecentHigh'].iloc[-1] > recent_high_data['VWAP_RecentHigh'].iloc[-2] else 'F',
-        'VWAP_RecentLow': vwap_low,
-        'VWAP_RecentLow_trend': 'R' if recent_low_data['VWAP_RecentLow'].iloc[-1] > recent_low_data['VWAP_RecentLow'].iloc[-2] else 'F',
-        'VWAP_Earnings': vwap_earnings,
-        'VWAP_Earnings_trend': 'R' if earnings_data is not None and earnings_data['VWAP_Earnings'].iloc[-1] > earnings_data['VWAP_Earnings'].iloc[-2] else 'F' if earnings_data is not None else None,
-        'current_volume': current_volume,
-        'avg_volume_20d': avg_volume_20d,
-        'P/S': p_s_ratio,
-        'P/S_trend': ttm_revenue_trend,
-        'P/FCF': p_fcf_ratio,
-        'P/FCF_trend': ttm_fcf_trend
-    }
+def numeric_column(rows, key):
+    return np.array([np.nan if row[key] in ('N/A', None) else row[key] for row in rows], dtype=float)
+
+def format_column(values, spec):
+    return ['N/A' if np.isnan(v) else format(v, spec) for v in values.tolist()]
+
+def trend_column(rows, key):
+    return [row[key] or '' for row in rows]
+
+def table_columns(data):
+    # Display strings and fill colors for every column, computed a column at a time from the
+    # numeric values rather than by formatting each row and parsing it back for the colors
+    rows = list(data.values())
+    n = len(rows)
+    black = np.full(n, 'black', dtype=object)
+
+    price = numeric_column(rows, 'latest_price')
+    status = [row['status'] for row in rows]
+    days = numeric_column(rows, 'days_to_earnings')
+    columns = [
+        (list(data), black),
+        (status, np.array([STATUS_COLORS.get(s, 'black') for s in status], dtype=object)),
+        (format_column(days, '.0f'), np.where(days <= 21, 'darkorange', black)),
+        (format_column(price, '.2f'), black),
+    ]
+
+    for key in VALUE_COLUMNS:
+        values = numeric_column(rows, key)
+        # Colors compare the value as displayed (2 decimals) against the last price
+        shown = np.round(values, 2)
+        fill = np.where(shown > price, 'red', np.where(shown < price, 'green', black))
+        trends = trend_column(rows, f'{key}_trend')
+        columns.append((format_column(values, '.2f'), fill))
+        columns.append((trends, np.array([TREND_COLORS.get(t, 'black') for t in trends], dtype=object)))
+
+    volume = numeric_column(rows, 'current_volume')
+    avg_volume = numeric_column(rows, 'avg_volume_20d')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(avg_volume != 0, volume / avg_volume, np.nan)
+    columns.append((format_column(ratio, '.2f'), np.where(np.round(ratio, 2) > 1, 'darkorange', black)))
+
+    for key in ('P/S', 'P/FCF'):
+        trends = trend_column(rows, f'{key}_trend')
+        columns.append((format_column(numeric_column(rows, key), '.1f'), black))
+        columns.append((trends, np.array([TREND_COLORS.get(t, 'black') for t in trends], dtype=object)))
+
+    return [values for values, _ in columns], [list(fill) for _, fill in columns]
 
-def create_table(data):
+def create_table(data, page=0, page_size=None):
     headers = [
         'TICKER', 'STATUS', 'E', 'LAST', '5D SMA', '', '50D SMA', '', '150D SMA', '', '200D SMA', '',
         'VWAP YTD', '', 'VWAP H', '', 'VWAP L', '', 'VWAP E', '', 'VOL/20D AVG', 'P/S', '', 'P/FCF', ''
     ]
 
-    table_data = []
-    cell_colors = []
-    font_colors = []
-
-    for ticker, values in data.items():
-        row = [
-            ticker,
-            values['status'],
-            str(values['days_to_earnings']) if values['days_to_earnings'] is not None else 'N/A',
-            f"{values['latest_price']:.2f}",
-            f"{values['SMA5']:.2f}" if values['SMA5'] != 'N/A' else 'N/A', values['SMA5_trend'],
-            f"{values['SMA50']:.2f}" if values['SMA50'] != 'N/A' else 'N/A', values['SMA50_trend'],
-            f"{values['SMA150']:.2f}" if values['SMA150'] != 'N/A' else 'N/A', values['SMA150_trend'],
-            f"{values['SMA200']:.2f}" if values['SMA200'] != 'N/A' else 'N/A', values['SMA200_trend'],
-            f"{values['VWAP_YearStart']:.2f}" if values['VWAP_YearStart'] != 'N/A' else 'N/A', values['VWAP_YearStart_trend'],
-            f"{values['VWAP_RecentHigh']:.2f}" if values['VWAP_RecentHigh'] != 'N/A' else 'N/A', values['VWAP_RecentHigh_trend'],
-            f"{values['VWAP_RecentLow']:.2f}" if values['VWAP_RecentLow'] != 'N/A' else 'N/A', values['VWAP_RecentLow_trend'],
-            f"{values['VWAP_Earnings']:.2f}" if values['VWAP_Earnings'] not in ['N/A', None] else 'N/A',
-            values['VWAP_Earnings_trend'] if values['VWAP_Earnings_trend'] else '',
-            f"{values['current_volume'] / values['avg_volume_20d']:.2f}" if values['avg_volume_20d'] != 0 else 'N/A',
-            f"{values['P/S']:.1f}" if values['P/S'] not in ['N/A', None] else 'N/A',
-            values['P/S_trend'] if values['P/S_trend'] else '',
-            f"{values['P/FCF']:.1f}" if values['P/FCF'] not in ['N/A', None] else 'N/A',
-            values['P/FCF_trend'] if values['P/FCF_trend'] else ''
-        ]
-        
-        row_colors = ['black'] * len(row)
-        row_font_colors = ['white'] * len(row)
-        
-        # Set colors for STATUS column
-        if values['status'] == 'AVOID':
-            row_colors[1] = 'red'
-            row_font_colors[1] = 'white'
-        elif values['status'] == 'CLEAR':
-            row_colors[1] = 'green'
-            row_font_colors[1] = 'white'
-        elif values['status'] == 'CAUTION':
-            row_colors[1] = 'darkorange'
-            row_font_colors[1] = 'white'
-        
-        # Set color for 'E' column
-        if values['days_to_earnings'] is not None and values['days_to_earnings'] <= 21:
-            row_colors[2] = 'darkorange'
-            row_font_colors[2] = 'white'
-        
-        # Set colors for SMA and VWAP columns
-        value_indices = [4, 6, 8, 10, 12, 14, 16, 18]
-        for i in value_indices:
-            if row[i] != 'N/A' and values['latest_price'] != 'N/A':
-                try:
-                    if float(row[i].replace('$', '')) > values['latest_price']:
-                        row_colors[i] = 'red'
-                    elif float(row[i].replace('$', '')) < values['latest_price']:
-                        row_colors[i] = 'green'
-                except ValueError:
-                    # If conversion fails, leave the color as black
-                    pass
-        
-        # Set colors for trend columns
-        trend_indices = [5, 7, 9, 11, 13, 15, 17, 19, 22, 24]
-        for i in trend_indices:
-            if row[i] == 'R':
-                row_colors[i] = 'green'
-                row_font_colors[i] = 'white'
-            elif row[i] == 'F':
-                row_colors[i] = 'red'
-                row_font_colors[i] = 'white'
-        
-        # Set color for volume comparison
-        if row[-5] != 'N/A':
-            try:
-                if float(row[-5]) > 1:
-                    row_colors[-5] = 'darkorange'
-            except ValueError:
-                # If conversion fails, leave the color as black
-                pass
-        
-        table_data.append(row)
-        cell_colors.append(row_colors)
-        font_colors.append(row_font_colors)
+    # Only the requested page is formatted and sent to the browser
+    if page_size:
+        data = dict(list(data.items())[page * page_size:(page + 1) * page_size])
+    cell_values, cell_colors = table_columns(data)
 
     # Define column widths
     column_widths = [
@@ -288,25 +118,30 @@ def create_table(data):
         'right', 'center'  # P/FCF and trend
     ]
 
-    fig = go.Figure(data=[go.Table(
+    # Plotly is only imported once there is a table to draw
+    import plotly.graph_objects as go
+
+    # Every cell value and color above comes from fixed formats and palettes, so skip Plotly's
+    # per-cell validation, which otherwise dominates the cost of large tables
+    fig = go.Figure(data=[dict(
+        type='table',
         header=dict(
             values=[f"<b>{h}</b>" for h in headers],
-            fill_color='black',
+            fill=dict(color='black'),
             align=column_alignment,
             font=dict(color='#FF9933', size=18),
             height=40
         ),
         cells=dict(
-            values=[list(col) for col in zip(*table_data)],
+            values=cell_values,
             align=column_alignment,
-            font=dict(color=[list(col) for col in zip(*font_colors)], size=18),
-            fill=dict(color=[list(col) for col in zip(*cell_colors)]),
+            font=dict(color='white', size=18),
+            fill=dict(color=cell_colors),
             height=30,
-            line_color='darkslategray',
-            line_width=1
+            line=dict(color='darkslategray', width=1)
         ),
         columnwidth=column_widths
-    )])
+    )], _validate=False)
 
     # Calculate the total width of all columns
     total_width = sum(column_widths)
@@ -323,52 +158,334 @@ def create_table(data):
 
     return fig
 
-def get_vix_data():
-    tickers = ["^VIX", "VXX", "VXZ", "QQQ", "SPY"]
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=365)  # Fetch 1 year of data to ensure enough for 150-day MA
-    data = yf.download(tickers, start=start_date, end=end_date)
-    
-    vix_data = data['Close']['^VIX']
-    vxx_data = data['Close']['VXX']
-    vxz_data = data['Close']['VXZ']
-    qqq_data = data['Close']['QQQ']
-    spy_data = data['Close']['SPY']
-    
-    vix_spot = vix_data.iloc[-1]
-    vxx_price = vxx_data.iloc[-1]
-    vxz_price = vxz_data.iloc[-1]
-    qqq_price = qqq_data.iloc[-1]
-    spy_price = spy_data.iloc[-1]
-    
-    vix_ma20 = vix_data.rolling(window=20).mean().iloc[-1]
-    vxx_ma20 = vxx_data.rolling(window=20).mean().iloc[-1]
-    vxz_ma20 = vxz_data.rolling(window=20).mean().iloc[-1]
-    
-    vix_ratio = vix_spot / vix_ma20
-    vxx_ratio = vxx_price / vxx_ma20
-    vxz_ratio = vxz_price / vxz_ma20
-
-    # Calculate SMAs for QQQ and SPY
-    qqq_sma5 = qqq_data.rolling(window=5).mean().iloc[-1]
-    qqq_sma150 = qqq_data.rolling(window=150).mean().iloc[-1]
-    spy_sma5 = spy_data.rolling(window=5).mean().iloc[-1]
-    spy_sma150 = spy_data.rolling(window=150).mean().iloc[-1]
-
-    # Determine short-term and long-term trends
-    qqq_st = 'green' if qqq_price > qqq_sma5 else 'red'
-    qqq_lt = 'green' if qqq_price > qqq_sma150 else 'red'
-    spy_st = 'green' if spy_price > spy_sma5 else 'red'
-    spy_lt = 'green' if spy_price > spy_sma150 else 'red'
-
-    # Debug output
-    print(f"QQQ Price: {qqq_price:.2f}, QQQ 5 SMA: {qqq_sma5:.2f}, QQQ 150 SMA: {qqq_sma150:.2f}, QQQ ST Color: {qqq_st}, QQQ LT Color: {qqq_lt}")
-    print(f"SPY Price: {spy_price:.2f}, SPY 5 SMA: {spy_sma5:.2f}, SPY 150 SMA: {spy_sma150:.2f}, SPY ST Color: {spy_st}, SPY LT Color: {spy_lt}")
-    
-    return vix_spot, vxx_price, vxz_price, vix_ratio, vxx_ratio, vxz_ratio, qqq_price, qqq_st, qqq_lt, spy_price, spy_st, spy_lt, qqq_sma5, qqq_sma150, spy_sma5, spy_sma150
+def plot_table(container, data, page=0, page_size=None):
+    with span('create_table'):
+        fig = create_table(data, page, page_size)
+    # Plotly serializes the figure inside plotly_chart
+    with span('render'):
+        container.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+
+def create_relative_table(tickers, strength):
+    # One column per benchmark and lookback: how much better (green) or worse (red) than the
+    # benchmark each ticker did
+    import plotly.graph_objects as go
+
+    headers = ['TICKER'] + [f"VS {symbol} {label}" for symbol in strength for label, _ in LOOKBACKS]
+    values = [tickers]
+    colors = [['black'] * len(tickers)]
+    for symbol, table in strength.items():
+        for j in range(table.shape[1]):
+            column = table[:, j]
+            values.append(['N/A' if np.isnan(v) else f"{v:+.1%}" for v in column.tolist()])
+            colors.append(np.where(column > 0, 'green', np.where(column < 0, 'red', 'black')).tolist())
+    fig = go.Figure(data=[dict(
+        type='table',
+        header=dict(values=[f"<b>{h}</b>" for h in headers], fill=dict(color='black'),
+                    font=dict(color='#FF9933', size=18), height=40),
+        cells=dict(values=values, align=['left'] + ['right'] * (len(headers) - 1),
+                   font=dict(color='white', size=18), fill=dict(color=colors), height=30,
+                   line=dict(color='darkslategray', width=1)),
+    )], _validate=False)
+    fig.update_layout(margin=dict(l=0, r=0, t=0, b=0), paper_bgcolor='black', plot_bgcolor='black',
+                      height=len(tickers) * 30 + 40)
+    return fig
+
+def create_correlation_heatmap(tickers, corr):
+    import plotly.graph_objects as go
+
+    fig = go.Figure(data=[dict(
+        type='heatmap', z=corr, x=tickers, y=tickers, zmin=-1, zmax=1, colorscale='RdYlGn',
+        hovertemplate='%{y} / %{x}: %{z:.2f}<extra></extra>',
+    )], _validate=False)
+    size = min(max(len(tickers) * 20, 300), 1200)
+    fig.update_layout(margin=dict(l=0, r=0, t=0, b=0), paper_bgcolor='black', plot_bgcolor='black',
+                      font=dict(color='#FF9933'), height=size, yaxis=dict(autorange='reversed'))
+    return fig
+
+def render_relative(tickers):
+    # Relative strength against SPY and QQQ and the correlations of daily returns across the
+    # rows shown, computed from the daily bars already loaded
+    try:
+        names, strength, corr = get_relative_strength(tickers)
+    except Exception as e:
+        st.error(f"ERROR COMPUTING RELATIVE STRENGTH: {str(e)}")
+        return
+    if not names:
+        return
+    st.markdown("<h1>RELATIVE STRENGTH</h1>", unsafe_allow_html=True)
+    with span('create_table'):
+        fig = create_relative_table(names, strength)
+    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+    if len(names) > 1:
+        st.markdown(f"<h1>CORRELATION ({CORRELATION_WINDOW}D DAILY RETURNS)</h1>", unsafe_allow_html=True)
+        st.plotly_chart(create_correlation_heatmap(names, corr), use_container_width=True,
+                        config={'displayModeBar': False})
+
+def view_changed():
+    # Paging and filtering only change what is shown, so the next rerun reuses the rows
+    st.session_state['view_changed'] = True
+
+def row_table(data):
+    # The query index over a row set, kept in session state with the rows it was built from. Reruns
+    # for a filter keystroke or a page change pass the same row objects and query it as it is;
+    # only a new or changed row rebuilds it
+    cached = st.session_state.get('row_table')
+    if cached is not None and len(cached[0]) == len(data) and all(
+            cached[0].get(ticker) is row for ticker, row in data.items()):
+        return cached[1]
+    table = RowTable(data)
+    st.session_state['row_table'] = (dict(data), table)
+    return table
+
+def filter_table(data, report=False):
+    # Rows matching the FILTER box in its order, or all of them when it is empty or invalid
+    text = st.session_state.get('filter', '')
+    if not text or not text.strip() or not data:
+        return data
+    try:
+        return filter_rows(data, text, row_table(data))
+    except ValueError as e:
+        if report:
+            st.error(f"INVALID FILTER: {str(e)}")
+        return data
+
+def table_page(data):
+    # Long watchlists are shown a page at a time; changing the page reruns the script, which then
+    # reuses the rows kept in session state instead of fetching them again
+    page_size = config.TABLE_PAGE_SIZE
+    pages = max(1, -(-len(data) // page_size))
+    page = 0
+    if pages > 1:
+        if st.session_state.get('table_page', 1) > pages:
+            st.session_state['table_page'] = 1
+        page = st.number_input(f"PAGE (OF {pages}, {len(data)} ROWS)", min_value=1, max_value=pages,
+                               step=1, key='table_page', on_change=view_changed) - 1
+    return page, page_size
+
+def render_table(container, data):
+    st.session_state['table_rows'] = data
+    data = filter_table(data, report=True)
+    if not data:
+        container.warning("NO ROWS MATCH THE FILTER.")
+        return
+    plot_table(container, data, *table_page(data))
+
+    # Add custom CSS for horizontal scrolling
+    st.markdown("""
+    <style>
+    .stPlotlyChart {
+        overflow-x: auto;
+        white-space: nowrap;
+    }
+    </style>
+    """, unsafe_allow_html=True)
+
+def render_streaming(tickers, cached=None, stale=None):
+    # Shows rows as soon as they are computed. Re-rendering is throttled to at most every
+    # RENDER_INTERVAL seconds and never more often than twice the last render took, so rebuilding
+    # the figure cannot dominate the refresh however many rows arrive. Rows in `cached` are shown
+    # straight away and not fetched again; rows of the `stale` snapshot (tickers, rows, saved at)
+    # stand in for the others, marked stale, until they are fetched
+    unique = list(dict.fromkeys(tickers))
+    data = {t: cached[t] for t in unique if cached and t in cached}
+    todo = [t for t in unique if t not in data]
+    stale_rows = {t: stale[1][t] for t in todo if t in stale[1]} if stale else {}
+    progress = st.progress(0.0, text=f"FETCHING DATA... 0/{len(todo)}")
+    stale_area = st.empty()
+    error_area = st.container()
+    table_area = st.empty()
+
+    def shown():
+        return {t: data.get(t, stale_rows.get(t)) for t in unique if t in data or t in stale_rows}
+
+    rendered = 0
+    if data or stale_rows:
+        plot_table(table_area, filter_table(shown()), 0, config.TABLE_PAGE_SIZE)
+        rendered = len(data)
+        if stale_rows:
+            render_last_updated(stale_area, stale[2], stale=True)
+    done = 0
+    last_render = 0.0
+    render_cost = 0.0
+    try:
+        for rows, errors in iter_stock_data(todo, flush_interval=config.RENDER_INTERVAL / 2):
+            data.update(rows)
+            done += len(rows) + len(errors)
+            for ticker, e in errors.items():
+                error_area.error(f"ERROR FETCHING DATA FOR {ticker}: {str(e)}")
+            progress.progress(done / len(todo), text=f"FETCHING DATA... {done}/{len(todo)}")
+
+            now = time.monotonic()
+            if len(data) > rendered and now - last_render >= max(config.RENDER_INTERVAL, 2 * render_cost):
+                plot_table(table_area, filter_table(shown()), 0, config.TABLE_PAGE_SIZE)
+                rendered = len(data)
+                last_render = time.monotonic()
+                render_cost = last_render - now
+    except Exception as e:
+        for ticker in todo:
+            if ticker not in data:
+                error_area.error(f"ERROR FETCHING DATA FOR {ticker}: {str(e)}")
+    progress.empty()
+    stale_area.empty()
+
+    # Final render in input order
+    data = {t: data[t] for t in unique if t in data}
+    if data:
+        render_table(table_area, data)
+    else:
+        table_area.warning("NO VALID DATA TO DISPLAY.")
+    return data
+
+def render_live(tickers):
+    # Builds the live state once per watchlist and renders it; the returned function then polls
+    # new minute bars every LIVE_INTERVAL seconds and redraws in place until a rerun interrupts it
+    unique = list(dict.fromkeys(tickers))
+    error_area = st.container()
+    table_area = st.empty()
+    updated_area = st.empty()
+
+    live = st.session_state.get('live')
+    if live is None or live[0] != unique:
+        with st.spinner("FETCHING DATA..."):
+            try:
+                state, errors = start_live(unique)
+            except Exception as e:
+                state, errors = None, {ticker: e for ticker in unique}
+        live = (unique, state, errors)
+        st.session_state['live'] = live
+    _, state, errors = live
+    for ticker, e in errors.items():
+        error_area.error(f"ERROR FETCHING DATA FOR {ticker}: {str(e)}")
+    if state is None:
+        table_area.warning("NO VALID DATA TO DISPLAY.")
+        return None
+
+    rows = state.rows()
+    st.session_state['table_rows'] = rows
+    shown = filter_table(rows, report=True)
+    page, page_size = table_page(shown)
+    plot_table(table_area, shown, page, page_size)
+    render_last_updated(updated_area, max(state.last_bar))
+
+    def keep_updating():
+        # Streamlit only stops a script at its next st call, so every pass makes one and a rerun
+        # from the ticker input, filter or LIVE toggle interrupts the loop. Once the market closes
+        # there is nothing left to poll and the script ends with the last table on the page
+        while market_calendar.is_open():
+            time.sleep(config.LIVE_INTERVAL)
+            try:
+                changed = poll(state)
+            except Exception as e:
+                error_area.error(f"ERROR POLLING LIVE DATA: {str(e)}")
+                continue
+            if changed is None:
+                # A new session started; rebuild from the daily bars
+                st.session_state.pop('live', None)
+                st.experimental_rerun()
+            if changed:
+                plot_table(table_area, filter_table(state.rows()), page, page_size)
+            render_last_updated(updated_area, max(state.last_bar))
+    return keep_updating
+
+def render_last_updated(container, updated, stale=False):
+    updated = updated.astimezone(market_calendar.EXCHANGE_TZ)
+    note = " (STALE, REFRESHING...)" if stale else ""
+    container.markdown(f"<div class='last-updated'>LAST UPDATED {updated:%Y-%m-%d %H:%M:%S} ET{note}</div>",
+                unsafe_allow_html=True)
+
+def render_late(container, data):
+    # Rows with stages that missed their deadline show N/A or stale values in those columns
+    late = {ticker: row['late'] for ticker, row in data.items() if row.get('late')}
+    if late:
+        stages = sorted({stage for value in late.values() for stage in value.split(', ')})
+        container.warning(f"SLOW UPSTREAM ({', '.join(stages).upper().replace('_', ' ')}): "
+                          f"N/A OR STALE COLUMNS FOR {', '.join(late)} FILL IN ON THE NEXT REFRESH")
+
+def render_header(container, values, stale_at=None):
+    # Header with the regime boxes; `stale_at` marks values from the last snapshot
+    vix_spot, vxx_price, vxz_price, vix_ratio, vxx_ratio, vxz_ratio, qqq_price, qqq_st, qqq_lt, spy_price, spy_st, spy_lt, qqq_sma5, qqq_sma150, spy_sma5, spy_sma150 = values
+    stale_note = ""
+    if stale_at is not None:
+        stale_note = f"<div class='last-updated'>AS OF {stale_at.astimezone(market_calendar.EXCHANGE_TZ):%Y-%m-%d %H:%M} ET (STALE)</div>"
+
+    # Determine colors based on conditions
+    vix_color = "red" if vix_spot > vxx_price or vix_spot > vxz_price else "green"
+    vxx_color = "red" if vxx_price > vxz_price else "green"
+
+    # Ensure LT colors are set correctly
+    qqq_lt = 'green' if qqq_price > qqq_sma150 else 'red' if not pd.isna(qqq_sma150) else 'gray'
+    spy_lt = 'green' if spy_price > spy_sma150 else 'red' if not pd.isna(spy_sma150) else 'gray'
+
+    # Header with title, VIX boxes, QQQ and SPY boxes, and info button
+    container.markdown(f"""
+    <div class="header-container">
+        <div class="title-and-vix">
+            <h1>SKYHOOK スカイフック v0.2</h1>
+            <div class="vix-container">
+                <div class="vix-box" style="background-color: {vix_color}; color: white;">
+                    VIX: {vix_spot:.2f} [{vix_ratio:.2f}]
+                </div>
+                <div class="vix-box" style="background-color: {vxx_color}; color: white;">
+                    VXX: {vxx_price:.2f} [{vxx_ratio:.2f}]
+                </div>
+                <div class="vix-box" style="background-color: black; color: #FF9933; border: 1px solid #FF9933;">
+                    VXZ: {vxz_price:.2f} [{vxz_ratio:.2f}]
+                </div>
+                <div class="spacer"></div>
+                <div class="vix-box" style="background-color: black; color: #FF9933; border: 1px solid #FF9933;">
+                    QQQ: {qqq_price:.2f}
+                </div>
+                <div class="vix-box" style="background-color: {qqq_st}; color: white;">
+                    ST
+                </div>
+                <div class="vix-box" style="background-color: {qqq_lt}; color: white;">
+                    LT
+                </div>
+                <div class="spacer"></div>
+                <div class="vix-box" style="background-color: black; color: #FF9933; border: 1px solid #FF9933;">
+                    SPY: {spy_price:.2f}
+                </div>
+                <div class="vix-box" style="background-color: {spy_st}; color: white;">
+                    ST
+                </div>
+                <div class="vix-box" style="background-color: {spy_lt}; color: white;">
+                    LT
+                </div>
+                {stale_note}
+            </div>
+        </div>
+        <button class="info-button" onclick="toggleInfo()">Press i for info</button>
+    </div>
+    """, unsafe_allow_html=True)
+
+def render_diagnostics(run):
+    # Hidden per-rerun timing panel, toggled with `d`
+    rows = ''.join(
+        f"<tr><td>{stage.upper()}</td><td>{entry['count']}</td><td>{entry['total'] * 1000:.0f}</td>"
+        f"<td>{entry['max'] * 1000:.0f}</td><td>{entry['max_ticker'] or ''}</td></tr>"
+        for stage, entry in sorted(run.summary().items(), key=lambda item: -item[1]['total'])
+    )
+    # Process-wide upstream fetches, and how many waited on one another session already had in flight
+    fetches = ' &nbsp; '.join(
+        f"{kind.upper()} {counts['issued']} ISSUED / {counts['coalesced']} COALESCED"
+        for kind, counts in sorted(histograms.fetch_counts().items())
+    )
+    late = ' &nbsp; '.join(f"{stage.upper()} {count} LATE" for stage, count in sorted(histograms.late_counts().items()))
+    st.markdown(f"""
+    <div id="diagnostics-section" class="diagnostics-section">
+        <strong>DIAGNOSTICS</strong> &nbsp; RUN {run.id} &nbsp; {(time.time() - run.started) * 1000:.0f} MS TOTAL
+        <table class="diagnostics-table">
+            <tr><th>STAGE</th><th>CALLS</th><th>TOTAL MS</th><th>MAX MS</th><th>SLOWEST</th></tr>
+            {rows}
+        </table>
+        {fetches} {late}
+    </div>
+    """, unsafe_allow_html=True)
 
 def main():
     st.set_page_config(page_title="Skyhook v0.2", layout="wide")
+    configure_logging()
+    run = start_run('rerun')
     
 # Update the CSS to include styles for spacing
     st.markdown("""
@@ -453,6 +570,28 @@ def main():
         border-top: 1px solid #FF9933;
         z-index: 999;
     }
+    .diagnostics-section {
+        display: none;
+        position: fixed;
+        top: 60px;
+        right: 10px;
+        background-color: #1E1E1E;
+        color: #FF9933;
+        padding: 10px 20px;
+        border: 1px solid #FF9933;
+        font-size: 12px;
+        z-index: 999;
+    }
+    .last-updated {
+        color: #FF9933;
+        font-size: 12px;
+        text-align: right;
+    }
+    .diagnostics-table th, .diagnostics-table td {
+        padding: 2px 8px;
+        text-align: right;
+        border: none;
+    }
     .info-content {
         display: flex;
         justify-content: space-between;
@@ -490,57 +629,22 @@ def main():
     </style>
     """, unsafe_allow_html=True)
 
-    # Fetch VIX, QQQ, and SPY data
-    vix_spot, vxx_price, vxz_price, vix_ratio, vxx_ratio, vxz_ratio, qqq_price, qqq_st, qqq_lt, spy_price, spy_st, spy_lt, qqq_sma5, qqq_sma150, spy_sma5, spy_sma150 = get_vix_data()
+    if config.PREFETCH:
+        start_prefetcher()
 
-    # Determine colors based on conditions
-    vix_color = "red" if vix_spot > vxx_price or vix_spot > vxz_price else "green"
-    vxx_color = "red" if vxx_price > vxz_price else "green"
-
-    # Ensure LT colors are set correctly
-    qqq_lt = 'green' if qqq_price > qqq_sma150 else 'red' if not pd.isna(qqq_sma150) else 'gray'
-    spy_lt = 'green' if spy_price > spy_sma150 else 'red' if not pd.isna(spy_sma150) else 'gray'
-
-    # Header with title, VIX boxes, QQQ and SPY boxes, and info button
-    st.markdown(f"""
-    <div class="header-container">
-        <div class="title-and-vix">
-            <h1>SKYHOOK スカイフック v0.2</h1>
-            <div class="vix-container">
-                <div class="vix-box" style="background-color: {vix_color}; color: white;">
-                    VIX: {vix_spot:.2f} [{vix_ratio:.2f}]
-                </div>
-                <div class="vix-box" style="background-color: {vxx_color}; color: white;">
-                    VXX: {vxx_price:.2f} [{vxx_ratio:.2f}]
-                </div>
-                <div class="vix-box" style="background-color: black; color: #FF9933; border: 1px solid #FF9933;">
-                    VXZ: {vxz_price:.2f} [{vxz_ratio:.2f}]
-                </div>
-                <div class="spacer"></div>
-                <div class="vix-box" style="background-color: black; color: #FF9933; border: 1px solid #FF9933;">
-                    QQQ: {qqq_price:.2f}
-                </div>
-                <div class="vix-box" style="background-color: {qqq_st}; color: white;">
-                    ST
-                </div>
-                <div class="vix-box" style="background-color: {qqq_lt}; color: white;">
-                    LT
-                </div>
-                <div class="spacer"></div>
-                <div class="vix-box" style="background-color: black; color: #FF9933; border: 1px solid #FF9933;">
-                    SPY: {spy_price:.2f}
-                </div>
-                <div class="vix-box" style="background-color: {spy_st}; color: white;">
-                    ST
-                </div>
-                <div class="vix-box" style="background-color: {spy_lt}; color: white;">
-                    LT
-                </div>
-            </div>
-        </div>
-        <button class="info-button" onclick="toggleInfo()">Press i for info</button>
-    </div>
-    """, unsafe_allow_html=True)
+    # Fetch VIX, QQQ, and SPY data. Until the shared values are warm, the last snapshot is painted
+    # straight away and the current values are fetched alongside the rest of the page
+    header_area = st.empty()
+    regime = cached_regime()
+    regime_snapshot = load_regime() if regime is None and config.SNAPSHOT else None
+    pending_regime = None
+    if regime is not None:
+        render_header(header_area, regime)
+    elif regime_snapshot is not None:
+        render_header(header_area, *regime_snapshot)
+        pending_regime = get_vix_data_async()
+    else:
+        render_header(header_area, get_vix_data())
 
     # Info section (initially hidden)
     st.markdown("""
@@ -574,8 +678,18 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
-    # Input for stock tickers
+    # Input for stock tickers. The table snapshot is shared by every session in the process, so it
+    # never fills in the box (that would hand one user's watchlist to the next); its rows only
+    # stand in, marked stale, for the tickers a session enters itself
+    table_snapshot = load_table() if config.SNAPSHOT else None
     tickers_input = st.text_input("ENTER TICKERS (SPACE-SEPARATED):", key="tickers")
+    st.text_input("FILTER (E.G. STATUS == CLEAR AND E > 21 AND VOL_RATIO > 1.5 ORDER BY P/S LIMIT 20):",
+                  key="filter", on_change=view_changed)
+    live_mode = st.checkbox("LIVE", value=config.LIVE_MODE, key="live_mode",
+                            help=f"Update prices every {config.LIVE_INTERVAL:g}s while the market is open")
+    show_relative = st.checkbox("RELATIVE STRENGTH", value=config.RELATIVE_STRENGTH, key="show_relative",
+                                on_change=view_changed,
+                                help="Returns against SPY and QQQ and correlations across the rows shown")
     
     # Keyboard shortcut handling
     js = """
@@ -586,27 +700,35 @@ def main():
             const infoSection = doc.getElementById('info-section');
             infoSection.style.display = infoSection.style.display === 'none' ? 'block' : 'none';
         }
+        function toggleDiagnostics() {
+            const section = doc.getElementById('diagnostics-section');
+            if (section) section.style.display = section.style.display === 'block' ? 'none' : 'block';
+        }
         doc.addEventListener('keydown', function(e) {
+            // Enter and Escape act on the focused box (tickers or filter), the ticker box otherwise
+            const typing = e.target.tagName === 'INPUT';
             if (e.key === 'Enter') {
                 e.preventDefault();
-                const inputField = doc.querySelector('.stTextInput input');
-                if (inputField && inputField.value.trim() !== '') {
+                const inputField = typing ? e.target : doc.querySelector('.stTextInput input');
+                if (inputField && (inputField.value.trim() !== '' || typing)) {
                     inputField.blur();
-                    inputField.form.requestSubmit();
+                    if (inputField.form) inputField.form.requestSubmit();
                 }
             } else if (e.key === 'Escape') {
                 e.preventDefault();
-                const inputField = doc.querySelector('.stTextInput input');
+                const inputField = typing ? e.target : doc.querySelector('.stTextInput input');
                 if (inputField) {
                     inputField.value = '';
                     inputField.dispatchEvent(new Event('input', { bubbles: true }));
                 }
-            } else if (e.key === '/') {
+            } else if (e.key === '/' && !typing) {
                 e.preventDefault();
                 const inputField = doc.querySelector('.stTextInput input');
                 if (inputField) inputField.focus();
-            } else if (e.key === 'i' || e.key === 'I') {
+            } else if ((e.key === 'i' || e.key === 'I') && !typing) {
                 toggleInfo();
+            } else if ((e.key === 'd' || e.key === 'D') && !typing) {
+                toggleDiagnostics();
             }
         });
     });
@@ -614,47 +736,87 @@ def main():
     """
     html(js, height=0)
     
-    if tickers_input:
+    keep_updating = None
+    if tickers_input and live_mode:
         tickers = [ticker.strip().upper() for ticker in tickers_input.split() if ticker.strip()]
-        with st.spinner("FETCHING DATA..."):
-            data = {}
-            for ticker in tickers:
-                try:
-                    data[ticker] = get_stock_data(ticker)
-                except Exception as e:
-                    st.error(f"ERROR FETCHING DATA FOR {ticker}: {str(e)}")
-            
-            if data:
-                fig = create_table(data)
-                st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-                
-                # Add custom CSS for horizontal scrolling
-                st.markdown("""
-                <style>
-                .stPlotlyChart {
-                    overflow-x: auto;
-                    white-space: nowrap;
-                }
-                </style>
-                """, unsafe_allow_html=True)
+        keep_updating = render_live(tickers)
+    elif tickers_input:
+        tickers = [ticker.strip().upper() for ticker in tickers_input.split() if ticker.strip()]
+        # Rows the prefetcher (or an earlier rerun) computed recently are read from the shared
+        # cache; only the rest are fetched now
+        cached, missing, updated = {}, list(dict.fromkeys(tickers)), None
+        if config.PREFETCH:
+            cached, missing, updated = get_cache().lookup(tickers)
+        rows = st.session_state.get('table_rows')
+        if st.session_state.pop('view_changed', False) and rows and set(rows) <= set(tickers):
+            render_table(st, rows)
+        elif not missing:
+            render_table(st, cached)
+            if config.SNAPSHOT:
+                save_table(cached)
+        else:
+            if config.STREAMING_RENDER:
+                data = render_streaming(tickers, cached, table_snapshot)
             else:
-                st.warning("NO VALID DATA TO DISPLAY.")
+                with st.spinner("FETCHING DATA..."):
+                    try:
+                        fetched, errors = get_stock_data_batch(missing)
+                    except Exception as e:
+                        fetched, errors = {}, {ticker: e for ticker in missing}
+                    for ticker, e in sorted(errors.items(), key=lambda item: tickers.index(item[0])):
+                        st.error(f"ERROR FETCHING DATA FOR {ticker}: {str(e)}")
+                    data = {t: cached.get(t, fetched.get(t)) for t in dict.fromkeys(tickers) if t in cached or t in fetched}
+
+                    if data:
+                        render_table(st, data)
+                    else:
+                        st.warning("NO VALID DATA TO DISPLAY.")
+            render_late(st, data)
+            if config.PREFETCH:
+                get_cache().update({t: data[t] for t in missing if t in data})
+            if config.SNAPSHOT:
+                save_table(data)
+            updated = updated if cached else market_calendar.now()
+        if config.PREFETCH and updated is not None:
+            render_last_updated(st, updated)
+            if st.button("SAVE WATCHLIST", help="Keep these tickers refreshed in the background"):
+                save_watchlist(tickers)
+                st.success("WATCHLIST SAVED.")
+        if show_relative and st.session_state.get('table_rows'):
+            render_relative(list(filter_table(st.session_state['table_rows'])))
     
+    if pending_regime is not None:
+        try:
+            render_header(header_area, pending_regime.result())
+        except Exception as e:
+            st.error(f"ERROR FETCHING MARKET DATA: {str(e)}")
+
+    finish_run(run)
+    if config.DIAGNOSTICS:
+        render_diagnostics(run)
+
     # Status bar
     st.markdown(
         """
         <div class='status-bar'>
-            <div>i: TOGGLE INFO | /: SEARCH | ESC: CLEAR | ENTER: ANALYZE </div>
+            <div>i: TOGGLE INFO | d: DIAGNOSTICS | /: SEARCH | ESC: CLEAR | ENTER: ANALYZE </div>
             <div>&copy 2024 <a href="https://www.sebastianquadrat.com" target="_blank">Sebastian Quadrat</a></div>
         </div>
         """,
         unsafe_allow_html=True
     )
 
+    # Last, since it only returns when a rerun interrupts it
+    if keep_updating is not None:
+        keep_updating()
+
 if __name__ == "__main__":
     # Check if the script is being run directly
     if os.environ.get("STREAMLIT_SCRIPT_MODE") != "true":
         os.environ["STREAMLIT_SCRIPT_MODE"] = "true"
-        os.system(f"{sys.executable} -m streamlit run '{__file__}'")
+        # `streamlit run` in this interpreter, which has already imported everything the first
+        # rerun needs, instead of a second one; flags such as --server.port pass through
+        from streamlit.web import cli
+        cli.main(['run', __file__] + sys.argv[1:], prog_name='streamlit')
     else:
         main()
\ No newline at end of file
@@ -0,0 +1,118 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# NYSE regular sessions in exchange time. Ad hoc closures (national days of mourning, weather)
+# are not predictable and are not listed
+EXCHANGE_TZ = ZoneInfo('America/New_York')
+OPEN = time(9, 30)
+CLOSE = time(16, 0)
+EARLY_CLOSE = time(13, 0)
+
+
+def easter(year):
+    # Anonymous Gregorian algorithm
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def nth_weekday(year, month, weekday, n):
+    # n-th (1-based) given weekday of the month, or the last one for n=-1
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def observed(day):
+    # Saturday holidays are observed on the Friday before, Sunday holidays on the Monday after
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=None)
+def holidays(year):
+    days = {
+        nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        easter(year) - timedelta(days=2),  # Good Friday
+        nth_weekday(year, 5, 0, -1),  # Memorial Day
+        observed(date(year, 7, 4)),
+        nth_weekday(year, 9, 0, 1),  # Labor Day
+        nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        observed(date(year, 12, 25)),
+    }
+    # New Year's Day falling on a Saturday is not made up on the Friday before
+    if date(year, 1, 1).weekday() != 5:
+        days.add(observed(date(year, 1, 1)))
+    if year >= 2022:
+        days.add(observed(date(year, 6, 19)))  # Juneteenth
+    return frozenset(days)
+
+
+@lru_cache(maxsize=None)
+def early_closes(year):
+    candidates = (
+        date(year, 7, 3),
+        nth_weekday(year, 11, 3, 4) + timedelta(days=1),  # day after Thanksgiving
+        date(year, 12, 24),
+    )
+    return frozenset(day for day in candidates if is_trading_day(day))
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def session(day):
+    # (open, close) as exchange-time datetimes, or None when the market is closed all day
+    if not is_trading_day(day):
+        return None
+    close = EARLY_CLOSE if day in early_closes(day.year) else CLOSE
+    return (datetime.combine(day, OPEN, tzinfo=EXCHANGE_TZ),
+            datetime.combine(day, close, tzinfo=EXCHANGE_TZ))
+
+
+def now():
+    return datetime.now(EXCHANGE_TZ)
+
+
+def is_open(at=None):
+    at = (at or now()).astimezone(EXCHANGE_TZ)
+    hours = session(at.date())
+    return hours is not None and hours[0] <= at < hours[1]
+
+
+def next_session(at=None):
+    # The first session that has not closed yet at `at`
+    at = (at or now()).astimezone(EXCHANGE_TZ)
+    day = at.date()
+    while True:
+        hours = session(day)
+        if hours is not None and at < hours[1]:
+            return hours
+        day += timedelta(days=1)
+
+
+def previous_close(at=None):
+    # The close of the most recent session that ended at or before `at`
+    at = (at or now()).astimezone(EXCHANGE_TZ)
+    day = at.date()
+    while True:
+        hours = session(day)
+        if hours is not None and hours[1] <= at:
+            return hours[1]
+        day -= timedelta(days=1)
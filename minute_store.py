@@ -0,0 +1,256 @@
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import config
+import market_calendar
+from fetching import call_with_retry
+from providers import get_provider
+
+# Column files per symbol; the time column is appended last, so its length is the number of
+# complete bars even if a write was interrupted
+COLUMNS = (('close', np.float64), ('volume', np.float64), ('pv', np.float64), ('v', np.float64), ('time', np.int64))
+BAR_SECONDS = 60
+BACKFILL_DAYS = 29  # Yahoo serves 1m bars for the last 30 days
+REQUEST_DAYS = 7  # and at most 7 days of them per request
+DAY = 86400
+
+
+def epoch(at):
+    # Epoch seconds of a datetime, naive ones taken as exchange time
+    at = pd.Timestamp(at)
+    if at.tzinfo is None:
+        at = at.tz_localize(market_calendar.EXCHANGE_TZ)
+    return at.value // 10 ** 9
+
+
+def day_start(seconds):
+    # Exchange-time midnight of the day containing `seconds`
+    day = datetime.fromtimestamp(seconds, market_calendar.EXCHANGE_TZ).date()
+    return epoch(datetime(day.year, day.month, day.day))
+
+
+def day_starts(index):
+    # Exchange-time midnight of each daily bar, as epoch seconds
+    index = index.tz_convert(market_calendar.EXCHANGE_TZ) if index.tz is not None else index.tz_localize(market_calendar.EXCHANGE_TZ)
+    return index.normalize().asi8 // 10 ** 9
+
+
+@lru_cache(maxsize=4096)
+def session_close(start):
+    # Epoch close of the session on the day starting at `start`, 16:00 when there is none
+    hours = market_calendar.session(datetime.fromtimestamp(start, market_calendar.EXCHANGE_TZ).date())
+    return epoch(hours[1]) if hours is not None else start + 16 * 3600
+
+
+class MinuteBars:
+    # One symbol's bars as read-only memory-mapped columns: bar start times (epoch seconds),
+    # closes, volumes and the running sums of close x volume and of volume, so the VWAP over
+    # any span is a couple of binary searches and four reads, whatever its length
+    def __init__(self, columns):
+        self.close, self.volume, self.pv, self.v, self.time = columns
+
+    def __len__(self):
+        return len(self.time)
+
+    def position(self, at):
+        # First bar starting at or after `at`
+        return int(np.searchsorted(self.time, at, side='left'))
+
+    def sums(self, start, stop):
+        # Close x volume and volume over the bars starting in [start, stop)
+        lo, hi = self.position(start), self.position(stop)
+        if hi <= lo:
+            return 0.0, 0.0
+        base_pv, base_v = (self.pv[lo - 1], self.v[lo - 1]) if lo else (0.0, 0.0)
+        return self.pv[hi - 1] - base_pv, self.v[hi - 1] - base_v
+
+    def covered_from(self):
+        # Start of the first day whose whole session is held
+        first = int(self.time[0])
+        start = day_start(first)
+        hours = market_calendar.session(datetime.fromtimestamp(first, market_calendar.EXCHANGE_TZ).date())
+        if hours is not None and first > epoch(hours[0]):
+            start = day_start(start + DAY + 3600)  # + an hour for DST days
+        return start
+
+    def extreme(self, start, stop, largest=True):
+        # Start time of the highest (or lowest) close in [start, stop), the first one on ties
+        lo, hi = self.position(start), self.position(stop)
+        if hi <= lo:
+            return None
+        closes = self.close[lo:hi]
+        return int(self.time[lo + (np.nanargmax(closes) if largest else np.nanargmin(closes))])
+
+
+class MinuteBarStore:
+    # Months of 1-minute bars per symbol under <root>/<SYMBOL>/<column>, appended in place and
+    # opened with np.memmap, so a whole universe can be opened without reading it into memory
+    def __init__(self, root=None):
+        self.root = root or config.MINUTE_DIR
+        self.lock = threading.Lock()
+        self.opened = {}  # symbol -> (length, MinuteBars)
+
+    def _path(self, symbol, name):
+        return os.path.join(self.root, symbol, name)
+
+    def _length(self, symbol):
+        path = self._path(symbol, 'time')
+        return os.path.getsize(path) // 8 if os.path.exists(path) else 0
+
+    def open(self, symbol):
+        n = self._length(symbol)
+        if n == 0:
+            return None
+        opened = self.opened.get(symbol)
+        if opened is not None and opened[0] == n:
+            return opened[1]
+        bars = MinuteBars([np.memmap(self._path(symbol, name), dtype=dtype, mode='r', shape=(n,))
+                           for name, dtype in COLUMNS])
+        self.opened[symbol] = (n, bars)
+        return bars
+
+    def last_time(self, symbol):
+        bars = self.open(symbol)
+        return None if bars is None else int(bars.time[-1])
+
+    def drop(self, symbol):
+        with self.lock:
+            self.opened.pop(symbol, None)
+            shutil.rmtree(os.path.join(self.root, symbol), ignore_errors=True)
+
+    def append(self, symbol, frame, now=None):
+        # Adds the bars newer than the last one held. A bar is only complete once its minute is
+        # over, so the one still forming is left for the next call
+        if frame is None or frame.empty:
+            return 0
+        now = time.time() if now is None else now
+        index = frame.index if frame.index.tz is not None else frame.index.tz_localize(market_calendar.EXCHANGE_TZ)
+        times = index.asi8 // 10 ** 9
+        close = frame['Close'].to_numpy(dtype=float)
+        volume = np.nan_to_num(frame['Volume'].to_numpy(dtype=float))
+        with self.lock:
+            n = self._length(symbol)
+            last_time, last_pv, last_v = -1, 0.0, 0.0
+            if n:
+                bars = self.open(symbol)
+                last_time, last_pv, last_v = int(bars.time[-1]), float(bars.pv[-1]), float(bars.v[-1])
+            keep = ~np.isnan(close) & (times > last_time) & (times + BAR_SECONDS <= now)
+            if not keep.any():
+                return 0
+            times, close, volume = times[keep], close[keep], volume[keep]
+            columns = (close, volume, last_pv + np.cumsum(close * volume), last_v + np.cumsum(volume), times)
+            os.makedirs(os.path.join(self.root, symbol), exist_ok=True)
+            for (name, dtype), values in zip(COLUMNS, columns):
+                with open(self._path(symbol, name), 'ab') as f:
+                    # Drop anything past the last complete bar left by an interrupted append
+                    f.truncate(n * np.dtype(dtype).itemsize)
+                    f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        return len(times)
+
+
+def sync(store, symbols, provider=None, now=None):
+    # Downloads the bars each symbol is missing, BACKFILL_DAYS back at most, REQUEST_DAYS at a time.
+    # A symbol whose bars stop before that is started over, so what is held never has a gap
+    provider = provider or get_provider()
+    now = now or market_calendar.now()
+    earliest = now - timedelta(days=BACKFILL_DAYS)
+    starts = {}
+    for symbol in dict.fromkeys(symbols):
+        last = store.last_time(symbol)
+        if last is not None and last < epoch(earliest):
+            store.drop(symbol)
+            last = None
+        starts[symbol] = earliest if last is None else datetime.fromtimestamp(last + BAR_SECONDS, market_calendar.EXCHANGE_TZ)
+    if not starts:
+        return
+    start = min(starts.values())
+    while start < now:
+        end = min(start + timedelta(days=REQUEST_DAYS), now)
+        due = [symbol for symbol, since in starts.items() if since < end]
+        if due:
+            frames = call_with_retry(provider.history, due, max(start, min(starts[s] for s in due)), end, '1m')
+            for symbol, frame in frames.items():
+                store.append(symbol, frame)
+        start = end
+
+
+def is_current(bars, now):
+    # Whether the bars reach the present: within a few minutes while the market is open, up to
+    # the last close otherwise
+    last = int(bars.time[-1]) + BAR_SECONDS
+    if market_calendar.is_open(now):
+        return last >= epoch(now) - 10 * BAR_SECONDS
+    return last >= epoch(market_calendar.previous_close(now))
+
+
+def anchored_vwaps(store, tickers, frames, offsets, anchors, year_start, earnings_dates, now=None):
+    # The anchored VWAPs of compute_indicators, [prev, last] as (n, 2) arrays, read off the minute
+    # bars from each anchor's exact time: the first minute of the year, the first bar after the
+    # earnings release and the minute of the recent high or low close. Days before a symbol's
+    # minute history begins are taken from its daily bars. Returns the values and which rows were
+    # computed; rows whose minute bars are missing or behind are left to the daily engine
+    now = now or market_calendar.now()
+    n = len(tickers)
+    values = {f'VWAP_{name}': np.full((n, 2), np.nan) for name in anchors}
+    computed = np.zeros(n, dtype=bool)
+    for i, (ticker, frame) in enumerate(zip(tickers, frames)):
+        bars = store.open(ticker)
+        if bars is None or frame is None or frame.empty or not is_current(bars, now):
+            continue
+        days = day_starts(frame.index)
+        today = int(days[-1])
+        covered = bars.covered_from()
+        if covered > today:
+            continue
+        computed[i] = True
+
+        # Daily close x volume and volume before the minute history, summed from each anchor
+        closes = np.array([session_close(int(start)) for start in days], dtype=np.int64)
+        pv = np.nan_to_num(frame['Close'].to_numpy(dtype=float) * frame['Volume'].to_numpy(dtype=float))
+        v = np.nan_to_num(frame['Volume'].to_numpy(dtype=float))
+        before = days < covered
+        pv_sums = np.concatenate([[0.0], np.cumsum(np.where(before, pv, 0.0))])
+        v_sums = np.concatenate([[0.0], np.cumsum(np.where(before, v, 0.0))])
+
+        def vwap(anchor, stop):
+            # Days whose session closes after the anchor, then minute bars up to `stop`
+            first = int(np.searchsorted(closes, anchor, side='right'))
+            daily_pv, daily_v = pv_sums[-1] - pv_sums[first], v_sums[-1] - v_sums[first]
+            minute_pv, minute_v = bars.sums(max(anchor, covered), stop)
+            total_v = daily_v + minute_v
+            return (daily_pv + minute_pv) / total_v if total_v else np.nan
+
+        starts = {'YearStart': epoch(year_start)}
+        if earnings_dates[i] is not None and anchors['Earnings'][i] >= 0:
+            starts['Earnings'] = epoch(earnings_dates[i])
+        for name, largest in (('RecentHigh', True), ('RecentLow', False)):
+            column = anchors[name][i]
+            if column < 0:
+                continue
+            day = int(days[column - offsets[i]])
+            exact = bars.extreme(day, day + DAY, largest) if day >= covered else None
+            starts[name] = exact if exact is not None else day
+        for name, anchor in starts.items():
+            if anchors[name][i] < 0:
+                continue
+            values[f'VWAP_{name}'][i] = [vwap(anchor, today) if anchor < today else np.nan,
+                                         vwap(anchor, float('inf'))]
+    return values, computed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MinuteBarStore()
+    return _store
@@ -0,0 +1,327 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import config
+from bar_store import BarStore
+from fetching import DeadlineExceeded, call_with_retry, fetch_concurrently, get_deadlines
+from fundamentals_store import get_fundamentals, prime_quotes, stored_fundamentals
+from indicators import anchor_indices, classify_status, compute_indicators, stack_histories, trend
+from instrumentation import span
+from minute_store import anchored_vwaps, get_store as get_minute_store, sync as sync_minutes
+from providers import get_provider
+from relative import BENCHMARKS, compute_relative
+from snapshot import save_regime
+
+logger = logging.getLogger('skyhook.pipeline')
+
+def calculate_vwap(data):
+    return (data['Close'] * data['Volume']).cumsum() / data['Volume'].cumsum()
+
+def stored_daily(tickers, start):
+    # Whatever daily bars are on disk, however old, for when the download runs out of time
+    if not config.BAR_STORE:
+        return {}
+    store = BarStore()
+    frames = {}
+    for ticker in tickers:
+        frame = store.load(ticker)
+        if frame is not None:
+            frames[ticker] = frame[frame.index >= start]
+    return frames
+
+def download_batch(tickers, late=None):
+    # Each stage waits at most its deadline. Given a `late` set, a stage that misses it is added
+    # to the set and degrades instead of failing: daily bars fall back to the ones stored on disk
+    # and intraday bars are left out. The late download is collected by the next call
+    tickers = list(dict.fromkeys(tickers))
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=365)  # 1 year ago
+    provider = get_provider()
+    deadlines = get_deadlines()
+    key = tuple(tickers)
+    with span('download_daily'):
+        try:
+            daily = deadlines.call('daily', key, config.DEADLINE_DAILY, provider.history, tickers, start_date, end_date)
+        except DeadlineExceeded:
+            if late is None:
+                raise
+            late.add('daily')
+            daily = stored_daily(tickers, start_date)
+    with span('download_intraday'):
+        try:
+            intraday = deadlines.call('intraday', key, config.DEADLINE_INTRADAY, provider.intraday, tickers)
+        except DeadlineExceeded:
+            if late is None:
+                raise
+            late.add('intraday')
+            intraday = {}
+    if config.MINUTE_STORE:
+        # The VWAPs fall back to daily anchors for symbols left behind, so a failed sync is not fatal
+        with span('download_minutes'):
+            try:
+                deadlines.call('minutes', key, config.DEADLINE_INTRADAY, sync_minutes, get_minute_store(), tickers, provider)
+            except Exception as e:
+                logger.warning(json.dumps({'event': 'minute_sync_failed', 'error': str(e)}))
+    return {ticker: (daily.get(ticker), intraday.get(ticker)) for ticker in tickers}
+
+def iter_stock_data(tickers, flush_interval=0.0):
+    # Yields (rows, errors) as per-ticker fetches complete. Rows that arrive within
+    # `flush_interval` seconds of each other are computed together in one vectorized pass. Stages
+    # that miss their deadline leave their columns N/A or stale, listed in the row's 'late'
+    late = set()
+    history = call_with_retry(download_batch, tickers, late=late)
+    priced = []
+    missing = {}
+    for ticker, (data, latest_data) in history.items():
+        if data is None or data.empty:
+            missing[ticker] = DeadlineExceeded('daily') if 'daily' in late else ValueError("NO PRICE DATA RETURNED")
+        elif (latest_data is None or latest_data.empty) and 'intraday' not in late:
+            missing[ticker] = ValueError("NO PRICE DATA RETURNED")
+        else:
+            priced.append(ticker)
+    if missing:
+        yield {}, missing
+
+    provider = get_provider()
+    prime_quotes(priced, provider)
+    pending = {}
+    last_flush = time.monotonic()
+    for ticker, result, error in fetch_concurrently(lambda t: get_fundamentals(t, provider), priced,
+                                                    deadline=config.REFRESH_BUDGET, stage='fundamentals'):
+        if isinstance(error, DeadlineExceeded):
+            result, error = stored_fundamentals(ticker), None
+        if error is not None:
+            yield {}, {ticker: error}
+            continue
+        pending[ticker] = result
+        if time.monotonic() - last_flush >= flush_interval:
+            yield compute_rows({t: history[t] for t in pending}, pending, late), {}
+            pending = {}
+            last_flush = time.monotonic()
+    if pending:
+        yield compute_rows({t: history[t] for t in pending}, pending, late), {}
+
+def get_stock_data_batch(tickers):
+    results = {}
+    errors = {}
+    for rows, batch_errors in iter_stock_data(tickers, flush_interval=float('inf')):
+        results.update(rows)
+        errors.update(batch_errors)
+    # Keep the caller's ticker order regardless of completion order
+    ordered = list(dict.fromkeys(tickers))
+    return {ticker: results[ticker] for ticker in ordered if ticker in results}, errors
+
+def get_stock_data(ticker, history=None):
+    if history is None:
+        history = download_batch([ticker])[ticker]
+    data, latest_data = history
+
+    if data is None or data.empty or latest_data is None or latest_data.empty:
+        raise ValueError("NO PRICE DATA RETURNED")
+
+    fundamentals = get_fundamentals(ticker, get_provider())
+    return compute_rows({ticker: history}, {ticker: fundamentals})[ticker]
+
+def valuation(fundamentals):
+    # P/Sales and P/FCF with the trend of the underlying TTM figures
+    market_cap = fundamentals['market_cap']
+    if not fundamentals['has_statements']:
+        return None, None, None, None
+
+    ttm_revenue = fundamentals['ttm_revenue']
+    ttm_free_cash_flow = fundamentals['ttm_fcf']
+    
+    p_s_ratio = market_cap / ttm_revenue if market_cap is not None and ttm_revenue else None
+    p_fcf_ratio = market_cap / ttm_free_cash_flow if market_cap is not None and ttm_free_cash_flow else None
+
+    # Calculate TTM trends
+    ttm_revenue_trend = 'R' if ttm_revenue > fundamentals['prev_ttm_revenue'] else 'F'
+    ttm_fcf_trend = 'R' if ttm_free_cash_flow > fundamentals['prev_ttm_fcf'] else 'F'
+    return p_s_ratio, ttm_revenue_trend, p_fcf_ratio, ttm_fcf_trend
+
+def compute_rows(history, fundamentals, late=()):
+    # Computes the table rows for all tickers at once on right-aligned close/volume matrices
+    tickers = list(history)
+    if not tickers:
+        return {}
+    with span('indicators'):
+        return _compute_rows(tickers, history, fundamentals, late)
+
+def _compute_rows(tickers, history, fundamentals, late=()):
+    frames = [history[ticker][0] for ticker in tickers]
+    close, volume, offsets = stack_histories(frames)
+    year_start = pd.Timestamp(f'{datetime.now().year}-01-01')
+    earnings_dates = [fundamentals[ticker]['last_earnings_date'] for ticker in tickers]
+    anchors = anchor_indices(frames, offsets, close.shape[1], year_start, earnings_dates)
+    ind = compute_indicators(close, volume, anchors)
+    if config.MINUTE_STORE:
+        minute, computed = anchored_vwaps(get_minute_store(), tickers, frames, offsets, anchors, year_start, earnings_dates)
+        for key, values in minute.items():
+            ind[key] = np.where(computed[:, None], values, ind[key])
+
+    # Without intraday bars a quote at most QUOTE_PRICE_TTL old, or else the last daily close, stands
+    # in for the price and the volume is N/A; either way the row is marked late for 'intraday'
+    intraday = [history[ticker][1] for ticker in tickers]
+    has_intraday = [frame is not None and not frame.empty for frame in intraday]
+    quoted = [fundamentals[ticker].get('price') for ticker in tickers]
+    latest_price = np.array([
+        frame['Close'].iloc[-1] if ok else (price if price is not None else daily['Close'].iloc[-1])
+        for frame, daily, ok, price in zip(intraday, frames, has_intraday, quoted)
+    ], dtype=float)
+    current_volume = [frame['Volume'].sum() if ok else np.nan for frame, ok in zip(intraday, has_intraday)]
+    stale = [(['daily'] if 'daily' in late else []) + ([] if ok else ['intraday']) for ok in has_intraday]
+    return make_rows(tickers, latest_price, current_volume, ind, anchors['Earnings'] >= 0, fundamentals, stale)
+
+def make_rows(tickers, latest_price, current_volume, ind, has_earnings, fundamentals, late=None):
+    # Table rows from the latest prices and (n, 2) [prev, last] indicator arrays. `late` lists the
+    # stages each row is missing on top of the ones its fundamentals snapshot reports
+    status = classify_status(latest_price, ind, has_earnings)
+    trends = {key: trend(values) for key, values in ind.items()}
+
+    rows = {}
+    for i, ticker in enumerate(tickers):
+        p_s_ratio, ttm_revenue_trend, p_fcf_ratio, ttm_fcf_trend = valuation(fundamentals[ticker])
+        next_earnings_date = fundamentals[ticker]['next_earnings_date']
+        days_to_earnings = (next_earnings_date - pd.Timestamp.now()).days if next_earnings_date is not None else None
+        stages = (late[i] if late else []) + fundamentals[ticker].get('late', [])
+
+        rows[ticker] = {
+            'latest_price': latest_price[i],
+            'status': str(status[i]),
+            'days_to_earnings': days_to_earnings,
+            'SMA5': ind['SMA5'][i, -1],
+            'SMA5_trend': str(trends['SMA5'][i]),
+            'SMA50': ind['SMA50'][i, -1],
+            'SMA50_trend': str(trends['SMA50'][i]),
+            'SMA150': ind['SMA150'][i, -1],
+            'SMA150_trend': str(trends['SMA150'][i]),
+            'SMA200': ind['SMA200'][i, -1],
+            'SMA200_trend': str(trends['SMA200'][i]),
+            'VWAP_YearStart': ind['VWAP_YearStart'][i, -1],
+            'VWAP_YearStart_trend': str(trends['VWAP_YearStart'][i]),
+            'VWAP_RecentHigh': ind['VWAP_RecentHigh'][i, -1],
+            'VWAP_RecentHigh_trend': str(trends['VWAP_RecentHigh'][i]),
+            'VWAP_RecentLow': ind['VWAP_RecentLow'][i, -1],
+            'VWAP_RecentLow_trend': str(trends['VWAP_RecentLow'][i]),
+            'VWAP_Earnings': ind['VWAP_Earnings'][i, -1] if has_earnings[i] else None,
+            'VWAP_Earnings_trend': str(trends['VWAP_Earnings'][i]) if has_earnings[i] else None,
+            'current_volume': current_volume[i],
+            'avg_volume_20d': ind['avg_volume_20d'][i, -1],
+            'P/S': p_s_ratio,
+            'P/S_trend': ttm_revenue_trend,
+            'P/FCF': p_fcf_ratio,
+            'P/FCF_trend': ttm_fcf_trend,
+            'late': ', '.join(stages) or None
+        }
+    return rows
+
+def get_relative_strength(tickers):
+    # Relative strength against the benchmarks and correlations across the tickers, from the daily
+    # bars the table and the regime header have just loaded; the shared bar cache serves them
+    # again without another download
+    tickers = list(dict.fromkeys(tickers))
+    symbols = tickers + [symbol for symbol in BENCHMARKS if symbol not in tickers]
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=365)  # 1 year ago
+    with span('download_daily'):
+        frames = get_deadlines().call('daily', tuple(symbols), config.DEADLINE_DAILY,
+                                      get_provider().history, symbols, start_date, end_date)
+    with span('relative'):
+        return compute_relative(frames, tickers)
+
+_regime = None
+_regime_lock = threading.Lock()
+_regime_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='skyhook-regime')
+
+def cached_regime():
+    # The shared regime values if they are still fresh, without fetching anything
+    with _regime_lock:
+        cached = _regime
+    if cached is not None and time.monotonic() - cached[1] < config.REGIME_TTL:
+        return cached[0]
+    return None
+
+def regime_age():
+    # Seconds since the shared regime values were computed, None before they first are
+    with _regime_lock:
+        cached = _regime
+    return None if cached is None else time.monotonic() - cached[1]
+
+def get_vix_data(refresh=False):
+    # Shared by every session in the process and recomputed at most every REGIME_TTL seconds
+    global _regime
+    cached = None if refresh else cached_regime()
+    if cached is not None:
+        return cached
+    values = compute_regime()
+    with _regime_lock:
+        _regime = (values, time.monotonic())
+    if config.SNAPSHOT:
+        save_regime(values)
+    return values
+
+def get_vix_data_async(refresh=False):
+    # A future for get_vix_data on a single shared worker, so a page can paint before the regime
+    # is fetched; requests queued behind a running fetch then find the values fresh
+    return _regime_worker.submit(get_vix_data, refresh)
+
+# Names of the values compute_regime returns, in order
+REGIME_FIELDS = (
+    'vix_spot', 'vxx_price', 'vxz_price', 'vix_ratio', 'vxx_ratio', 'vxz_ratio',
+    'qqq_price', 'qqq_st', 'qqq_lt', 'spy_price', 'spy_st', 'spy_lt',
+    'qqq_sma5', 'qqq_sma150', 'spy_sma5', 'spy_sma150',
+)
+
+def compute_regime():
+    tickers = ["^VIX", "VXX", "VXZ", "QQQ", "SPY"]
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=365)  # Fetch 1 year of data to ensure enough for 150-day MA
+    with span('vix'):
+        data = get_provider().history(tickers, start_date, end_date)
+    
+    vix_data = data['^VIX']['Close']
+    vxx_data = data['VXX']['Close']
+    vxz_data = data['VXZ']['Close']
+    qqq_data = data['QQQ']['Close']
+    spy_data = data['SPY']['Close']
+    
+    vix_spot = vix_data.iloc[-1]
+    vxx_price = vxx_data.iloc[-1]
+    vxz_price = vxz_data.iloc[-1]
+    qqq_price = qqq_data.iloc[-1]
+    spy_price = spy_data.iloc[-1]
+    
+    vix_ma20 = vix_data.rolling(window=20).mean().iloc[-1]
+    vxx_ma20 = vxx_data.rolling(window=20).mean().iloc[-1]
+    vxz_ma20 = vxz_data.rolling(window=20).mean().iloc[-1]
+    
+    vix_ratio = vix_spot / vix_ma20
+    vxx_ratio = vxx_price / vxx_ma20
+    vxz_ratio = vxz_price / vxz_ma20
+
+    # Calculate SMAs for QQQ and SPY
+    qqq_sma5 = qqq_data.rolling(window=5).mean().iloc[-1]
+    qqq_sma150 = qqq_data.rolling(window=150).mean().iloc[-1]
+    spy_sma5 = spy_data.rolling(window=5).mean().iloc[-1]
+    spy_sma150 = spy_data.rolling(window=150).mean().iloc[-1]
+
+    # Determine short-term and long-term trends
+    qqq_st = 'green' if qqq_price > qqq_sma5 else 'red'
+    qqq_lt = 'green' if qqq_price > qqq_sma150 else 'red'
+    spy_st = 'green' if spy_price > spy_sma5 else 'red'
+    spy_lt = 'green' if spy_price > spy_sma150 else 'red'
+
+    logger.debug(json.dumps({
+        'event': 'regime',
+        'QQQ': {'price': qqq_price, 'sma5': qqq_sma5, 'sma150': qqq_sma150, 'st': qqq_st, 'lt': qqq_lt},
+        'SPY': {'price': spy_price, 'sma5': spy_sma5, 'sma150': spy_sma150, 'st': spy_st, 'lt': spy_lt},
+    }, default=float))
+    
+    return vix_spot, vxx_price, vxz_price, vix_ratio, vxx_ratio, vxz_ratio, qqq_price, qqq_st, qqq_lt, spy_price, spy_st, spy_lt, qqq_sma5, qqq_sma150, spy_sma5, spy_sma150
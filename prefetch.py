@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import threading
+from datetime import timedelta
+
+import config
+import market_calendar
+from instrumentation import finish_run, start_run
+from pipeline import get_stock_data_batch, get_vix_data_async
+
+logger = logging.getLogger('skyhook.prefetch')
+
+
+def read_watchlists(path):
+    # One watchlist per line, symbols separated by whitespace or commas; '#' starts a comment
+    if not os.path.exists(path):
+        return []
+    watchlists = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0]
+            symbols = [s.strip().upper() for s in line.replace(',', ' ').split() if s.strip()]
+            if symbols:
+                watchlists.append(list(dict.fromkeys(symbols)))
+    return watchlists
+
+
+def save_watchlist(tickers, path=None):
+    path = path or config.WATCHLISTS_PATH
+    tickers = list(dict.fromkeys(tickers))
+    if tickers in read_watchlists(path):
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(' '.join(tickers) + '\n')
+
+
+def is_fresh(updated, at=None):
+    # While the market is open a value is fresh for two refresh intervals; after the close,
+    # anything fetched since that close is as current as it is going to get
+    at = at or market_calendar.now()
+    if market_calendar.is_open(at):
+        return at - updated <= timedelta(seconds=2 * config.PREFETCH_INTERVAL)
+    return updated >= market_calendar.previous_close(at)
+
+
+def fresh_for(updated, at=None):
+    # Seconds until a value fetched at `updated` stops being fresh, see is_fresh
+    at = at or market_calendar.now()
+    if not is_fresh(updated, at):
+        return 0.0
+    open_, close = market_calendar.next_session(at)
+    if market_calendar.is_open(at):
+        expires = min(updated + timedelta(seconds=2 * config.PREFETCH_INTERVAL), close)
+    else:
+        expires = open_
+    return (expires - at).total_seconds()
+
+
+def next_refresh(at=None):
+    # Every PREFETCH_INTERVAL seconds during the session, one end-of-day pass
+    # PREFETCH_CLOSE_DELAY seconds after the close, then nothing until the next open
+    at = at or market_calendar.now()
+    open_, close = market_calendar.next_session(at)
+    last = market_calendar.previous_close(at)
+    last_end_of_day = last + timedelta(seconds=config.PREFETCH_CLOSE_DELAY)
+    if at < last_end_of_day:
+        return last_end_of_day
+    if at < open_:
+        return open_
+    return min(at + timedelta(seconds=config.PREFETCH_INTERVAL), close)
+
+
+class RowCache:
+    # Latest computed rows, shared by every session in the process
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = {}
+
+    def update(self, rows, at=None):
+        # Rows with late columns are not kept, so the next lookup refetches them and picks up
+        # the late results
+        at = at or market_calendar.now()
+        with self.lock:
+            for ticker, row in rows.items():
+                if not row.get('late'):
+                    self.rows[ticker] = (row, at)
+
+    def lookup(self, tickers):
+        # Fresh cached rows in the caller's order, the tickers that still need fetching and
+        # the time of the oldest row returned
+        rows = {}
+        missing = []
+        oldest = None
+        with self.lock:
+            entries = {ticker: self.rows.get(ticker) for ticker in dict.fromkeys(tickers)}
+        for ticker, entry in entries.items():
+            if entry is None or not is_fresh(entry[1]):
+                missing.append(ticker)
+                continue
+            rows[ticker] = entry[0]
+            oldest = entry[1] if oldest is None else min(oldest, entry[1])
+        return rows, missing, oldest
+
+
+class Prefetcher(threading.Thread):
+    # Keeps the saved watchlists and the regime symbols warm in the cache on the exchange calendar
+    def __init__(self, cache, watchlists_path=None):
+        super().__init__(name='skyhook-prefetch', daemon=True)
+        self.cache = cache
+        self.watchlists_path = watchlists_path or config.WATCHLISTS_PATH
+        self.stopped = threading.Event()
+        self.last_refresh = None
+
+    def run(self):
+        # Warm the cache once on start, whatever the time, so the first rerun has something to read
+        self.refresh()
+        while not self.stopped.is_set():
+            delay = (next_refresh() - market_calendar.now()).total_seconds()
+            if delay > 0 and self.stopped.wait(delay):
+                break
+            self.refresh()
+
+    def stop(self):
+        self.stopped.set()
+
+    def refresh(self):
+        # Everything goes through the shared provider, whose download lock keeps these downloads
+        # from overlapping a session's. The regime is refreshed on the shared regime worker and
+        # the watchlists are fetched one at a time, so a session's own download waits for at most
+        # one watchlist's turn at the lock rather than the whole pass
+        run = start_run('prefetch')
+        try:
+            get_vix_data_async(refresh=True).result()
+        except Exception as e:
+            logger.warning(json.dumps({'event': 'prefetch_failed', 'what': 'vix', 'error': str(e)}))
+        done = set()
+        for watchlist in read_watchlists(self.watchlists_path):
+            tickers = [t for t in watchlist if t not in done]
+            if self.stopped.is_set():
+                break
+            if not tickers:
+                continue
+            done.update(tickers)
+            try:
+                rows, errors = get_stock_data_batch(tickers)
+                self.cache.update(rows)
+                if errors:
+                    logger.warning(json.dumps({'event': 'prefetch_errors',
+                                               'errors': {t: str(e) for t, e in errors.items()}}))
+            except Exception as e:
+                logger.warning(json.dumps({'event': 'prefetch_failed', 'what': 'watchlists', 'error': str(e)}))
+        self.last_refresh = market_calendar.now()
+        finish_run(run)
+
+
+_cache = RowCache()
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+def get_cache():
+    return _cache
+
+def start_prefetcher():
+    # One background thread per process; Streamlit reruns and sessions all share it
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None or not _prefetcher.is_alive():
+            _prefetcher = Prefetcher(_cache)
+            _prefetcher.start()
+    return _prefetcher
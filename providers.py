@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import config
+from storage import read_frame, write_frame
+from yahoo import get_session, quotes
+
+STATEMENTS = ('quarterly_financials', 'quarterly_cashflow')
+
+
+class MarketDataProvider:
+    # history/intraday return {ticker: DataFrame of OHLCV}; symbols without data are omitted.
+    # Backends that cannot run two downloads at once set a process-wide download_lock, which the
+    # shared layers in front of them hold around every upstream download
+    download_lock = None
+
+    def history(self, tickers, start, end, interval='1d'):
+        raise NotImplementedError
+
+    def intraday(self, tickers):
+        raise NotImplementedError
+
+    # Minute bars from `since` on; backends that cannot ask for a start time filter a full day
+    def intraday_since(self, tickers, since):
+        frames = self.intraday(tickers)
+        return {ticker: frame[frame.index >= since] for ticker, frame in frames.items()}
+
+    # Returns an object exposing earnings_dates, info, quarterly_financials and quarterly_cashflow
+    def ticker(self, symbol):
+        raise NotImplementedError
+
+    def market_cap(self, symbol):
+        return self.ticker(symbol).info.get('marketCap')
+
+    # {symbol: {'market_cap', 'price'}} for many symbols; backends without a bulk quote ask per symbol
+    def quotes(self, tickers):
+        return {ticker: {'market_cap': self.market_cap(ticker), 'price': None} for ticker in dict.fromkeys(tickers)}
+
+
+def split_download(data, tickers):
+    # yf.download returns flat columns for one symbol and (ticker, field) columns for several
+    if data is None or data.empty:
+        return {}
+    if len(tickers) == 1:
+        return {tickers[0]: data}
+    frames = {}
+    available = set(data.columns.get_level_values(0))
+    for ticker in tickers:
+        if ticker in available:
+            frame = data[ticker].dropna(how='all')
+            if not frame.empty:
+                frames[ticker] = frame
+    return frames
+
+
+def yfinance():
+    # Imported on first use: it is slow to import and nothing needs it before the first download
+    import yfinance
+    return yfinance
+
+
+class YFinanceProvider(MarketDataProvider):
+    # Every request goes through the process-wide pooled session, see yahoo.get_session.
+    # yf.download collects its frames in module globals that each call clears and reads back by
+    # ticker, so two downloads running at once can lose each other's frames or swap a 1m frame in
+    # for a daily one. The lock is process-wide and held for the whole download, including one
+    # left running after its caller's deadline. Reentrant, as the coalescing layer holds it too
+    download_lock = threading.RLock()
+
+    def download(self, tickers, **kwargs):
+        with self.download_lock:
+            data = yfinance().download(tickers, group_by='ticker', progress=False, session=get_session(), **kwargs)
+        return split_download(data, tickers)
+
+    def history(self, tickers, start, end, interval='1d'):
+        return self.download(list(dict.fromkeys(tickers)), start=start, end=end, interval=interval)
+
+    def intraday(self, tickers):
+        return self.download(list(dict.fromkeys(tickers)), period="1d", interval="1m")
+
+    def intraday_since(self, tickers, since):
+        frames = self.download(list(dict.fromkeys(tickers)), start=since, interval="1m")
+        return {ticker: frame[frame.index >= since] for ticker, frame in frames.items()}
+
+    def ticker(self, symbol):
+        return yfinance().Ticker(symbol, session=get_session())
+
+    def market_cap(self, symbol):
+        # The bulk quote for one symbol, then fast_info, both far smaller than the quoteSummary
+        # payload behind .info
+        try:
+            quote = self.quotes([symbol]).get(symbol)
+        except Exception:
+            quote = None
+        if quote is not None and quote['market_cap'] is not None:
+            return quote['market_cap']
+        ticker = self.ticker(symbol)
+        try:
+            return ticker.fast_info['marketCap']
+        except Exception:
+            return ticker.info.get('marketCap')
+
+    def quotes(self, tickers):
+        return quotes(tickers)
+
+
+class ReplayTicker:
+    def __init__(self, provider, symbol):
+        self.provider = provider
+        self.symbol = symbol
+
+    @property
+    def earnings_dates(self):
+        frame = self.provider.read(self.symbol, 'earnings_dates')
+        if frame is not None:
+            # CSV round-trips mixed DST offsets as strings, so restore a proper tz-aware index
+            frame.index = pd.to_datetime(frame.index, utc=True).tz_convert('America/New_York')
+        return frame
+
+    @property
+    def info(self):
+        self.provider.wait()
+        path = os.path.join(self.provider.root, self.symbol, 'info.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    # Statements are recorded transposed (one row per quarter) and served in yfinance's orientation
+    @property
+    def quarterly_financials(self):
+        frame = self.provider.read(self.symbol, 'quarterly_financials')
+        return frame.T if frame is not None else pd.DataFrame()
+
+    @property
+    def quarterly_cashflow(self):
+        frame = self.provider.read(self.symbol, 'quarterly_cashflow')
+        return frame.T if frame is not None else pd.DataFrame()
+
+
+class ReplayProvider(MarketDataProvider):
+    # Serves data recorded by `record` from <root>/<SYMBOL>/<name>.parquet|csv, sleeping
+    # `latency` seconds per simulated request so timings resemble a remote source
+    def __init__(self, root=None, latency=None):
+        self.root = root or config.REPLAY_DIR
+        self.latency = config.REPLAY_LATENCY if latency is None else latency
+
+    def wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def read(self, symbol, name):
+        self.wait()
+        return read_frame(os.path.join(self.root, symbol, name))
+
+    def _frames(self, tickers, name):
+        self.wait()
+        frames = {}
+        for ticker in dict.fromkeys(tickers):
+            frame = read_frame(os.path.join(self.root, ticker, name))
+            if frame is not None and not frame.empty:
+                frames[ticker] = frame
+        return frames
+
+    def history(self, tickers, start, end, interval='1d'):
+        frames = self._frames(tickers, 'daily')
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        return {
+            ticker: frame[(frame.index >= start) & (frame.index < end)]
+            for ticker, frame in frames.items()
+        }
+
+    def intraday(self, tickers):
+        return self._frames(tickers, 'intraday')
+
+    def ticker(self, symbol):
+        return ReplayTicker(self, symbol)
+
+
+def record(tickers, root=None, days=365, source=None, fmt='.parquet'):
+    # Captures everything get_stock_data reads so it can be replayed offline
+    root = root or config.REPLAY_DIR
+    source = source or YFinanceProvider()
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    daily = source.history(tickers, start_date, end_date)
+    intraday = source.intraday(tickers)
+    for ticker in dict.fromkeys(tickers):
+        base = os.path.join(root, ticker)
+        if ticker in daily:
+            write_frame(daily[ticker], os.path.join(base, 'daily'), fmt)
+        if ticker in intraday:
+            write_frame(intraday[ticker], os.path.join(base, 'intraday'), fmt)
+        info = source.ticker(ticker)
+        earnings_dates = info.earnings_dates
+        if earnings_dates is not None and not earnings_dates.empty:
+            write_frame(earnings_dates, os.path.join(base, 'earnings_dates'), fmt)
+        for name in STATEMENTS:
+            statement = getattr(info, name)
+            if statement is not None and not statement.empty:
+                statement = statement.T
+                statement.columns = [str(col) for col in statement.columns]
+                write_frame(statement, os.path.join(base, name), fmt)
+        with open(os.path.join(base, 'info.json'), 'w') as f:
+            json.dump({'marketCap': info.info.get('marketCap')}, f)
+
+
+def wrap_provider(provider, store_bars=False):
+    # The process-wide layers in front of an upstream: shared in-flight downloads, the on-disk bar
+    # store (for upstreams worth not asking twice) and the in-memory bar cache
+    if config.COALESCE:
+        from coalescing import CoalescingProvider
+        provider = CoalescingProvider(provider)
+    if store_bars and config.BAR_STORE:
+        from bar_store import StoredHistoryProvider
+        provider = StoredHistoryProvider(provider)
+    if config.BAR_CACHE_TTL > 0:
+        from bar_cache import SharedHistoryProvider
+        provider = SharedHistoryProvider(provider)
+    return provider
+
+
+_provider = None
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        if config.PROVIDER == 'replay':
+            _provider = ReplayProvider()
+        elif config.PROVIDER == 'yfinance':
+            _provider = YFinanceProvider()
+        else:
+            raise ValueError(f"UNKNOWN MARKET DATA PROVIDER: {config.PROVIDER}")
+        _provider = wrap_provider(_provider, store_bars=config.PROVIDER == 'yfinance')
+    return _provider
+
+def set_provider(provider):
+    global _provider
+    _provider = provider
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record market data for offline replay")
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--dir', default=None, help="replay directory (default: SKYHOOK_REPLAY_DIR)")
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet')
+    args = parser.parse_args()
+    record([t.upper() for t in args.tickers], args.dir, args.days, fmt='.' + args.format)
@@ -0,0 +1,199 @@
+import ast
+import re
+
+import numpy as np
+
+# Names the table headers use for row fields; every row key is also accepted upper-cased with
+# '/' dropped (P/S -> PS, P/FCF_trend -> PFCF_TREND)
+ALIASES = {
+    'E': 'days_to_earnings',
+    'LAST': 'latest_price',
+    'PRICE': 'latest_price',
+    'VOLUME': 'current_volume',
+    'VWAP_YTD': 'VWAP_YearStart',
+    'VWAP_H': 'VWAP_RecentHigh',
+    'VWAP_L': 'VWAP_RecentLow',
+    'VWAP_E': 'VWAP_Earnings',
+    'VWAP_YTD_TREND': 'VWAP_YearStart_trend',
+    'VWAP_H_TREND': 'VWAP_RecentHigh_trend',
+    'VWAP_L_TREND': 'VWAP_RecentLow_trend',
+    'VWAP_E_TREND': 'VWAP_Earnings_trend',
+}
+# Row fields that hold text. Declared rather than inferred from the values, so a field that is
+# None on every row of a batch (VWAP_Earnings_trend when no row has an earnings date) still
+# compares as text and simply matches nothing
+TEXT_FIELDS = (
+    'status', 'late', 'SMA5_trend', 'SMA50_trend', 'SMA150_trend', 'SMA200_trend',
+    'VWAP_YearStart_trend', 'VWAP_RecentHigh_trend', 'VWAP_RecentLow_trend', 'VWAP_Earnings_trend',
+    'P/S_trend', 'P/FCF_trend',
+)
+KEYWORDS = re.compile(r'\b(and|or|not|in)\b', re.IGNORECASE)
+SLASH = re.compile(r'(?<=\w)/(?=\w)')
+CLAUSES = re.compile(r'^(?P<where>.*?)(?:\border\s+by\s+(?P<order>\w+)(?:\s+(?P<direction>asc|desc))?)?'
+                     r'(?:\s*\blimit\s+(?P<limit>\d+))?\s*$', re.IGNORECASE | re.DOTALL)
+OPERATORS = {ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>='}
+FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}
+
+
+class SortedIndex:
+    # Row positions ordered by value, NaN last, so a range predicate is two binary searches
+    def __init__(self, values):
+        self.order = np.argsort(values, kind='stable')
+        self.sorted = values[self.order]
+        self.valid = int((~np.isnan(values)).sum())
+
+    def select(self, op, value):
+        values = self.sorted[:self.valid]
+        lo, hi = 0, self.valid
+        if op in ('>', '>='):
+            lo = np.searchsorted(values, value, side='right' if op == '>' else 'left')
+        elif op in ('<', '<='):
+            hi = np.searchsorted(values, value, side='left' if op == '<' else 'right')
+        elif op in ('==', '!='):
+            lo, hi = np.searchsorted(values, value, side='left'), np.searchsorted(values, value, side='right')
+        if op == '!=':
+            return np.concatenate([self.order[:lo], self.order[hi:self.valid]])
+        return self.order[lo:hi]
+
+
+class RowTable:
+    # Columnar copy of computed rows with a sorted index per numeric field and a hash index per
+    # text field (status, trend flags), built once and queried many times
+    def __init__(self, rows):
+        self.tickers = np.array(list(rows), dtype=object)
+        self.n = len(self.tickers)
+        self.numeric = {}
+        self.text = {'ticker': self.tickers}
+        keys = list(dict.fromkeys(key for row in rows.values() for key in row))
+        for key in keys:
+            values = [row.get(key) for row in rows.values()]
+            if key in TEXT_FIELDS or any(isinstance(v, str) for v in values):
+                self.text[key] = np.array(['' if v is None else str(v).upper() for v in values], dtype=object)
+            else:
+                self.numeric[key] = np.array([np.nan if v is None else v for v in values], dtype=float)
+        if 'current_volume' in self.numeric and 'avg_volume_20d' in self.numeric:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self.numeric['vol_ratio'] = self.numeric['current_volume'] / self.numeric['avg_volume_20d']
+
+        self.names = {}
+        for key in list(self.numeric) + list(self.text):
+            self.names[key.upper().replace('/', '')] = key
+        for alias, key in ALIASES.items():
+            if key in self.numeric or key in self.text:
+                self.names[alias] = key
+
+        self.indexes = {key: SortedIndex(values) for key, values in self.numeric.items()}
+        self.groups = {}
+        for key, values in self.text.items():
+            unique, inverse, counts = np.unique(values.astype(str), return_inverse=True, return_counts=True)
+            positions = np.split(np.argsort(inverse, kind='stable'), np.cumsum(counts)[:-1])
+            self.groups[key] = dict(zip(unique.tolist(), positions))
+
+    def field(self, name):
+        key = self.names.get(name.upper().replace('/', ''))
+        if key is None:
+            raise ValueError(f"UNKNOWN FIELD: {name}")
+        return key
+
+    def query(self, text):
+        # Tickers matching e.g. "status == CLEAR and E > 21 order by vol_ratio desc limit 20"
+        where, order, descending, limit = parse(text)
+        mask = self.evaluate(where) if where is not None else np.ones(self.n, dtype=bool)
+        if order is not None:
+            key = self.field(order)
+            if key in self.indexes:
+                index = self.indexes[key]
+                ranked = index.order[:index.valid]
+                ranked = np.concatenate([ranked[::-1] if descending else ranked, index.order[index.valid:]])
+            else:
+                ranked = np.argsort(self.text[key].astype(str), kind='stable')
+                ranked = ranked[::-1] if descending else ranked
+            positions = ranked[mask[ranked]]
+        else:
+            positions = np.nonzero(mask)[0]
+        if limit is not None:
+            positions = positions[:limit]
+        return self.tickers[positions].tolist()
+
+    def evaluate(self, node):
+        if isinstance(node, ast.BoolOp):
+            masks = [self.evaluate(value) for value in node.values]
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return combine.reduce(masks)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return ~self.evaluate(node.operand)
+        if isinstance(node, ast.Compare):
+            # Chains like 1 < vol_ratio < 3 are the AND of each pair
+            mask = np.ones(self.n, dtype=bool)
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                mask &= self.compare(left, op, right)
+                left = right
+            return mask
+        raise ValueError(f"UNSUPPORTED EXPRESSION: {ast.unparse(node)}")
+
+    def compare(self, left, op, right):
+        if isinstance(op, (ast.In, ast.NotIn)):
+            if not isinstance(right, (ast.Tuple, ast.List, ast.Set)):
+                raise ValueError(f"EXPECTED A LIST AFTER IN: {ast.unparse(right)}")
+            mask = np.logical_or.reduce([self.compare(left, ast.Eq(), item) for item in right.elts] or
+                                        [np.zeros(self.n, dtype=bool)])
+            return ~mask if isinstance(op, ast.NotIn) else mask
+        if type(op) not in OPERATORS:
+            raise ValueError(f"UNSUPPORTED OPERATOR: {type(op).__name__}")
+        symbol = OPERATORS[type(op)]
+        if not self.is_field(left):
+            if not self.is_field(right):
+                raise ValueError(f"NO FIELD IN COMPARISON: {ast.unparse(left)} {symbol} {ast.unparse(right)}")
+            left, right, symbol = right, left, FLIPPED[symbol]
+        key = self.field(left.id)
+        value = literal(right)
+        mask = np.zeros(self.n, dtype=bool)
+        if key in self.indexes:
+            if not isinstance(value, (int, float)):
+                raise ValueError(f"{left.id} IS NUMERIC, GOT {value!r}")
+            mask[self.indexes[key].select(symbol, float(value))] = True
+            return mask
+        if symbol not in ('==', '!='):
+            raise ValueError(f"{left.id} CAN ONLY BE COMPARED WITH == OR !=")
+        mask[self.groups[key].get(str(value).upper(), [])] = True
+        if symbol == '!=':
+            mask = ~mask
+        return mask
+
+    def is_field(self, node):
+        return isinstance(node, ast.Name) and node.id.upper().replace('/', '') in self.names
+
+
+def literal(node):
+    # Numbers and strings; a bare word that is not a field is taken as text, as in status == CLEAR
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+        return -node.operand.value
+    raise ValueError(f"EXPECTED A VALUE: {ast.unparse(node)}")
+
+
+def parse(text):
+    # (where AST or None, order field or None, descending, limit or None)
+    match = CLAUSES.match(SLASH.sub('', text.strip()))
+    where = match.group('where').strip()
+    tree = None
+    if where:
+        try:
+            tree = ast.parse(KEYWORDS.sub(lambda m: m.group(1).lower(), where), mode='eval').body
+        except SyntaxError:
+            raise ValueError(f"CANNOT PARSE FILTER: {where}") from None
+    descending = (match.group('direction') or '').lower() == 'desc'
+    limit = int(match.group('limit')) if match.group('limit') else None
+    return tree, match.group('order'), descending, limit
+
+
+def filter_rows(rows, text, table=None):
+    # The rows matching a query, in its order. Building the RowTable costs more than one linear scan,
+    # so callers filtering the same rows repeatedly pass the `table` they built over them
+    if not text or not text.strip() or not rows:
+        return rows
+    return {ticker: rows[ticker] for ticker in (table or RowTable(rows)).query(text)}
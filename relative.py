@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+# Relative strength lookbacks in trading days, the symbols it is measured against and the window
+# of daily returns the correlations are computed over
+LOOKBACKS = (('1M', 21), ('3M', 63), ('6M', 126), ('1Y', 252))
+BENCHMARKS = ('SPY', 'QQQ')
+CORRELATION_WINDOW = 63
+MIN_PERIODS = 20  # days both symbols of a pair must have traded for a correlation
+
+
+def align_closes(frames, symbols):
+    # Days x symbols close matrix on the union of the symbols' trading days, each close carried
+    # forward over days its symbol did not trade; NaN before a symbol's first bar
+    closes = pd.concat([frames[symbol]['Close'] for symbol in symbols], axis=1).sort_index()
+    return closes.ffill().to_numpy(dtype=float)
+
+
+def relative_strength(close, benchmark, lookbacks=LOOKBACKS):
+    # Each column's return over each lookback relative to the benchmark's, as (n, lookbacks):
+    # 0.05 means it did 5% better than the benchmark. NaN where the history is too short
+    days = np.array([n for _, n in lookbacks])
+    valid = days < len(close)
+    rows = len(close) - 1 - np.where(valid, days, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        own = close[-1] / close[rows]  # (lookbacks, n)
+        market = benchmark[-1] / benchmark[rows]
+        strength = own / market[:, None] - 1
+    strength[~valid] = np.nan
+    return strength.T
+
+
+def correlation_matrix(close, window=CORRELATION_WINDOW, min_periods=MIN_PERIODS):
+    # Pearson correlations of daily log returns over the last `window` days between every pair of
+    # columns, each pair over the days both have returns. The pairwise sums come out of a few
+    # matrix products over the masked returns instead of a loop over the pairs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(np.log(close[-window - 1:]), axis=0)
+    valid = ~np.isnan(returns)
+    x = np.where(valid, returns, 0.0)
+    mask = valid.astype(float)
+    n = mask.T @ mask  # days both columns have returns
+    sx = x.T @ mask  # [i, j]: sum of column i's returns over those days
+    sxx = (x * x).T @ mask
+    sxy = x.T @ x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = n * sxy - sx * sx.T
+        var = (n * sxx - sx * sx) * (n * sxx.T - sx.T * sx.T)
+        corr = cov / np.sqrt(var)
+    corr[n < min_periods] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+
+def compute_relative(frames, tickers, benchmarks=BENCHMARKS, lookbacks=LOOKBACKS, window=CORRELATION_WINDOW):
+    # Relative strength of each ticker against each benchmark and the correlation matrix across the
+    # tickers, from their daily bars. Returns the tickers with bars, {benchmark: (n, lookbacks)}
+    # and the (n, n) correlations
+    tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker in frames]
+    benchmarks = [symbol for symbol in benchmarks if symbol in frames]
+    if not tickers:
+        return [], {}, np.empty((0, 0))
+    close = align_closes(frames, tickers + benchmarks)
+    n = len(tickers)
+    strength = {symbol: relative_strength(close[:, :n], close[:, n + j], lookbacks)
+                for j, symbol in enumerate(benchmarks)}
+    return tickers, strength, correlation_matrix(close[:, :n], window)
@@ -0,0 +1,188 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from bar_store import ADJUSTMENT_TOLERANCE
+from indicators import VWAP_ANCHORS, compute_indicators
+from pipeline import make_rows
+from storage import replacing
+
+# A year of trading days plus a margin; the app looks at the last 365 calendar days
+CAPACITY = 260
+LOOKBACK_DAYS = 365
+
+
+class RingBarStore:
+    # Daily closes and volumes for a whole universe in shared 2-D blocks, one row per symbol used as
+    # a fixed-length ring of its most recent `capacity` bars: float32 closes, int64 volumes and int32
+    # day numbers, 16 bytes a bar, so 6,000 symbols take about 25 MB. A new day's bar overwrites the
+    # oldest slot in place instead of rebuilding anything
+    def __init__(self, capacity=CAPACITY, rows=1024):
+        self.capacity = capacity
+        self.symbols = []
+        self.rows = {}
+        self.day = np.zeros((rows, capacity), dtype=np.int32)
+        self.close = np.full((rows, capacity), np.nan, dtype=np.float32)
+        self.volume = np.zeros((rows, capacity), dtype=np.int64)
+        self.head = np.zeros(rows, dtype=np.int64)  # slot the next bar goes into
+        self.count = np.zeros(rows, dtype=np.int64)
+
+    def __contains__(self, symbol):
+        return symbol in self.rows and self.count[self.rows[symbol]] > 0
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.day, self.close, self.volume, self.head, self.count))
+
+    def _row(self, symbol):
+        row = self.rows.get(symbol)
+        if row is not None:
+            return row
+        row = len(self.symbols)
+        if row == len(self.head):
+            grow = max(len(self.head), 1)
+            self.day = np.concatenate([self.day, np.zeros((grow, self.capacity), dtype=np.int32)])
+            self.close = np.concatenate([self.close, np.full((grow, self.capacity), np.nan, dtype=np.float32)])
+            self.volume = np.concatenate([self.volume, np.zeros((grow, self.capacity), dtype=np.int64)])
+            self.head = np.concatenate([self.head, np.zeros(grow, dtype=np.int64)])
+            self.count = np.concatenate([self.count, np.zeros(grow, dtype=np.int64)])
+        self.symbols.append(symbol)
+        self.rows[symbol] = row
+        return row
+
+    def _push(self, row, day, close, volume):
+        # Same day as the newest bar replaces it (a session captured before the close), a later day
+        # takes the oldest slot
+        last = (self.head[row] - 1) % self.capacity
+        if self.count[row] and self.day[row, last] == day:
+            slot = last
+        else:
+            slot = self.head[row]
+            self.head[row] = (slot + 1) % self.capacity
+            self.count[row] = min(self.count[row] + 1, self.capacity)
+        self.day[row, slot] = day
+        self.close[row, slot] = close
+        self.volume[row, slot] = 0 if np.isnan(volume) else volume
+
+    def load(self, symbol, frame):
+        # Replaces whatever is held for the symbol with the newest `capacity` bars of `frame`
+        frame = frame[frame['Close'].notna()].iloc[-self.capacity:]
+        row = self._row(symbol)
+        k = len(frame)
+        self.day[row, :k] = frame.index.values.astype('datetime64[D]').astype(np.int64)
+        self.close[row, :k] = frame['Close'].to_numpy(dtype=np.float64)
+        self.close[row, k:] = np.nan
+        self.volume[row, :k] = np.nan_to_num(frame['Volume'].to_numpy(dtype=np.float64))
+        self.head[row] = k % self.capacity
+        self.count[row] = k
+
+    def last_day(self, symbol, back=0):
+        # Date of the newest bar, or of the one `back` bars before it
+        row = self.rows[symbol]
+        back = min(back, self.count[row] - 1)
+        return pd.Timestamp(np.datetime64(int(self.day[row, (self.head[row] - 1 - back) % self.capacity]), 'D'))
+
+    def update(self, symbol, frame):
+        # Folds in daily bars in place. Returns False, changing nothing, when bars both sides have
+        # (other than the newest stored one, which may have been mid-session) no longer agree, as
+        # after a split or dividend adjustment; the symbol then needs a full load
+        frame = frame[frame['Close'].notna()]
+        days = frame.index.values.astype('datetime64[D]').astype(np.int64)
+        closes = frame['Close'].to_numpy(dtype=np.float64)
+        volumes = frame['Volume'].to_numpy(dtype=np.float64)
+        row = self._row(symbol)
+        if self.count[row]:
+            held = self._ordered(row)
+            shared, mine, theirs = np.intersect1d(held[0][:-1], days, return_indices=True)
+            if shared.size and not np.allclose(held[1][mine], closes[theirs].astype(np.float32),
+                                               rtol=ADJUSTMENT_TOLERANCE, atol=0):
+                return False
+            newest = held[0][-1]
+            keep = days >= newest
+            days, closes, volumes = days[keep], closes[keep], volumes[keep]
+        for day, close, volume in zip(days[-self.capacity:], closes[-self.capacity:], volumes[-self.capacity:]):
+            self._push(row, day, close, volume)
+        return True
+
+    def _ordered(self, row):
+        slots = (self.head[row] - self.count[row] + np.arange(self.count[row])) % self.capacity
+        return self.day[row, slots], self.close[row, slots]
+
+    def window(self, symbols, since=None):
+        # Right-aligned (symbols x capacity) float64 close and volume matrices for the indicator
+        # engine, NaN where a row has no bar or the bar is older than `since`, plus the datetime64
+        # day of every column
+        rows = np.array([self.rows[symbol] for symbol in symbols], dtype=np.int64)
+        order = (self.head[rows, None] + np.arange(self.capacity)) % self.capacity
+        held = np.arange(self.capacity) >= self.capacity - self.count[rows, None]
+        day = self.day[rows[:, None], order]
+        if since is not None:
+            held &= day >= np.datetime64(since, 'D').astype(np.int64)
+        close = np.where(held, self.close[rows[:, None], order].astype(np.float64), np.nan)
+        volume = np.where(held, self.volume[rows[:, None], order], np.nan)
+        return close, volume, np.where(held, day, -1).astype('datetime64[D]'), held
+
+    def save(self, path):
+        n = len(self.symbols)
+        with replacing(path) as tmp_path, open(tmp_path, 'wb') as f:
+            np.savez(f, symbols=np.array(self.symbols, dtype=str), day=self.day[:n], close=self.close[:n],
+                     volume=self.volume[:n], head=self.head[:n], count=self.count[:n])
+
+    @classmethod
+    def open(cls, path, capacity=CAPACITY):
+        if not os.path.exists(path):
+            return cls(capacity)
+        with np.load(path) as data:
+            store = cls(data['close'].shape[1], rows=0)
+            store.symbols = data['symbols'].tolist()
+            store.rows = {symbol: i for i, symbol in enumerate(store.symbols)}
+            for name in ('day', 'close', 'volume', 'head', 'count'):
+                setattr(store, name, data[name])
+        return store
+
+
+def anchor_columns(day, held, year_start, earnings_dates):
+    # Column of each VWAP anchor on the right-aligned window, -1 where there is none, the same
+    # positions anchor_indices finds on the DataFrames the app downloads
+    n, length = day.shape
+    columns = np.arange(length)
+    anchors = {name: np.full(n, -1, dtype=np.int64) for name in VWAP_ANCHORS}
+
+    def first(mask):
+        return np.where(mask.any(axis=1), mask.argmax(axis=1), -1)
+
+    anchors['YearStart'] = first(held & (day >= np.datetime64(year_start, 'D')))
+    last = np.where(held, columns, -1).max(axis=1)
+    any_held = last >= 0
+    last_day = day[np.arange(n), np.clip(last, 0, None)].astype('datetime64[ns]')
+    for i, earnings_date in enumerate(earnings_dates):
+        if earnings_date is not None and any_held[i] and np.datetime64(earnings_date, 'ns') <= last_day[i]:
+            anchors['Earnings'][i] = first(held[i:i + 1] & (day[i:i + 1] >= np.datetime64(earnings_date, 'ns')))[0]
+    return anchors
+
+
+def compute_rows(store, symbols, fundamentals, now=None):
+    # Table rows straight from the ring: the newest bar stands in for the latest price and volume,
+    # which is what a screen run after the close wants
+    symbols = [symbol for symbol in symbols if symbol in store and symbol in fundamentals]
+    if not symbols:
+        return {}
+    now = now or datetime.now()
+    close, volume, day, held = store.window(symbols, since=now - timedelta(days=LOOKBACK_DAYS))
+    keep = held.any(axis=1)
+    symbols = [symbol for symbol, k in zip(symbols, keep) if k]
+    close, volume, day, held = close[keep], volume[keep], day[keep], held[keep]
+
+    earnings_dates = [fundamentals[symbol]['last_earnings_date'] for symbol in symbols]
+    anchors = anchor_columns(day, held, datetime(now.year, 1, 1), earnings_dates)
+    # The recent high and low are only looked for in the window, like nanargmax on the download
+    for name, pick in (('RecentHigh', np.nanargmax), ('RecentLow', np.nanargmin)):
+        anchors[name] = pick(close, axis=1)
+    ind = compute_indicators(close, volume, anchors)
+    return make_rows(symbols, close[:, -1], volume[:, -1], ind, anchors['Earnings'] >= 0,
+                     {symbol: fundamentals[symbol] for symbol in symbols})
@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import config
+from storage import read_frame, write_frame
+
+
+def read_universe(path):
+    # One or more symbols per line, separated by whitespace or commas; '#' starts a comment
+    symbols = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0]
+            symbols.extend(s.strip().upper() for s in line.replace(',', ' ').split() if s.strip())
+    return list(dict.fromkeys(symbols))
+
+
+def init_worker(rate_limit):
+    # Each process gets its own limiter, so split the upstream budget between them. Workers would
+    # overwrite each other's metrics file, so they only log their timings. The deadlines are a
+    # latency budget for the interactive page; a headless screen waits for every fetch instead of
+    # degrading rows to stale or empty fallbacks
+    config.RATE_LIMIT = rate_limit
+    config.METRICS_PATH = None
+    config.REFRESH_BUDGET = 0
+    config.DEADLINE_DAILY = 0
+    config.DEADLINE_INTRADAY = 0
+    config.DEADLINE_EARNINGS = 0
+    config.DEADLINE_FUNDAMENTALS = 0
+
+
+def screen_chunk(symbols):
+    # Returns the rows, the per-symbol errors and whether the chunk completed. A chunk that failed
+    # as a whole (an outage, a rate-limit burst), returned no rows at all or has any row with late
+    # columns is not complete, so it is not checkpointed and a resumed run tries it again.
+    # Imported here so the parent process never loads yfinance or opens provider state before forking
+    from instrumentation import finish_run, start_run
+    from pipeline import get_stock_data_batch
+    run = start_run('screen_chunk')
+    try:
+        rows, errors = get_stock_data_batch(symbols)
+    except Exception as e:
+        rows, errors = {}, {symbol: e for symbol in symbols}
+    finish_run(run)
+    frame = pd.DataFrame.from_dict(rows, orient='index')
+    frame.index.name = 'ticker'
+    failed = pd.DataFrame({'ticker': list(errors), 'error': [str(e) for e in errors.values()]})
+    return frame, failed, bool(rows) and not any(row.get('late') for row in rows.values())
+
+
+def chunk_base(checkpoint_dir, i):
+    return os.path.join(checkpoint_dir, f'chunk-{i:05d}')
+
+
+def check_manifest(checkpoint_dir, universe, chunk_size):
+    # Checkpoints are only reusable for the same universe split the same way
+    digest = hashlib.sha1('\n'.join(universe).encode()).hexdigest()
+    manifest = {'universe_sha1': digest, 'chunk_size': chunk_size}
+    path = os.path.join(checkpoint_dir, 'manifest.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            if json.load(f) != manifest:
+                raise SystemExit(f"{checkpoint_dir} holds checkpoints for a different universe or chunk size")
+    else:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(manifest, f)
+
+
+def run(universe, output, fmt='csv', workers=None, chunk_size=200, checkpoint_dir=None):
+    workers = workers or os.cpu_count() or 1
+    checkpoint_dir = checkpoint_dir or output + '.parts'
+    check_manifest(checkpoint_dir, universe, chunk_size)
+
+    chunks = [universe[i:i + chunk_size] for i in range(0, len(universe), chunk_size)]
+    todo = [i for i in range(len(chunks)) if read_frame(chunk_base(checkpoint_dir, i)) is None]
+    print(f"{len(universe)} SYMBOLS IN {len(chunks)} CHUNKS, {len(chunks) - len(todo)} ALREADY DONE", file=sys.stderr)
+
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(config.RATE_LIMIT / workers,)) as executor:
+        futures = {executor.submit(screen_chunk, chunks[i]): i for i in todo}
+        retry = []
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            frame, failed, complete = future.result()
+            # Errors first: the chunk file is the completion marker, and is left out for a chunk
+            # that did not complete so the errors are reported but the chunk stays to do
+            write_frame(failed.set_index('ticker'), chunk_base(checkpoint_dir, i) + '.errors')
+            if complete:
+                write_frame(frame, chunk_base(checkpoint_dir, i))
+            else:
+                retry.append(i)
+            print(f"[{done}/{len(todo)}] CHUNK {i}: {len(frame)} ROWS, {len(failed)} ERRORS"
+                  f"{'' if complete else ', FAILED'}, {time.monotonic() - started:.0f}s", file=sys.stderr)
+    if retry:
+        print(f"{len(retry)} CHUNKS FAILED AND ARE NOT CHECKPOINTED; RUN AGAIN TO RETRY THEM", file=sys.stderr)
+
+    frames = [read_frame(chunk_base(checkpoint_dir, i)) for i in range(len(chunks))]
+    errors = [read_frame(chunk_base(checkpoint_dir, i) + '.errors') for i in range(len(chunks))]
+    frames = [frame for frame in frames if frame is not None]
+    errors = [error for error in errors if error is not None]
+    result = pd.concat(frames) if frames else pd.DataFrame()
+    failed = pd.concat(errors) if errors else pd.DataFrame()
+    write_output(result, failed, output, fmt)
+    return result
+
+
+def run_in_memory(universe, output, fmt='csv', ring_path=None, chunk_size=200):
+    # Single-process screen over a RingBarStore kept on disk between runs: symbols already held
+    # only download the bars since their last one and are updated in place, the rest (and any
+    # whose history was adjusted since) get a full year
+    from fetching import call_with_retry, fetch_concurrently
+    from fundamentals_store import get_fundamentals, prime_quotes
+    from instrumentation import finish_run, start_run
+    from providers import get_provider
+    from ring_store import LOOKBACK_DAYS, RingBarStore, compute_rows
+
+    ring_path = ring_path or os.path.join(config.DATA_DIR, 'ring.npz')
+    store = RingBarStore.open(ring_path)
+    provider = get_provider()
+    run = start_run('screen_in_memory')
+    started = time.monotonic()
+    end = datetime.now()
+    batches = lambda symbols: [symbols[i:i + chunk_size] for i in range(0, len(symbols), chunk_size)]
+
+    full = [symbol for symbol in universe if symbol not in store]
+    for batch in batches([symbol for symbol in universe if symbol in store]):
+        # From the second-to-last bar, so a complete bar is compared for split/dividend adjustments
+        since = min(store.last_day(symbol, back=1) for symbol in batch)
+        frames = call_with_retry(provider.history, batch, since, end)
+        for symbol in batch:
+            if symbol in frames and not store.update(symbol, frames[symbol]):
+                full.append(symbol)
+    for batch in batches(full):
+        frames = call_with_retry(provider.history, batch, end - timedelta(days=LOOKBACK_DAYS), end)
+        for symbol, frame in frames.items():
+            store.load(symbol, frame)
+    store.save(ring_path)
+    print(f"{len(store)} SYMBOLS IN {store.nbytes / 2 ** 20:.1f} MB, {len(full)} LOADED IN FULL, "
+          f"{time.monotonic() - started:.0f}s", file=sys.stderr)
+
+    errors = {symbol: ValueError("NO PRICE DATA RETURNED") for symbol in universe if symbol not in store}
+    prime_quotes([symbol for symbol in universe if symbol in store], provider)
+    fundamentals = {}
+    for symbol, result, error in fetch_concurrently(lambda s: get_fundamentals(s, provider),
+                                                    [symbol for symbol in universe if symbol in store]):
+        if error is not None:
+            errors[symbol] = error
+        else:
+            fundamentals[symbol] = result
+    rows = compute_rows(store, universe, fundamentals)
+    finish_run(run)
+
+    result = pd.DataFrame.from_dict(rows, orient='index')
+    result.index.name = 'ticker'
+    failed = pd.DataFrame({'ticker': list(errors), 'error': [str(e) for e in errors.values()]}).set_index('ticker')
+    write_output(result, failed, output, fmt)
+    return result
+
+
+def write_output(result, failed, output, fmt):
+    if fmt == 'parquet':
+        result.to_parquet(output)
+    else:
+        result.to_csv(output)
+    message = f"WROTE {len(result)} ROWS TO {output}"
+    if not failed.empty:
+        failed.to_csv(output + '.errors.csv')
+        message += f", {len(failed)} ERRORS TO {output}.errors.csv"
+    print(message, file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Skyhook status screen over a universe file")
+    parser.add_argument('universe', help="file with one or more symbols per line")
+    parser.add_argument('-o', '--output', required=True, help="CSV or Parquet file to write")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=None,
+                        help="output format (default: from the output extension)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=200, help="symbols per batch download and checkpoint")
+    parser.add_argument('--checkpoint-dir', default=None,
+                        help="where finished chunks are kept for resuming (default: OUTPUT.parts)")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="screen in one process over a compact bar store updated in place between runs")
+    parser.add_argument('--ring', default=None, help="bar store file for --in-memory (default: DATA_DIR/ring.npz)")
+    args = parser.parse_args(argv)
+    fmt = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+    if args.in_memory:
+        run_in_memory(read_universe(args.universe), args.output, fmt, args.ring, args.chunk_size)
+    else:
+        run(read_universe(args.universe), args.output, fmt, args.workers, args.chunk_size, args.checkpoint_dir)
+
+
+if __name__ == "__main__":
+    main()
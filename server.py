@@ -0,0 +1,196 @@
+import argparse
+import hashlib
+import json
+import logging
+import math
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import config
+import market_calendar
+from instrumentation import configure_logging, finish_run, start_run
+from pipeline import REGIME_FIELDS, get_stock_data_batch, get_vix_data, regime_age
+from prefetch import fresh_for, get_cache, start_prefetcher
+from query import filter_rows
+
+logger = logging.getLogger('skyhook.server')
+
+# Upper bound on how long clients may cache a response, whatever the market calendar says
+MAX_AGE = 3600
+
+
+class BadRequest(Exception):
+    pass
+
+
+def plain(value):
+    # JSON-safe scalars: numpy numbers as Python ones, NaN as null
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def parse_tickers(query):
+    # ?tickers=AAPL,MSFT or ?tickers=AAPL+MSFT, repeatable
+    tickers = [t.strip().upper() for value in query.get('tickers', []) for t in value.replace(',', ' ').split()]
+    if not tickers:
+        raise BadRequest("NO TICKERS GIVEN, E.G. /rows?tickers=AAPL,MSFT")
+    return list(dict.fromkeys(tickers))
+
+
+def get_rows(tickers):
+    # Rows still fresh in the shared cache are reused; the rest are fetched and cached for the
+    # next poll. Returns the rows in the caller's order, the errors and when the oldest row was fetched
+    cached, missing, updated = get_cache().lookup(tickers)
+    errors = {}
+    if missing:
+        run = start_run('http')
+        try:
+            fetched, errors = get_stock_data_batch(missing)
+        except Exception as e:
+            fetched, errors = {}, {ticker: e for ticker in missing}
+        finish_run(run)
+        now = market_calendar.now()
+        get_cache().update(fetched, now)
+        cached.update(fetched)
+        if fetched:
+            updated = now if updated is None else min(updated, now)
+    return {t: cached[t] for t in tickers if t in cached}, errors, updated
+
+
+def rows_response(query, fmt):
+    tickers = parse_tickers(query)
+    rows, errors, updated = get_rows(tickers)
+    try:
+        rows = filter_rows(rows, query.get('filter', [''])[0])
+    except ValueError as e:
+        raise BadRequest(f"INVALID FILTER: {str(e)}")
+    # Errors and rows degraded by a missed deadline are fixed by the next refresh, so they are
+    # not cached
+    degraded = errors or any(row.get('late') for row in rows.values())
+    max_age = fresh_for(updated) if updated is not None and not degraded else 0
+    if fmt == 'csv':
+        frame = pd.DataFrame.from_dict(rows, orient='index')
+        frame.index.name = 'ticker'
+        return frame.to_csv(), max_age
+    body = {
+        'updated': updated.isoformat() if updated is not None else None,
+        'rows': {ticker: {key: plain(value) for key, value in row.items()} for ticker, row in rows.items()},
+        'errors': {ticker: str(e) for ticker, e in errors.items()},
+    }
+    return json.dumps(body), max_age
+
+
+def regime_response(query, fmt):
+    values = dict(zip(REGIME_FIELDS, (plain(value) for value in get_vix_data())))
+    # Recomputed every REGIME_TTL seconds during the session. After the close nothing moves until
+    # the next open, but only once values computed after the close are served: until they are
+    # recomputed, clients revalidate every time
+    age = regime_age() or 0.0
+    now = market_calendar.now()
+    if market_calendar.is_open(now):
+        max_age = config.REGIME_TTL - age
+    else:
+        max_age = fresh_for(now - timedelta(seconds=age), now)
+    if fmt == 'csv':
+        return pd.DataFrame([values]).to_csv(index=False), max_age
+    return json.dumps(values), max_age
+
+
+ROUTES = {
+    '/rows': rows_response,
+    '/regime': regime_response,
+}
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+class Handler(BaseHTTPRequestHandler):
+    # GET /rows?tickers=AAPL,MSFT[&filter=...][&format=csv] and GET /regime[?format=csv]. Every
+    # response carries an ETag of its body and a max-age for as long as the data stays fresh, so a
+    # client polling with If-None-Match gets an empty 304 until something changes
+    server_version = 'Skyhook'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/health':
+            return self.send_body(200, 'text/plain', b'ok\n', 0)
+        route = ROUTES.get(url.path.rstrip('/'))
+        if route is None:
+            return self.send_error_body(404, f"UNKNOWN PATH: {url.path}")
+        fmt = query.get('format', [None])[0] or ('csv' if 'text/csv' in self.headers.get('Accept', '') else 'json')
+        if fmt not in ('json', 'csv'):
+            return self.send_error_body(400, f"UNKNOWN FORMAT: {fmt}")
+        try:
+            text, max_age = route(query, fmt)
+        except BadRequest as e:
+            return self.send_error_body(400, str(e))
+        except Exception as e:
+            logger.warning(json.dumps({'event': 'http_error', 'path': self.path, 'error': str(e)}))
+            return self.send_error_body(502, f"ERROR FETCHING DATA: {str(e)}")
+        body = text.encode()
+        content_type = 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/json'
+        self.send_body(200, content_type, body, max_age)
+
+    def send_body(self, status, content_type, body, max_age):
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        if status == 200 and etag_matches(self.headers.get('If-None-Match'), etag):
+            status, body = 304, b''
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        max_age = int(max(0, min(max_age, MAX_AGE)))
+        self.send_header('Cache-Control', f'max-age={max_age}' if max_age else 'max-age=0, must-revalidate')
+        self.send_header('Vary', 'Accept')
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_body(self, status, message):
+        body = json.dumps({'error': message}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(json.dumps({'event': 'http_request', 'client': self.client_address[0],
+                                 'request': format % args}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Skyhook rows and the market regime as JSON or CSV")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    if config.PREFETCH:
+        start_prefetcher()
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    print(f"SERVING ON http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+import config
+import market_calendar
+from storage import find_frame, read_frame, replacing, write_frame
+
+logger = logging.getLogger('skyhook.snapshot')
+
+# The last regime header and table persisted to disk, so a fresh process or session can paint
+# them straight away, marked stale, while the current values are fetched
+_lock = threading.Lock()
+_table = None  # (tickers, rows, saved at), read from disk at most once per process
+
+
+def regime_path():
+    return os.path.join(config.SNAPSHOT_DIR, 'regime.json')
+
+
+def table_base():
+    return os.path.join(config.SNAPSHOT_DIR, 'table')
+
+
+def save_regime(values):
+    # A snapshot that cannot be written only costs the next cold start its stale paint
+    try:
+        with replacing(regime_path()) as tmp_path, open(tmp_path, 'w') as f:
+            json.dump({'saved_at': market_calendar.now().isoformat(), 'values': list(values)}, f, default=float)
+    except (OSError, ValueError, TypeError) as e:
+        logger.warning(json.dumps({'event': 'snapshot_failed', 'what': 'regime', 'error': str(e)}))
+
+
+def load_regime():
+    # (values, saved at) or None
+    try:
+        with open(regime_path()) as f:
+            snapshot = json.load(f)
+        return tuple(snapshot['values']), datetime.fromisoformat(snapshot['saved_at'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_table(rows):
+    global _table
+    if not rows:
+        return
+    saved_at = market_calendar.now()
+    with _lock:
+        _table = (list(rows), dict(rows), saved_at)
+    try:
+        write_frame(pd.DataFrame.from_dict(rows, orient='index'), table_base())
+    except Exception as e:
+        logger.warning(json.dumps({'event': 'snapshot_failed', 'what': 'table', 'error': str(e)}))
+
+
+def load_table():
+    # (tickers in table order, rows, saved at) or None
+    global _table
+    with _lock:
+        if _table is not None:
+            return _table
+    path = find_frame(table_base())
+    if path is None:
+        return None
+    try:
+        frame = read_frame(table_base())
+    except Exception:
+        return None
+    frame = frame.astype(object).where(frame.notna(), None)
+    saved_at = datetime.fromtimestamp(os.path.getmtime(path), market_calendar.EXCHANGE_TZ)
+    table = (list(frame.index), frame.to_dict(orient='index'), saved_at)
+    with _lock:
+        _table = _table or table
+        return _table
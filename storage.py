@@ -0,0 +1,48 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+import pandas as pd
+
+FRAME_FORMATS = ('.parquet', '.csv')
+
+def find_frame(base):
+    for ext in FRAME_FORMATS:
+        if os.path.exists(base + ext):
+            return base + ext
+    return None
+
+def read_frame(base):
+    # Reads `base.parquet` or `base.csv`, returning None when neither exists
+    path = find_frame(base)
+    if path is None:
+        return None
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, index_col=0, parse_dates=True)
+
+@contextmanager
+def replacing(path):
+    # Yields a temporary path next to `path` to write to, then replaces `path` with it atomically
+    # so readers never see a half-written file. Each writer gets its own temporary file, so
+    # sessions and background threads writing the same file at once do not trip over each other
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def write_frame(df, base, fmt='.parquet'):
+    path = base + fmt
+    with replacing(path) as tmp_path:
+        if fmt == '.parquet':
+            df.to_parquet(tmp_path)
+        else:
+            df.to_csv(tmp_path)
+    return path
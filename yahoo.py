@@ -0,0 +1,50 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+QUOTE_URL = 'https://query1.finance.yahoo.com/v7/finance/quote'
+QUOTE_BATCH = 200  # symbols per quote request
+
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    # One pooled keep-alive session for every Yahoo request in the process. yfinance keeps its
+    # cookie and crumb on a process-wide singleton bound to the session it was last given, so
+    # handing it this one everywhere negotiates the crumb once and reuses it
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.HTTP_POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+    return _session
+
+
+def quotes(symbols):
+    # Market cap and latest price for many symbols from the bulk quote endpoint, one request per
+    # QUOTE_BATCH symbols, instead of a quoteSummary call per symbol.
+    # Returns {symbol: {'market_cap', 'price'}}; symbols Yahoo does not know are left out
+    from yfinance.data import YfData
+
+    data = YfData(session=get_session())
+    symbols = list(dict.fromkeys(symbols))
+    results = {}
+    for i in range(0, len(symbols), QUOTE_BATCH):
+        batch = symbols[i:i + QUOTE_BATCH]
+        response = data.get_raw_json(QUOTE_URL, params={
+            'symbols': ','.join(batch),
+            'fields': 'marketCap,regularMarketPrice',
+        })
+        for quote in (response.get('quoteResponse') or {}).get('result') or []:
+            if quote.get('symbol') in batch:
+                results[quote['symbol']] = {
+                    'market_cap': quote.get('marketCap'),
+                    'price': quote.get('regularMarketPrice'),
+                }
+    return results